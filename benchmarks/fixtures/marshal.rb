@@ -0,0 +1,30 @@
+# Writes marshal.rvdata2 for benchmarks/roundtrip.py. Covers what RPG Maker VX Ace files
+# hold: objects, shared strings (links), repeated symbols, hashes with a default, floats,
+# bignums, Table style _dump user data, US-ASCII and binary strings.
+# Usage: ruby marshal.rb
+module RPG
+  class EventCommand; def initialize(c, i, p); @code = c; @indent = i; @parameters = p; end; end
+  class Event; attr_accessor :pages; def initialize(id); @id = id; @name = format('EV%03d', id); @x = id; @y = 2; @pages = []; end; end
+  class Event::Page; def initialize(list); @list = list; end; end
+  class Map; attr_accessor :events; def initialize; @display_name = '村'; @events = {}; @scroll = 1.0; @rate = 0.5; @big = 2**40; end; end
+  class BaseItem; class Feature; def initialize(value); @code = 21; @value = value; end; end; end
+end
+class Table; def initialize(data); @data = data; end; def _dump(level); @data; end; def self._load(data); new(data); end; end
+
+phrases = ['こんにちは、元気ですか？', '今日はいい天気ですね。', 'この先に宝箱があるらしい。', 'ありがとう、助かったよ！']
+shared = '共有'
+map = RPG::Map.new
+(1..20).each do |id|
+  event = RPG::Event.new(id)
+  list = [RPG::EventCommand.new(101, 0, ['', 0, 0, 2])]
+  list += phrases.rotate(id).first(3).map { |phrase| RPG::EventCommand.new(401, 0, [phrase]) }
+  list += [RPG::EventCommand.new(401, 0, [shared]), RPG::EventCommand.new(401, 0, [shared]), RPG::EventCommand.new(0, 0, [])]
+  event.pages << RPG::Event::Page.new(list)
+  map.events[id] = event
+end
+defaults = Hash.new(5)
+defaults[:'日本'] = 1.0
+defaults[:a] = 1.0
+features = [RPG::BaseItem::Feature.new(1.0), RPG::BaseItem::Feature.new(0.1), RPG::BaseItem::Feature.new(1e20), RPG::BaseItem::Feature.new(-0.0)]
+data = [map, Table.new("\x01\x02\x00".b), features, defaults, 'ascii'.force_encoding('US-ASCII'), "bin\xff".b, -2**70, nil, true, false]
+File.binwrite('marshal.rvdata2', Marshal.dump(data))
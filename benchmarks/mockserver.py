@@ -0,0 +1,191 @@
+# Local stand-in for the OpenAI chat completions API, for benchmarks without network or cost.
+# Usage: python -m benchmarks.mockserver [--port 8765] [--latency lognormal:0.6,0.4] [--rate429 0.05] ...
+# Then point the tool at it with api="http://127.0.0.1:8765/v1/"
+import argparse, hashlib, json, math, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+JAPANESE = re.compile(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]')
+
+def parseLatency(spec):
+    """
+    Latency distribution as kind:parameters, in seconds.
+    fixed:0.5, uniform:0.2,1.5, normal:0.8,0.2, lognormal:mu,sigma (of the log, so
+    lognormal:-0.5,0.5 has a median of ~0.6s and a long tail).
+    """
+    kind, _, parameters = spec.partition(':')
+    values = [float(value) for value in parameters.split(',') if value]
+    samplers = {
+        'fixed': lambda rng: values[0],
+        'uniform': lambda rng: rng.uniform(values[0], values[1]),
+        'normal': lambda rng: max(0.0, rng.gauss(values[0], values[1])),
+        'lognormal': lambda rng: rng.lognormvariate(values[0], values[1]),
+    }
+    if kind not in samplers:
+        raise ValueError(f'Unknown latency distribution {kind}')
+    return samplers[kind]
+
+def countTokens(text):
+    # Rough cl100k behaviour: one token per Japanese character, one per 4 other characters
+    japanese = len(JAPANESE.findall(text))
+    return japanese + math.ceil((len(text) - japanese) / 4)
+
+class MockConfig:
+    def __init__(self, latency='fixed:0.5', rate429=0.0, rate5xx=0.0, truncate=0.0, mismatch=0.0, seed=1, scale=1.0):
+        self.latency = parseLatency(latency)
+        self.rate429 = rate429
+        self.rate5xx = rate5xx
+        self.truncate = truncate
+        self.mismatch = mismatch
+        self.seed = seed
+        self.scale = scale      # Multiplies every latency, 0 for pure overhead runs
+
+class MockState:
+    """
+    Outcomes are drawn from an RNG seeded by the request body and how many times that body
+    was seen before, so a run gives the same answers whatever order threads send requests
+    in, and a retried request can succeed after an injected failure.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.stats = {'requests': 0, '429': 0, '5xx': 0, 'truncated': 0, 'mismatched': 0, 'promptTokens': 0, 'completionTokens': 0}
+
+    def rng(self, body):
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(digest, 0)
+            self.attempts[digest] = attempt + 1
+            self.stats['requests'] += 1
+        return random.Random(f'{self.config.seed}:{digest}:{attempt}')
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+def translateLines(user, rng, config, state):
+    """
+    Returns [content, finish reason]. Line1..LineN JSON gets a Line for each input key,
+    `<LineN>` tagged batches get the same tags back and anything else gets a single
+    translated string.
+    """
+    keys = re.findall(r'"(Line\d+)"\s*:', user)
+    tagged = len(keys) == 0
+    if tagged:
+        keys = list(dict.fromkeys(re.findall(r'<(Line\d+)>', user)))
+    if not keys:
+        return ['Translated text', 'stop']
+
+    lines = {key: f'Translated {key.lower()} text' for key in keys}
+    if rng.random() < config.mismatch:
+        state.count('mismatched')
+        if len(keys) > 1:
+            lines.pop(keys[-1])
+        else:
+            lines[f'Line{len(keys) + 1}'] = 'Extra line'
+    if tagged:
+        content = '\n'.join(f'`<{key}>{text}</{key}>`' for key, text in lines.items())
+    else:
+        content = json.dumps(lines, indent=4)
+
+    if rng.random() < config.truncate:
+        state.count('truncated')
+        return [content[:max(1, len(content) // 2)], 'length']
+    return [content, 'stop']
+
+def completion(request, rng, config, state):
+    # Body of a successful chat completion for request, with usage counted like the API does
+    messages = request.get('messages', [])
+    content, finishReason = translateLines(str(messages[-1].get('content', '')) if messages else '', rng, config, state)
+    promptTokens = sum(countTokens(str(message.get('content', ''))) for message in messages)
+    completionTokens = countTokens(content)
+    state.count('promptTokens', promptTokens)
+    state.count('completionTokens', completionTokens)
+    return {
+        'id': 'chatcmpl-mock',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': request.get('model', 'mock'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': finishReason}],
+        'usage': {'prompt_tokens': promptTokens, 'completion_tokens': completionTokens, 'total_tokens': promptTokens + completionTokens},
+    }
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            with self.state.lock:
+                return self.reply(200, dict(self.state.stats))
+        self.reply(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self.reply(404, {'error': {'message': 'Not found'}})
+
+        config = self.state.config
+        rng = self.state.rng(body)
+        time.sleep(config.latency(rng) * config.scale)
+
+        # Injected failures
+        roll = rng.random()
+        if roll < config.rate429:
+            self.state.count('429')
+            return self.reply(429, {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}, {'Retry-After': '1'})
+        if roll < config.rate429 + config.rate5xx:
+            self.state.count('5xx')
+            return self.reply(rng.choice([500, 502, 503]), {'error': {'message': 'Server error', 'type': 'server_error'}})
+
+        self.reply(200, completion(json.loads(body), rng, config, self.state))
+
+    def reply(self, code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def startServer(config, port=0):
+    # Runs in a background thread, returns [server, base url]. Port 0 picks a free one.
+    handler = type('Handler', (MockHandler,), {'state': MockState(config)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mockserver', daemon=True).start()
+    return [server, f'http://127.0.0.1:{server.server_address[1]}/v1/']
+
+def addMockArguments(parser):
+    parser.add_argument('--latency', default='lognormal:-0.5,0.5', help='fixed:S, uniform:A,B, normal:MEAN,SD or lognormal:MU,SIGMA (seconds)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every latency by this')
+    parser.add_argument('--rate429', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--rate5xx', type=float, default=0.0, help='Share of requests answered with 500/502/503')
+    parser.add_argument('--truncate', type=float, default=0.0, help='Share of responses cut in half (finish_reason length)')
+    parser.add_argument('--mismatch', type=float, default=0.0, help='Share of responses with a missing or extra line')
+    parser.add_argument('--seed', type=int, default=1)
+
+def configFromArguments(args):
+    return MockConfig(args.latency, args.rate429, args.rate5xx, args.truncate, args.mismatch, args.seed, args.scale)
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI chat completions server')
+    parser.add_argument('--port', type=int, default=8765)
+    addMockArguments(parser)
+    args = parser.parse_args()
+
+    server, url = startServer(configFromArguments(args), args.port)
+    print(f'Mock API on {url} (GET {url}stats for counters)', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
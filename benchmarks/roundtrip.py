@@ -0,0 +1,277 @@
+# Round trip and alignment checks on synthetic files and fixtures. Offline, no API, no mock server.
+# Each case prints what went wrong and the script exits 1 if any case failed.
+# Usage: python -m benchmarks.roundtrip [--cases eushully,splice,marshal,jsonstream,wolfdata] [--seed 1]
+import argparse, importlib, os, random, re, shutil, sys, tempfile
+from benchmarks.mockserver import MockConfig
+from benchmarks.synthetic import mvmzProject, scriptProject, wolfDataProject
+from benchmarks.throughput import ROOT, setEnvironment
+
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+
+def readBytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def sameBytes(name, before, after):
+    # Failure message naming the first byte that differs, [] when the two are identical
+    if before == after:
+        return []
+    index = next((i for i, pair in enumerate(zip(before, after)) if pair[0] != pair[1]), min(len(before), len(after)))
+    return [f'{name}: {len(before)} bytes in, {len(after)} out, first difference at byte {index}']
+
+def offlineEngine(engine, mockConfig):
+    # Engine module answering from the mock's response builder instead of the API
+    from benchmarks.suite import OfflineCompletions
+    from modules.engines import getEngine
+    module = importlib.import_module(getEngine(engine)[3])
+    module.createCompletion = OfflineCompletions(mockConfig)
+    return module
+
+def eushullySkeleton(lines):
+    """
+    Everything but the text: each run of show-text/end-text-line lines becomes one TEXT
+    marker and quoted strings are blanked. Translating must leave this exactly as it was.
+    """
+    skeleton = []
+    for line in lines:
+        if line.startswith(('show-text', 'end-text-line')):
+            if not skeleton or skeleton[-1] != 'TEXT':
+                skeleton.append('TEXT')
+        else:
+            skeleton.append(re.sub(r'"(.*)"', '""', line))
+    return skeleton
+
+def checkEushully(folder, seed):
+    """
+    Translates synthetic eushully scripts at a wide and a narrow width. Every line that
+    isn't text has to come out in the same place, every show-text needs its end-text-line,
+    and a mismatched batch has to leave the script byte for byte as it was.
+    """
+    from modules.batch import runProject
+    failures = []
+    for width, mismatch in [[60, 0.0], [8, 0.0], [60, 1.0]]:
+        project = os.path.join(folder, f'eushully{width}-{mismatch}')
+        filenames = scriptProject(os.path.join(project, 'files'), 'eushully', files=2, blocks=150, seed=seed)
+        module = offlineEngine('eushully', MockConfig(mismatch=mismatch, seed=seed))
+        module.WIDTH = width
+        module.LISTWIDTH = width
+        summary = runProject(project, 'eushully', False, 1)
+        failures += [f'{record["file"]}: {record["error"]}' for record in summary['files'] if record['error'] is not None]
+
+        for filename in filenames:
+            with open(os.path.join(project, 'files', filename), 'r', encoding='utf-8') as f:
+                before = f.readlines()
+            with open(os.path.join(project, 'translated', filename), 'r', encoding='utf-8') as f:
+                after = f.readlines()
+            name = f'{filename} (width {width}, mismatch {mismatch})'
+            if mismatch:
+                if before != after:
+                    failures.append(f'{name}: mismatched batch changed the script')
+                continue
+            if eushullySkeleton(before) != eushullySkeleton(after):
+                failures.append(f'{name}: lines outside the text moved or went missing')
+            if after == before:
+                failures.append(f'{name}: nothing was translated')
+            for index, line in enumerate(after):
+                if line.startswith('show-text') and (index + 1 >= len(after) or not after[index + 1].startswith('end-text-line')):
+                    failures.append(f'{name}: show-text on line {index + 1} has no end-text-line')
+                    break
+    return failures
+
+def spliceInPlace(lines, patches):
+    # What the engines did before spliceLines: slice assignment from the last patch back
+    lines = list(lines)
+    for start, end, replacement in reversed(patches):
+        lines[start:end] = replacement
+    return lines
+
+def randomPatches(rng, lines):
+    """
+    Ordered, non overlapping patches over lines: replacements that grow, shrink, delete
+    (empty) or insert (start == end), touching each other, the first and the last line.
+    """
+    patches = []
+    position = 0
+    while position < len(lines):
+        start = position + rng.choice([0, 0, 1, 3])
+        end = min(len(lines), start + rng.choice([0, 1, 1, 2, 4]))
+        if start > len(lines) or (patches and start == end == patches[-1][1]):
+            break
+        patches.append([start, end, [f'patch {len(patches)}.{index}\n' for index in range(rng.choice([0, 1, 1, 2, 5]))]])
+        position = end if end > start else end + 1
+    return patches
+
+def checkSplice(folder, seed):
+    """
+    spliceLines against slice assignment on the synthetic wolf2, iris and eushully scripts
+    with random patches. Patching every range with its own lines has to give the script
+    back byte for byte.
+    """
+    from modules.splice import spliceLines
+    rng = random.Random(seed)
+    failures = []
+    for kind, encoding in [['wolf2', 'shift_jis'], ['iris', 'shift_jis'], ['eushully', 'utf-8']]:
+        files = os.path.join(folder, kind)
+        for filename in scriptProject(files, kind, files=2, blocks=100, seed=seed):
+            path = os.path.join(files, filename)
+            with open(path, 'r', encoding=encoding, newline='') as f:
+                lines = f.readlines()
+            for attempt in range(50):
+                patches = randomPatches(rng, lines)
+                if spliceLines(lines, patches) != spliceInPlace(lines, patches):
+                    failures.append(f'{kind}/{filename}: patch set {attempt} differs from slice assignment')
+                    break
+            same = [[start, end, lines[start:end]] for start, end, _ in randomPatches(rng, lines)]
+            text = ''.join(spliceLines(lines, same))
+            failures += sameBytes(f'{kind}/{filename} (patched with its own lines)', readBytes(path), text.encode(encoding))
+    return failures
+
+def checkMarshal(folder, seed):
+    """
+    Reads and writes back a file Ruby's Marshal.dump wrote (fixtures/marshal.rb) through
+    the same loadMarshal and dumpMarshal the ACE engine uses, then a second time from the
+    written copy. Both have to match the original byte for byte.
+    """
+    from modules.offload import dumpMarshal, loadMarshal
+    source = os.path.join(FIXTURES, 'marshal.rvdata2')
+    first = os.path.join(folder, 'first.rvdata2')
+    second = os.path.join(folder, 'second.rvdata2')
+    dumpMarshal(loadMarshal(source), first)
+    dumpMarshal(loadMarshal(first), second)
+    original = readBytes(source)
+    return sameBytes('marshal.rvdata2', original, readBytes(first)) + sameBytes('marshal.rvdata2 (second pass)', original, readBytes(second))
+
+def checkJSONStream(folder, seed):
+    """
+    Runs the MV/MZ engine with every code switched off over a synthetic project, so maps
+    and CommonEvents go through streamFile (Scanner to Writer) with nothing to translate.
+    The input is written with dumpJSON first, so in both jsonStyles and with chunks small
+    enough to split every value the output has to be the input byte for byte.
+    """
+    from modules import jsonstream
+    from modules.batch import runProject
+    from modules.offload import dumpJSON, loadJSON
+    module = offlineEngine('mvmz', MockConfig(seed=seed))
+    switches = {name: getattr(module, name) for name in dir(module) if re.fullmatch(r'CODE\d+', name)}
+    environment = {key: os.environ.get(key) for key in ['jsonStyle', 'streamJSON']}
+    chunk = jsonstream.CHUNK
+    failures = []
+    try:
+        for name in switches:
+            setattr(module, name, False)
+        os.environ['streamJSON'] = '0.000001'
+        for style in ['indent', 'compact']:
+            for size in [64, chunk]:
+                os.environ['jsonStyle'] = style
+                jsonstream.CHUNK = size
+                project = os.path.join(folder, f'{style}{size}')
+                files = os.path.join(project, 'files')
+                filenames = mvmzProject(files, maps=5, commonEvents=40, seed=seed, extra=True)
+                for filename in filenames:
+                    dumpJSON(loadJSON(os.path.join(files, filename)), os.path.join(files, filename))
+                summary = runProject(project, 'mvmz', False, 1)
+                failures += [f'{record["file"]}: {record["error"]}' for record in summary['files'] if record['error'] is not None]
+                for filename in filenames:
+                    before = readBytes(os.path.join(files, filename))
+                    after = readBytes(os.path.join(project, 'translated', filename))
+                    failures += sameBytes(f'{filename} ({style}, {size} byte chunks)', before, after)
+    finally:
+        for name, value in switches.items():
+            setattr(module, name, value)
+        for key, value in environment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        jsonstream.CHUNK = chunk
+    return failures
+
+def wolfStrings(data):
+    # Every string wolfdata recorded, in file order
+    strings = []
+    for _, _, container, keys, _ in data['spans']:
+        for key in keys:
+            container = container[key]
+        strings.append(container)
+    return strings
+
+def setWolfStrings(data, strings):
+    for span, value in zip(data['spans'], strings):
+        target = span[2]
+        for key in span[3][:-1]:
+            target = target[key]
+        target[span[3][-1]] = value
+
+def checkWolfData(folder, seed):
+    """
+    Reads and writes synthetic .mps/.dat files with loadWolfData and dumpWolfData. Untouched
+    they have to come back byte for byte. With every string changed and read back, each one
+    has to land where it was, and changing them back has to give the original file again.
+    """
+    from modules.wolfdata import dumpWolfData, loadWolfData
+    files = os.path.join(folder, 'files')
+    failures = []
+    filenames = wolfDataProject(files, maps=3, commonEvents=10, items=20, seed=seed)
+
+    # Copies keep their names, the reader goes by them. Databases need their .project too.
+    for name in ['copy', 'edited']:
+        shutil.copytree(files, os.path.join(folder, name))
+    for filename in filenames:
+        source = os.path.join(files, filename)
+        copy = os.path.join(folder, 'copy', filename)
+        edited = os.path.join(folder, 'edited', filename)
+        original = readBytes(source)
+        data = loadWolfData(source)
+        strings = wolfStrings(data)
+        failures += dumpWolfData(data, copy)
+        failures += sameBytes(filename, original, readBytes(copy))
+
+        setWolfStrings(data, [value + '改' for value in strings])
+        failures += dumpWolfData(data, edited)
+        data = loadWolfData(edited)
+        if wolfStrings(data) != [value + '改' for value in strings]:
+            failures.append(f'{filename}: edited strings read back differently')
+        setWolfStrings(data, strings)
+        failures += dumpWolfData(data, copy)
+        failures += sameBytes(f'{filename} (edited and back)', original, readBytes(copy))
+    return failures
+
+CASES = {
+    'eushully': checkEushully,
+    'splice': checkSplice,
+    'marshal': checkMarshal,
+    'jsonstream': checkJSONStream,
+    'wolfdata': checkWolfData,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that reading and writing files keeps every byte and every line in place')
+    parser.add_argument('--cases', default=','.join(CASES), help='Comma separated case names')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+
+    # Engines read prompt.txt and vocab.txt from the working folder
+    setEnvironment('http://127.0.0.1:9/v1/', 1, 1)
+    workFolder = tempfile.mkdtemp(prefix='translator-roundtrip-')
+    shutil.copy(os.path.join(ROOT, 'prompt.example'), os.path.join(workFolder, 'prompt.txt'))
+    shutil.copy(os.path.join(ROOT, 'vocab.txt'), os.path.join(workFolder, 'vocab.txt'))
+    cwd = os.getcwd()
+    os.chdir(workFolder)
+    failed = False
+    try:
+        for case in cases:
+            folder = os.path.join(workFolder, case)
+            os.makedirs(folder)
+            failures = CASES[case](folder, args.seed)
+            print(f'{case.ljust(12)} {"FAIL" if failures else "ok"}')
+            for failure in failures:
+                print(f'    {failure}')
+            failed = failed or bool(failures)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workFolder, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
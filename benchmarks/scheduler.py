@@ -0,0 +1,146 @@
+# Makespan benchmark for the file scheduler on a synthetic RPG Maker project, in two parts.
+# Model: simulateMakespan over made up page durations. No engine code runs, the numbers
+# only show what the ordering and the shared page pool can buy under ideal conditions.
+# Measured: the real runProject (scheduleFiles, the page pool, submitBounded) on a generated
+# MV project against the mock API, once in the order the files were written and once
+# largest first.
+# Usage: python -m benchmarks.scheduler [--fileThreads 4] [--threads 5] [--model] [mock options]
+import argparse, json, os, random, shutil, sys, tempfile, time
+from benchmarks.mockserver import addMockArguments, configFromArguments, startServer
+from benchmarks.synthetic import page, writeJSON
+from benchmarks.throughput import ROOT, setEnvironment
+from modules.scheduler import simulateMakespan
+
+SEED = 1234
+REQUESTSECONDS = 8.0    # Average time for one translateGPT batch in the model
+
+def syntheticProject(seed=SEED):
+    """
+    Pages for a typical mid-sized MV project. Each page costs a few API batches. The small
+    database files come first, large maps are scattered through the list and CommonEvents
+    is appended last, the worst place for it.
+    """
+    rng = random.Random(seed)
+    page = lambda: REQUESTSECONDS * rng.randint(1, 4)
+
+    files = [
+        ['Actors.json', [page()]],
+        ['Armors.json', [page()]],
+        ['Items.json', [page()]],
+        ['Skills.json', [page()]],
+        ['System.json', [page()]],
+        ['Troops.json', [page() for _ in range(12)]],
+    ]
+    for i in range(1, 81):
+        pageCount = rng.choice([1, 1, 2, 3, 5, 8]) if i % 17 else rng.randint(60, 120)
+        files.append([f'Map{i:03}.json', [page() for _ in range(pageCount)]])
+
+    # The big one ends up last often enough to matter
+    files.append(['CommonEvents.json', [page() for _ in range(400)]])
+    return files
+
+def writeProject(folder, seed=SEED):
+    """
+    Writes an MV files folder with the same skew as syntheticProject: mostly small maps, a
+    few large ones and one CommonEvents several times the size of any map. Returns the
+    file names in the order they were written, CommonEvents last.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for i in range(1, 41):
+        events = rng.choice([1, 1, 2, 3, 5, 8]) if i % 17 else rng.randint(30, 60)
+        mapEvents = [None] + [{'id': j, 'name': f'EV{j:03}', 'note': '', 'pages': [page(rng, 3, 3)]} for j in range(1, events + 1)]
+        filenames.append(writeJSON(folder, f'Map{i:03}.json', {'displayName': '', 'events': mapEvents}))
+    common = [None] + [{'id': j, 'name': f'CE{j:03}', 'list': page(rng, 3, 3)['list']} for j in range(1, 201)]
+    filenames.append(writeJSON(folder, 'CommonEvents.json', common))
+    return filenames
+
+def modelResults(fileThreads, threads):
+    files = syntheticProject()
+    print(f'Model: {len(files)} files, {sum(len(file[1]) for file in files)} pages, {REQUESTSECONDS}s per batch, no engine code run')
+    return [
+        ['listdir order, pool per file', simulateMakespan(files, fileThreads, threads, 'listdir', False)],
+        ['largest first, pool per file', simulateMakespan(files, fileThreads, threads, 'lpt', False)],
+        ['largest first, shared page pool', simulateMakespan(files, fileThreads, threads, 'lpt', True)],
+    ]
+
+def measuredResults(args):
+    server, url = startServer(configFromArguments(args))
+    setEnvironment(url, args.fileThreads, args.threads)
+
+    # Engines read prompt.txt and vocab.txt from the working folder
+    workFolder = tempfile.mkdtemp(prefix='translator-scheduler-')
+    shutil.copy(os.path.join(ROOT, 'prompt.example'), os.path.join(workFolder, 'prompt.txt'))
+    shutil.copy(os.path.join(ROOT, 'vocab.txt'), os.path.join(workFolder, 'vocab.txt'))
+    project = os.path.join(workFolder, 'project')
+    written = writeProject(os.path.join(project, 'files'))
+    cwd = os.getcwd()
+    os.chdir(workFolder)
+
+    from modules import batch, rpgmakermvmz
+    rpgmakermvmz.CODE401 = True
+    if args.batchsize:
+        rpgmakermvmz.BATCHSIZE = args.batchsize
+    scheduleFiles = batch.scheduleFiles
+
+    def timeRun(order):
+        # runProject asks batch.scheduleFiles for the order, everything else is the real path
+        batch.scheduleFiles = order
+        try:
+            start = time.perf_counter()
+            summary = batch.runProject(project, 'mvmz', False, args.fileThreads)
+            seconds = time.perf_counter() - start
+        finally:
+            batch.scheduleFiles = scheduleFiles
+        shutil.rmtree(os.path.join(project, 'translated'), ignore_errors=True)
+        failed = [record['file'] for record in summary['files'] if record['error'] is not None]
+        if summary['error'] is not None or failed:
+            raise RuntimeError(f'Run failed: {summary["error"] or failed}')
+        return seconds
+
+    try:
+        with server.RequestHandlerClass.state.lock:
+            requests = server.RequestHandlerClass.state.stats['requests']
+        results = [['written order, CommonEvents last', timeRun(lambda folder, extension: list(written))]]
+        with server.RequestHandlerClass.state.lock:
+            requests = server.RequestHandlerClass.state.stats['requests'] - requests
+        results.append(['largest first (scheduleFiles)', timeRun(scheduleFiles)])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workFolder, ignore_errors=True)
+        server.shutdown()
+    print(f'Measured: {len(written)} files, {requests} requests per run, latency {args.latency}, shared page pool')
+    return results
+
+def printResults(results, fileThreads, threads):
+    baseline = results[0][1]
+    print(f'fileThreads={fileThreads}, threads={threads}')
+    for name, makespan in results:
+        print(f'  {name.ljust(34)} {makespan:9.1f}s  {baseline / makespan:5.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare file orderings, modelled and measured against the mock API')
+    parser.add_argument('--fileThreads', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=5)
+    parser.add_argument('--batchsize', type=int, default=10, help='Lines per request in the measured run')
+    parser.add_argument('--model', action='store_true', help='Only print the model, skip the measured runs')
+    parser.add_argument('--json', help='Also write the results to this file')
+    addMockArguments(parser)
+    parser.set_defaults(latency='fixed:0.2')
+    args = parser.parse_args()
+    jsonPath = os.path.abspath(args.json) if args.json else None
+
+    output = {'model': modelResults(args.fileThreads, args.threads)}
+    printResults(output['model'], args.fileThreads, args.threads)
+    if not args.model:
+        output['measured'] = measuredResults(args)
+        printResults(output['measured'], args.fileThreads, args.threads)
+
+    if jsonPath:
+        with open(jsonPath, 'w', encoding='utf-8') as outFile:
+            json.dump(output, outFile, indent=4)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
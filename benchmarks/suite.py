@@ -0,0 +1,179 @@
+# Per engine benchmark on synthetic projects. Every engine is timed twice: offline, with
+# answers built in process (parse, inject and serialise only), and against the mock API.
+# Results are appended to a JSON history so a slower searchCodes or dump shows up as a
+# regression against the previous run with the same settings.
+# Usage: python -m benchmarks.suite [--engines mvmz,wolf] [--size 1] [--history benchmarks/history.json]
+import argparse, datetime, importlib, json, os, platform, shutil, subprocess, sys, tempfile, time
+from types import SimpleNamespace
+from benchmarks.mockserver import MockState, addMockArguments, completion, configFromArguments, startServer
+from benchmarks.synthetic import SYNTHETIC, engineProject
+from benchmarks.throughput import ROOT, setEnvironment
+
+# Switches the benchmark turns on so the generated commands are actually translated
+ENGINEFLAGS = {
+    'mvmz': {'CODE401': True, 'CODE102': True, 'CODE122': True, 'CODE355655': True, 'CODE356': True, 'CODE357': True},
+    'wolf': {'ITEMFLAG': True},
+    'wolfdata': {'ITEMFLAG': True},
+}
+
+class OfflineCompletions:
+    """
+    Stands in for createCompletion in an engine module. Answers come from the mock's own
+    response builder without HTTP or latency, so what is left is the engine's own work.
+    """
+    def __init__(self, config):
+        self.state = MockState(config)
+
+    def __call__(self, **kwargs):
+        request = {'model': kwargs.get('model'), 'messages': kwargs.get('messages', [])}
+        body = json.dumps(request, ensure_ascii=False).encode('utf-8')
+        data = completion(request, self.state.rng(body), self.state.config, self.state)
+        return json.loads(json.dumps(data), object_hook=lambda item: SimpleNamespace(**item))
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def folderSize(folder):
+    return sum(os.path.getsize(os.path.join(folder, filename)) for filename in os.listdir(folder))
+
+def timeProject(project, engine, fileThreads):
+    from modules.batch import runProject
+    start = time.perf_counter()
+    summary = runProject(project, engine, False, fileThreads)
+    seconds = time.perf_counter() - start
+    failed = [record['file'] for record in summary['files'] if record['error'] is not None]
+    if summary['error'] is not None:
+        failed.append(summary['error'])
+    return [seconds, summary, failed]
+
+def benchEngine(engine, workFolder, args, mockConfig, stats):
+    from modules.engines import getEngine
+    project = os.path.join(workFolder, engine)
+    filenames = engineProject(engine, os.path.join(project, 'files'), args.size, args.seed)
+    module = importlib.import_module(getEngine(engine)[3])
+    for name, value in ENGINEFLAGS.get(engine, {}).items():
+        setattr(module, name, value)
+    if args.batchsize:
+        module.BATCHSIZE = args.batchsize
+
+    # Offline: the engine's parse, inject and serialise with instant answers
+    online = module.createCompletion
+    offline = OfflineCompletions(mockConfig)
+    module.createCompletion = offline
+    try:
+        offlineSeconds, _, offlineFailed = timeProject(project, engine, args.fileThreads)
+    finally:
+        module.createCompletion = online
+    shutil.rmtree(os.path.join(project, 'translated'), ignore_errors=True)
+
+    # Mock: the whole handle path including HTTP, retries and latency
+    before = dict(stats())
+    mockSeconds, summary, mockFailed = timeProject(project, engine, args.fileThreads)
+    requests = stats()['requests'] - before['requests']
+
+    return {
+        'engine': engine,
+        'files': len(filenames),
+        'bytes': folderSize(os.path.join(project, 'files')),
+        'requests': requests,
+        'offlineSeconds': round(offlineSeconds, 3),
+        'mockSeconds': round(mockSeconds, 3),
+        'requestsPerSecond': round(requests / mockSeconds, 2) if mockSeconds else 0,
+        'inputTokens': sum(record['inputTokens'] for record in summary['files']),
+        'outputTokens': sum(record['outputTokens'] for record in summary['files']),
+        'mismatches': sum(1 for record in summary['files'] if record['mismatch']),
+        'failed': sorted(set(offlineFailed + mockFailed)),
+    }
+
+def readHistory(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def previousResult(history, settings, engine):
+    # Latest earlier run of the same engine with the same settings
+    for entry in reversed(history):
+        if entry['settings'] == settings:
+            for result in entry['results']:
+                if result['engine'] == engine:
+                    return result
+    return None
+
+def compare(result, previous, threshold):
+    # Relative change per timing, flagged when slower by more than threshold
+    notes = []
+    for key in ['offlineSeconds', 'mockSeconds']:
+        if previous is None or not previous.get(key):
+            notes.append('')
+            continue
+        change = result[key] / previous[key] - 1
+        notes.append(f'{change:+.0%}' + (' REGRESSION' if change > threshold else ''))
+    return notes
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each engine on synthetic projects, offline and against the mock API')
+    parser.add_argument('--engines', default=','.join(SYNTHETIC), help='Comma separated engine keys')
+    parser.add_argument('--size', type=float, default=1.0, help='Project size relative to a mid sized game')
+    parser.add_argument('--fileThreads', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batchsize', type=int, help='Lines per request, defaults to the engine setting')
+    parser.add_argument('--history', default=os.path.join(ROOT, 'benchmarks', 'history.json'), help='JSON file results are appended to, empty to skip')
+    parser.add_argument('--threshold', type=float, default=.2, help='Slowdown against the previous run reported as a regression')
+    addMockArguments(parser)
+    parser.set_defaults(latency='fixed:0.05')
+    args = parser.parse_args()
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    historyPath = os.path.abspath(args.history) if args.history else ''
+
+    mockConfig = configFromArguments(args)
+    server, url = startServer(mockConfig)
+    setEnvironment(url, args.fileThreads, args.threads)
+    os.environ['csvFormat'] = '1'
+
+    def stats():
+        with server.RequestHandlerClass.state.lock:
+            return dict(server.RequestHandlerClass.state.stats)
+
+    # Engines read prompt.txt and vocab.txt from the working folder
+    workFolder = tempfile.mkdtemp(prefix='translator-suite-')
+    shutil.copy(os.path.join(ROOT, 'prompt.example'), os.path.join(workFolder, 'prompt.txt'))
+    shutil.copy(os.path.join(ROOT, 'vocab.txt'), os.path.join(workFolder, 'vocab.txt'))
+    cwd = os.getcwd()
+    os.chdir(workFolder)
+    try:
+        results = [benchEngine(engine, workFolder, args, mockConfig, stats) for engine in engines]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workFolder, ignore_errors=True)
+        server.shutdown()
+
+    settings = {'size': args.size, 'fileThreads': args.fileThreads, 'threads': args.threads, 'batchsize': args.batchsize,
+                'latency': args.latency, 'mockScale': args.scale, 'seed': args.seed}
+    history = readHistory(historyPath) if historyPath else []
+
+    print(f'{"engine":10} {"files":>5} {"MB":>6} {"requests":>8} {"offline s":>10} {"":>16} {"mock s":>8} {"":>16}')
+    for result in results:
+        offlineNote, mockNote = compare(result, previousResult(history, settings, result['engine']), args.threshold)
+        print(f'{result["engine"]:10} {result["files"]:5} {result["bytes"] / 1e6:6.2f} {result["requests"]:8} '
+              f'{result["offlineSeconds"]:10.3f} {offlineNote:>16} {result["mockSeconds"]:8.3f} {mockNote:>16}')
+        for failed in result['failed']:
+            print(f'    failed: {failed}')
+
+    if historyPath:
+        history.append({
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'settings': settings,
+            'results': results,
+        })
+        with open(historyPath, 'w', encoding='utf-8') as outFile:
+            json.dump(history, outFile, indent=4, ensure_ascii=False)
+    return 1 if any(result['failed'] for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+# Synthetic game projects for benchmarks. Deterministic for a given seed.
+# Every generator writes into a files folder and returns the list of file names.
+import csv, json, os, random, struct
+
+SPEAKERS = ['レナリス', 'スクルー', 'オリン', 'プローテ', 'マルス', 'リュート']
+PHRASES = [
+    'こんにちは、元気ですか？',
+    '今日はいい天気ですね。',
+    'この先に宝箱があるらしい。',
+    'ちょっと待って、まだ準備ができていないの。',
+    '魔王の城はこの森を抜けた先にある。',
+    'ありがとう、助かったよ！',
+    'そんなことより、早く行きましょう。',
+    '村の人たちはみんな眠っているみたいだ。',
+]
+CHOICES = ['はい', 'いいえ', '話を聞く', '立ち去る', '買い物をする']
+ITEMS = ['回復薬', '毒消し', '鉄の剣', '革の盾', '魔法の杖', '古びた鍵']
+
+def dialogue(rng, lines):
+    # One message box: speaker line then text lines, as MV stores them
+    commands = [{'code': 101, 'indent': 0, 'parameters': ['', 0, 0, 2, rng.choice(SPEAKERS)]}]
+    for _ in range(lines):
+        commands.append({'code': 401, 'indent': 0, 'parameters': [rng.choice(PHRASES)]})
+    return commands
+
+def extras(rng):
+    # One of the other text bearing commands searchCodes handles
+    kind = rng.randint(0, 4)
+    if kind == 0:
+        choices = rng.sample(CHOICES, 2)
+        return [{'code': 102, 'indent': 0, 'parameters': [choices, 1, 0, 2, 0]},
+                {'code': 402, 'indent': 0, 'parameters': [0, choices[0]]},
+                {'code': 402, 'indent': 0, 'parameters': [1, choices[1]]},
+                {'code': 404, 'indent': 0, 'parameters': []}]
+    if kind == 1:
+        return [{'code': 122, 'indent': 0, 'parameters': [rng.randint(1, 99), rng.randint(1, 99), 0, 4, f'"{rng.choice(PHRASES)}"']}]
+    if kind == 2:
+        return [{'code': 355, 'indent': 0, 'parameters': [f'text = "{rng.choice(PHRASES)}"']}]
+    if kind == 3:
+        return [{'code': 356, 'indent': 0, 'parameters': [f'ShowInfo {rng.choice(PHRASES)}']}]
+    return [{'code': 357, 'indent': 0, 'parameters': ['TorigoyaMZ_NotifyMessage', 'notify', '通知', {'message': rng.choice(PHRASES)}]}]
+
+def page(rng, messages, lines, extra=False):
+    commands = []
+    for _ in range(messages):
+        commands.extend(dialogue(rng, rng.randint(1, lines)))
+        if extra:
+            commands.extend(extras(rng))
+    commands.append({'code': 0, 'indent': 0, 'parameters': []})
+    return {'list': commands}
+
+def writeJSON(folder, filename, data):
+    with open(os.path.join(folder, filename), 'w', encoding='utf-8') as outFile:
+        json.dump(data, outFile, ensure_ascii=False)
+    return filename
+
+def writeLines(folder, filename, lines, encoding='utf-8'):
+    with open(os.path.join(folder, filename), 'w', encoding=encoding, newline='') as outFile:
+        outFile.writelines(lines)
+    return filename
+
+def mvmzProject(folder, maps=20, events=5, pages=2, messages=3, lines=3, commonEvents=40, seed=1, extra=False, database=False):
+    """
+    Writes an MV/MZ style files folder with Map001..MapN.json and CommonEvents.json. Every
+    map has events * pages pages of messages message boxes with up to lines lines each.
+    extra mixes 102/122/355/356/357 commands in, database adds Actors and System.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for i in range(1, maps + 1):
+        mapEvents = [None] + [{'id': j, 'name': f'EV{j:03}', 'note': '', 'pages': [page(rng, messages, lines, extra) for _ in range(pages)]} for j in range(1, events + 1)]
+        filenames.append(writeJSON(folder, f'Map{i:03}.json', {'displayName': '', 'events': mapEvents}))
+
+    common = [None] + [{'id': j, 'name': f'CE{j:03}', 'list': page(rng, messages * 2, lines, extra)['list']} for j in range(1, commonEvents + 1)]
+    filenames.append(writeJSON(folder, 'CommonEvents.json', common))
+
+    if database:
+        actors = [None] + [{'id': j, 'name': SPEAKERS[j - 1], 'nickname': rng.choice(ITEMS), 'profile': rng.choice(PHRASES), 'note': ''} for j in range(1, len(SPEAKERS) + 1)]
+        filenames.append(writeJSON(folder, 'Actors.json', actors))
+        system = {
+            'gameTitle': '魔王の城',
+            'armorTypes': ['', '盾', '兜'],
+            'equipTypes': ['', '武器', '盾'],
+            'skillTypes': ['', '魔法', '必殺技'],
+            'variables': ['', '所持金'],
+            'terms': {
+                'basic': ['レベル', 'HP', 'MP'],
+                'commands': ['戦う', '逃げる', 'アイテム', None],
+                'params': ['最大HP', '攻撃力', '防御力'],
+                'messages': {'actionFailure': '%1には効かなかった！', 'alwaysDash': '常時ダッシュ', 'victory': '%1の勝利！'},
+            },
+        }
+        filenames.append(writeJSON(folder, 'System.json', system))
+    return filenames
+
+def aceProject(folder, maps=20, events=5, pages=2, messages=3, lines=3, commonEvents=40, seed=1):
+    # The same shape as mvmzProject in the YAML layout ACE exports use (c/i/p command keys)
+    from ruamel.yaml import YAML
+    yaml = YAML(pure=True)
+    yaml.width = 4096
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+
+    def acePage(messages):
+        return {'list': [{'c': command['code'], 'i': 0, 'p': command['parameters']} for command in page(rng, messages, lines)['list']]}
+
+    def dump(filename, data):
+        with open(os.path.join(folder, filename), 'w', encoding='utf-8') as outFile:
+            yaml.dump(data, outFile)
+        return filename
+
+    filenames = []
+    for i in range(1, maps + 1):
+        mapEvents = {j: {'id': j, 'name': f'EV{j:03}', 'pages': [acePage(messages) for _ in range(pages)]} for j in range(1, events + 1)}
+        filenames.append(dump(f'Map{i:03}.yaml', {'display_name': '', 'events': mapEvents}))
+    common = [None] + [dict(acePage(messages * 2), id=j, name=f'CE{j:03}') for j in range(1, commonEvents + 1)]
+    filenames.append(dump('CommonEvents.yaml', common))
+    return filenames
+
+def wolfTrees(maps=20, events=5, pages=2, messages=3, lines=3, commonEvents=40, items=50, seed=1):
+    # [filename, data] for each file of a WolfTrans style JSON export
+    rng = random.Random(seed)
+
+    def wolfCommands(messages):
+        commands = []
+        for _ in range(messages):
+            text = '\n'.join(rng.choice(PHRASES) for _ in range(rng.randint(1, lines)))
+            commands.append({'code': 101, 'stringArgs': [f'{rng.choice(SPEAKERS)}：\n{text}'], 'intArgs': []})
+            if rng.random() < .2:
+                commands.append({'code': 102, 'stringArgs': rng.sample(CHOICES, 2), 'intArgs': []})
+        commands.append({'code': 0, 'stringArgs': [], 'intArgs': []})
+        return commands
+
+    trees = []
+    for i in range(1, maps + 1):
+        mapEvents = [{'id': j, 'name': f'EV{j:03}', 'pages': [{'list': wolfCommands(messages)} for _ in range(pages)]} for j in range(events)]
+        trees.append([f'Map{i:03}.json', {'events': mapEvents}])
+    trees.append(['CommonEvent.json', {'commands': [command for _ in range(commonEvents) for command in wolfCommands(messages * 2)]}])
+
+    entries = [{'name': f'{rng.choice(ITEMS)}{j}', 'data': [
+        {'name': 'アイテム名', 'value': rng.choice(ITEMS)},
+        {'name': '説明文', 'value': rng.choice(PHRASES)},
+        {'name': '使用後文章[移動]', 'value': rng.choice(PHRASES)},
+        {'name': '使用時文章[戦]', 'value': rng.choice(PHRASES)},
+    ]} for j in range(items)]
+    trees.append(['DataBase.json', {'types': [{'name': 'アイテム', 'data': entries}]}])
+    return trees
+
+def wolfProject(folder, maps=20, events=5, pages=2, messages=3, lines=3, commonEvents=40, items=50, seed=1):
+    # WolfTrans style JSON: maps, CommonEvent.json and a DataBase.json with an item table
+    os.makedirs(folder, exist_ok=True)
+    return [writeJSON(folder, filename, data) for filename, data in wolfTrees(maps, events, pages, messages, lines, commonEvents, items, seed)]
+
+# Wolf RPG Editor binaries in the layout modules/wolfdata.py reads. Only what the reader
+# interprets carries data, the rest is filler of the right size.
+def wolfInt(value):
+    return struct.pack('<i', value)
+
+def wolfString(value):
+    data = value.encode('cp932') + b'\x00'
+    return wolfInt(len(data)) + data
+
+def wolfRoute(count):
+    return wolfInt(count) + b''.join(bytes([index, 2]) + wolfInt(1) + wolfInt(2) + b'\x01\x00' for index in range(count))
+
+def wolfCommand(command, move=False):
+    data = bytes([len(command['intArgs']) + 1]) + wolfInt(command['code']) + b''.join(wolfInt(value) for value in command['intArgs'])
+    data += bytes([command.get('indent', 0), len(command['stringArgs'])]) + b''.join(wolfString(value) for value in command['stringArgs'])
+    if move:
+        return data + b'\x01' + b'\x00' * 5 + b'\x07' + wolfRoute(2)
+    return data + b'\x00'
+
+def wolfCommandList(commands):
+    # Ends with a move route command, the one command type with a trailer
+    data = wolfInt(len(commands) + 1) + b''.join(wolfCommand(command) for command in commands)
+    return data + wolfCommand({'code': 201, 'intArgs': [1, 2], 'stringArgs': []}, move=True)
+
+def wolfMap(tree):
+    width, height = 3, 2
+    data = b'\x00' * 10 + b'W\x00\x00OL\x00M\x00' + wolfInt(0) + b'\x64' + wolfString('') + wolfInt(1) + wolfInt(width) + wolfInt(height)
+    data += wolfInt(len(tree['events'])) + b'\x05' * (width * height * 12)
+    for event in tree['events']:
+        data += b'\x6f' + b'\x39\x30\x00\x00' + wolfInt(event['id']) + wolfString(event['name']) + wolfInt(1) + wolfInt(2) + wolfInt(len(event['pages'])) + b'\x00' * 4
+        for page in event['pages']:
+            data += b'\x79' + wolfInt(0) + wolfString('chara.png') + b'\x01\x02\x03\x04' + b'\x09' * 37 + b'\x08' * 4 + b'\x01\x02' + wolfRoute(1)
+            data += wolfCommandList(page['list']) + b'\x03\x00\x00\x00' + b'\x00\x01\x01' + b'\x7a'
+        data += b'\x70'
+    return data + b'\x66'
+
+def wolfCommonEvents(tree):
+    # One common event per run of commands ending in code 0, odd ones with a return value
+    groups = [[]]
+    for command in tree['commands']:
+        groups[-1].append(command)
+        if command['code'] == 0:
+            groups.append([])
+    groups = [group for group in groups if group]
+
+    data = b'\x00W\x00\x00OL\x00FC\x00\x8f' + wolfInt(len(groups))
+    for index, commands in enumerate(groups):
+        data += b'\x8e' + wolfInt(index) + wolfInt(0) + b'\x00' * 7 + wolfString(f'コモン{index}') + wolfCommandList(commands) + wolfString('') + wolfString('説明') + b'\x8f'
+        data += wolfInt(2) + wolfString('a') + wolfString('b') + wolfInt(3) + b'\x01\x02\x03' + wolfInt(1) + wolfInt(2) + wolfString('x') + wolfString('y')
+        data += wolfInt(1) + wolfInt(2) + wolfInt(5) + wolfInt(6) + b'\x00' * 0x1d + wolfString('') * 100 + b'\x91' + wolfString('')
+        data += (b'\x92' + wolfString('z') + wolfInt(4) + b'\x92') if index % 2 else b'\x91'
+    return data + b'\x8f'
+
+def wolfDatabase(tree):
+    # [.project, .dat] with the JSON's string fields plus an int price field stored second
+    project = wolfInt(len(tree['types']))
+    data = b'\x00W\x00\x00OL\x00FM\x00\xc1' + wolfInt(len(tree['types']))
+    for table in tree['types']:
+        fields = [field['name'] for field in table['data'][0]['data']] + ['価格']
+        count = wolfInt(len(fields))
+        project += wolfString(table['name']) + count + b''.join(wolfString(field) for field in fields)
+        project += wolfInt(len(table['data'])) + b''.join(wolfString(entry['name']) for entry in table['data']) + wolfString('desc')
+        project += wolfInt(100) + b'\x00' * 100 + count + wolfString('') * len(fields) + (count + wolfInt(0) * len(fields)) * 3
+
+        info = [0x7D0, 0x7D1, 0x7D2, 0x7D3, 0x3E8]
+        data += b'\xfe\xff\xff\xff' + wolfInt(0) + wolfInt(len(info)) + b''.join(wolfInt(value) for value in info) + wolfInt(len(table['data']))
+        for entry in table['data']:
+            data += wolfInt(100 + len(entry['name'])) + b''.join(wolfString(field['value']) for field in entry['data'])
+    return [project, data + b'\xc1']
+
+def wolfDataProject(folder, maps=20, events=5, pages=2, messages=3, lines=3, commonEvents=40, items=50, seed=1):
+    # The wolfProject files as .mps maps, CommonEvent.dat and DataBase.project/.dat
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for filename, tree in wolfTrees(maps, events, pages, messages, lines, commonEvents, items, seed):
+        name = filename[:-len('.json')]
+        if name.startswith('Map'):
+            files = [[f'{name}.mps', wolfMap(tree)]]
+        elif name == 'CommonEvent':
+            files = [['CommonEvent.dat', wolfCommonEvents(tree)]]
+        else:
+            project, data = wolfDatabase(tree)
+            files = [['DataBase.project', project], ['DataBase.dat', data]]
+        for name, data in files:
+            with open(os.path.join(folder, name), 'wb') as outFile:
+                outFile.write(data)
+            if not name.endswith('.project'):
+                filenames.append(name)
+    return filenames
+
+def scriptProject(folder, kind, files=10, blocks=200, lines=3, seed=1):
+    """
+    Plain text scripts for the line based engines. kind is the engine key:
+    wolf2 (txt dump), tyrano (.ks), nscript (0.txt), iris, regex or eushully (txt).
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    text = lambda count: [rng.choice(PHRASES) for _ in range(count)]
+    filenames = []
+    for i in range(files):
+        script = []
+        for _ in range(blocks):
+            count = rng.randint(1, lines)
+            speaker = rng.choice(SPEAKERS)
+            if kind == 'wolf2':
+                script += ['/message\n', f'{speaker}：\n'] + [f'{line}\n' for line in text(count)] + ['\n']
+            elif kind == 'tyrano':
+                script += [f'[{speaker}] [@]\n'] + [f'[cm]{line}[p]\n' for line in text(count)]
+                if rng.random() < .1:
+                    script += [f'[glink status=1]{choice}\n' for choice in rng.sample(CHOICES, 2)]
+            elif kind == 'nscript':
+                script += [f'*label{len(script)}\n', f'「{"".join(text(count))}」\\\n', 'wait 100\n']
+            elif kind == 'iris':
+                script += ['#MSG,\n', f'　{speaker}\n'] + [f'　{line}\n' for line in text(count)] + ['\n']
+            elif kind == 'regex':
+                script += [f'mov $1{index},"{line}"\n' for index, line in enumerate(text(count))] + ['wait\n']
+            elif kind == 'eushully':
+                # Speaker, a show-text group ending in wait, then the odd set-string and concat
+                if rng.random() < .5:
+                    script.append(f'mov (global-int 46e2) {rng.randint(1, len(SPEAKERS))}\n')
+                for index, line in enumerate(text(count)):
+                    script += [f'show-text {index} "{line}"\n', 'end-text-line 0\n']
+                script.append('wait\n')
+                if rng.random() < .3:
+                    script.append(f'set-string (local-ptr 1) "{rng.choice(PHRASES)}"\n')
+                if rng.random() < .2:
+                    script.append('concat (local-ptr 1) "x"\n')
+            else:
+                raise ValueError(f'No script generator for {kind}')
+
+        if kind == 'tyrano':
+            filenames.append(writeLines(folder, f'scene{i:03}.ks', script))
+        elif kind == 'nscript':
+            filenames.append(writeLines(folder, f'{i}.txt', script, 'cp932'))
+        elif kind == 'eushully':
+            filenames.append(writeLines(folder, f'script{i:03}.txt', script))
+        else:
+            filenames.append(writeLines(folder, f'script{i:03}.txt', script, 'shift_jis'))
+    return filenames
+
+def csvProject(folder, files=10, rows=1000, seed=1):
+    # Translator++ export: source text in the first column, empty translation in the second
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    filenames = []
+    for i in range(files):
+        filename = f'sheet{i:03}.csv'
+        with open(os.path.join(folder, filename), 'w', encoding='utf-8-sig', newline='') as outFile:
+            writer = csv.writer(outFile)
+            for _ in range(rows):
+                writer.writerow(['\n'.join(rng.choice(PHRASES) for _ in range(rng.randint(1, 3))), ''])
+        filenames.append(filename)
+    return filenames
+
+def engineProject(engine, folder, scale=1.0, seed=1):
+    """
+    Project for one engine key at a size relative to a typical mid sized game. scale=1 is a
+    few MB of JSON for the event based engines and a few thousand lines for the others.
+    """
+    size = lambda value: max(1, round(value * scale))
+    if engine == 'mvmz':
+        return mvmzProject(folder, maps=size(40), commonEvents=size(80), seed=seed, extra=True, database=True)
+    if engine == 'ace':
+        return aceProject(folder, maps=size(20), commonEvents=size(40), seed=seed)
+    if engine == 'wolf':
+        return wolfProject(folder, maps=size(20), commonEvents=size(40), items=size(50), seed=seed)
+    if engine == 'wolfdata':
+        return wolfDataProject(folder, maps=size(20), commonEvents=size(40), items=size(50), seed=seed)
+    if engine == 'csv':
+        return csvProject(folder, files=size(10), seed=seed)
+    if engine in ['wolf2', 'tyrano', 'nscript', 'iris', 'regex', 'eushully']:
+        return scriptProject(folder, engine, files=size(10), seed=seed)
+    raise ValueError(f'No synthetic project for {engine}')
+
+SYNTHETIC = ['mvmz', 'ace', 'wolf', 'wolfdata', 'wolf2', 'csv', 'tyrano', 'nscript', 'iris', 'regex', 'eushully']
@@ -0,0 +1,157 @@
+# Microbenchmarks for the per line text helpers every engine keeps its own copy of:
+# subVars, resubVars, cleanTranslatedText, elongateCharacters, batchList, extractTranslation,
+# the Japanese detection regexes and textwrap.fill. Each module's variant runs over the same
+# corpus so a faster or unified helper can be judged on numbers.
+# Usage: python -m benchmarks.textops [--functions subVars,resubVars] [--modules mvmz,wolf] [--json out.json]
+import argparse, hashlib, importlib, inspect, json, os, re, shutil, sys, tempfile, textwrap, timeit
+from benchmarks.throughput import ROOT, setEnvironment
+
+# Lines as they come out of real games: control codes, names, icons, furigana, long
+# paragraphs, already translated text and lines with nothing to translate.
+CORPUS = [
+    'こんにちは、元気ですか？',
+    '\\C[2]レナリス\\C[0]「今日はいい天気ですね。」',
+    '\\N[1]は\\I[176]回復薬を\\V[12]個手に入れた！',
+    '魔王の城はこの森を抜けた先にある。\\.\\.\\.気をつけて進もう。',
+    '\\c[4]\\c[0]ちょっと待って、まだ準備ができていないの。\\|',
+    '\\FS[20]\\C[18]【システム】\\C[0]セーブしました。',
+    'そんなことより、早く行きましょう……',
+    'ありがとう、助かったよー！本当にありがとーーー！',
+    '\\>\\C[14]\\N[2]\\C[0]の攻撃力が\\V[30]上がった！\\<',
+    '村の人たちはみんな眠っているみたいだ。\n誰かが魔法をかけたのかもしれない。\n調べてみよう。',
+    '<hint:この薬草を使うとHPが回復する。>',
+    'ファイン：\nおはようございます。今日もよろしくお願いします。',
+    'Ｈｅｌｌｏ　ＷＯＲＬＤ　１２３',
+    'The gate is locked.',
+    '',
+    '……',
+    '\\{\\C[2]うわあああっ！\\}',
+    '「城へ行くには、この先の橋を渡って、東の塔を越えて、それから北の山道を三日ほど歩かなければならない。途中には魔物がたくさん出るから、十分に準備をしてから行くんだぞ。」',
+    '[ruby text="まおう"]魔王[ruby text="じょう"]城',
+    '\\i[64]鉄の剣　\\i[65]革の盾　\\i[66]魔法の杖',
+]
+
+HELPERS = ['subVars', 'resubVars', 'cleanTranslatedText', 'elongateCharacters', 'batchList', 'extractTranslation', 'japanese', 'textwrap']
+JAPANESEPATTERN = re.compile(r"r'(\[一-龠[^']*)'")
+
+def loadModules(keys):
+    # Engines read prompt.txt and vocab.txt from the working folder on import
+    from modules.engines import ENGINES
+    setEnvironment('http://127.0.0.1:9/v1/', 1, 1)
+    workFolder = tempfile.mkdtemp(prefix='translator-textops-')
+    shutil.copy(os.path.join(ROOT, 'prompt.example'), os.path.join(workFolder, 'prompt.txt'))
+    shutil.copy(os.path.join(ROOT, 'vocab.txt'), os.path.join(workFolder, 'vocab.txt'))
+    cwd = os.getcwd()
+    os.chdir(workFolder)
+    try:
+        return [[engine[0], importlib.import_module(engine[3])] for engine in ENGINES if not keys or engine[0] in keys]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workFolder, ignore_errors=True)
+
+def usesJSON(module):
+    # mvmz, csv and nscript send Line1..N JSON, the rest `<LineN>` tags
+    translate = getattr(module, 'translateGPT', None)
+    return translate is not None and 'json.dumps(payload' in inspect.getsource(translate)
+
+def fakeResponse(module, lines):
+    if usesJSON(module):
+        return json.dumps({f'Line{i + 1}': line for i, line in enumerate(lines)}, indent=4, ensure_ascii=False)
+    return '\n'.join(f'`<Line{i}>{line}</Line{i}>`' for i, line in enumerate(lines))
+
+def workload(helper, module):
+    """
+    Returns a function that runs helper once per corpus line with module's variant, or
+    None when the module has no copy of it.
+    """
+    if helper == 'textwrap':
+        width = getattr(module, 'WIDTH', 60)
+        return lambda: [textwrap.fill(line, width=width) for line in CORPUS]
+    if helper == 'japanese':
+        patterns = sorted(set(JAPANESEPATTERN.findall(inspect.getsource(module))))
+        if not patterns:
+            return None
+        compiled = [re.compile(pattern) for pattern in patterns]
+        return lambda: [pattern.search(line) for pattern in compiled for line in CORPUS]
+
+    function = getattr(module, helper, None)
+    if function is None:
+        return None
+    if helper in ['subVars', 'elongateCharacters']:
+        return lambda: [function(line) for line in CORPUS]
+    if helper == 'batchList':
+        lines = CORPUS * 5
+        return lambda: [function(lines, size) for size in [1, 5, 10, 20, 40]]
+    if helper == 'extractTranslation':
+        # One batch response holding the whole corpus, parsed once per line so the cost
+        # per line stays comparable with the other helpers
+        response = fakeResponse(module, CORPUS)
+        return lambda: [function(response, True) for _ in CORPUS]
+
+    # Placeholders as the API gives them back, with the lists subVars made
+    subbed = [module.subVars(line) for line in CORPUS] if hasattr(module, 'subVars') else None
+    if subbed is None:
+        return None
+    if helper == 'resubVars':
+        return lambda: [function(text, allList) for text, allList in subbed]
+    if helper == 'cleanTranslatedText':
+        return lambda: [function(text, varResponse) for text, varResponse in zip(CORPUS, subbed)]
+    return None
+
+def variantOf(module, helper):
+    # Modules with the same source for a helper share a variant label
+    if helper == 'japanese':
+        source = ','.join(sorted(set(JAPANESEPATTERN.findall(inspect.getsource(module)))))
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()[:7]
+    if helper == 'textwrap':
+        return f'w{getattr(module, "WIDTH", 60)}'
+    function = getattr(module, helper, None)
+    if function is None:
+        return ''
+    try:
+        return hashlib.sha1(inspect.getsource(function).encode('utf-8')).hexdigest()[:7]
+    except (OSError, TypeError):
+        return ''
+
+def measure(function, repeat):
+    # Best of repeat runs, in microseconds per corpus line
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number / len(CORPUS) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every module's copy of the text helpers over a fixed corpus")
+    parser.add_argument('--functions', default=','.join(HELPERS), help='Comma separated helpers')
+    parser.add_argument('--modules', default='', help='Comma separated engine keys, all by default')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+    helpers = [helper.strip() for helper in args.functions.split(',') if helper.strip()]
+    keys = [key.strip() for key in args.modules.split(',') if key.strip()]
+
+    modules = loadModules(keys)
+    results = []
+    for helper in helpers:
+        rows = []
+        for key, module in modules:
+            function = workload(helper, module)
+            if function is not None:
+                rows.append({'helper': helper, 'module': key, 'variant': variantOf(module, helper), 'usPerLine': measure(function, args.repeat)})
+        if not rows:
+            continue
+
+        fastest = min(row['usPerLine'] for row in rows)
+        print(f'\n{helper} ({len(set(row["variant"] for row in rows))} variants)')
+        for row in sorted(rows, key=lambda row: row['usPerLine']):
+            row['relative'] = round(row['usPerLine'] / fastest, 2) if fastest else 1.0
+            row['usPerLine'] = round(row['usPerLine'], 3)
+            print(f'  {row["module"]:12} {row["variant"]:8} {row["usPerLine"]:10.3f} us/line  x{row["relative"]:.2f}')
+        results.extend(rows)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as outFile:
+            json.dump({'corpus': len(CORPUS), 'results': results}, outFile, indent=4)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# End to end throughput against the local mock API. No network, no cost.
+# Usage: python -m benchmarks.throughput [--fileThreads 2] [--threads 4] [--batchsize 50] [--maps 20] [mock options]
+import argparse, json, os, shutil, sys, tempfile, time
+from benchmarks.mockserver import addMockArguments, configFromArguments, startServer
+from benchmarks.synthetic import mvmzProject
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setEnvironment(url, fileThreads, threads):
+    # Engines read these on import
+    os.environ.update({
+        'api': url, 'key': 'sk-mock', 'org': '', 'organization': '', 'model': 'gpt-4', 'language': 'English',
+        'timeout': '30', 'fileThreads': str(fileThreads), 'threads': str(threads),
+        'width': '60', 'listWidth': '100', 'noteWidth': '70', 'overallProgress': '0',
+    })
+
+def histogramQuantile(histogram, quantile):
+    # Upper bound of the bucket holding the quantile, like Prometheus' histogram_quantile
+    target = histogram['count'] * quantile
+    seen = 0
+    for bound, count in histogram['buckets'].items():
+        seen += count
+        if seen >= target:
+            return bound
+    return '+Inf'
+
+def main():
+    parser = argparse.ArgumentParser(description='Translate a synthetic MV project against the mock API and report throughput')
+    parser.add_argument('--fileThreads', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batchsize', type=int, help='Lines per request, defaults to the engine setting')
+    parser.add_argument('--maps', type=int, default=20)
+    parser.add_argument('--commonEvents', type=int, default=40)
+    parser.add_argument('--json', help='Also write the result to this file')
+    addMockArguments(parser)
+    args = parser.parse_args()
+    jsonPath = os.path.abspath(args.json) if args.json else None
+
+    server, url = startServer(configFromArguments(args))
+    setEnvironment(url, args.fileThreads, args.threads)
+
+    # Engines read prompt.txt and vocab.txt from the working folder
+    workFolder = tempfile.mkdtemp(prefix='translator-bench-')
+    shutil.copy(os.path.join(ROOT, 'prompt.example'), os.path.join(workFolder, 'prompt.txt'))
+    shutil.copy(os.path.join(ROOT, 'vocab.txt'), os.path.join(workFolder, 'vocab.txt'))
+    project = os.path.join(workFolder, 'project')
+    filenames = mvmzProject(os.path.join(project, 'files'), maps=args.maps, commonEvents=args.commonEvents, seed=args.seed)
+    cwd = os.getcwd()
+    os.chdir(workFolder)
+
+    from modules import rpgmakermvmz
+    from modules.batch import runProject
+    from modules.metrics import METRICS
+    rpgmakermvmz.CODE401 = True
+    if args.batchsize:
+        rpgmakermvmz.BATCHSIZE = args.batchsize
+
+    start = time.perf_counter()
+    summary = runProject(project, 'mvmz', False, args.fileThreads)
+    seconds = time.perf_counter() - start
+
+    with server.RequestHandlerClass.state.lock:
+        stats = dict(server.RequestHandlerClass.state.stats)
+    snapshot = METRICS.snapshot()
+    retries = sum(counter['value'] for counter in snapshot['counters'] if counter['name'] == 'retries_total')
+    latency = next((histogram for histogram in snapshot['histograms'] if histogram['name'] == 'request_seconds' and histogram['labels'].get('status') == 'ok'), None)
+    tokens = stats['promptTokens'] + stats['completionTokens']
+
+    result = {
+        'fileThreads': args.fileThreads,
+        'threads': args.threads,
+        'batchsize': rpgmakermvmz.BATCHSIZE,
+        'latency': args.latency,
+        'files': len(filenames),
+        'seconds': round(seconds, 2),
+        'requests': stats['requests'],
+        'requestsPerSecond': round(stats['requests'] / seconds, 2),
+        'tokensPerSecond': round(tokens / seconds, 1),
+        'injected429': stats['429'],
+        'injected5xx': stats['5xx'],
+        'truncated': stats['truncated'],
+        'mismatched': stats['mismatched'],
+        'retries': retries,
+        'p50': histogramQuantile(latency, .5) if latency else None,
+        'p95': histogramQuantile(latency, .95) if latency else None,
+        'failedFiles': sum(1 for record in summary['files'] if record['error'] is not None),
+    }
+    os.chdir(cwd)
+    shutil.rmtree(workFolder, ignore_errors=True)
+    server.shutdown()
+
+    for key, value in result.items():
+        print(f'{key.ljust(18)} {value}')
+    if jsonPath:
+        with open(jsonPath, 'w', encoding='utf-8') as outFile:
+            json.dump(result, outFile, indent=4)
+    return 1 if result['failedFiles'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
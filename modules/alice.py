@@ -1,38 +1,30 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import json, os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,9 +44,7 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 1
 
 def handleAlice(filename, estimate):
-    global ESTIMATE
-    totalTokens = [0,0]
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
     if estimate:
         start = time.time()
@@ -63,22 +53,20 @@ def handleAlice(filename, estimate):
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            totalTokens[0] += translatedData[1][0]
-            totalTokens[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', totalTokens, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='UTF-8') as outFile:
+            with open(outputPath(filename), 'w', encoding='UTF-8') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -86,17 +74,16 @@ def handleAlice(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    totalTokens[0] += translatedData[1][0]
-                    totalTokens[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', totalTokens, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='UTF-8') as f:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='UTF-8') as f:
         translatedData = parseText(f, filename)
     
     return translatedData
@@ -130,9 +117,8 @@ def parseText(data, filename):
     linesList = data.readlines()
     totalTokens = [0, 0]
     totalLines = len(linesList)
-    global LOCK
     
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
         try:
@@ -229,7 +215,7 @@ def translateLines(linesList, pbar):
                         # Mismatch
                         else:
                             pbar.write(f'Mismatch: {batchStartIndex} - {i}')
-                            MISMATCH.append(batch)
+                            currentRun().addMismatch(batch)
                             batchStartIndex = i
                             batch.clear()
 
@@ -443,7 +429,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -505,7 +491,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
     totalTokens = [0, 0]
     if isinstance(text, list):
@@ -532,8 +518,9 @@ def translateGPT(text, history, fullPromptFlag):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -551,6 +538,7 @@ def translateGPT(text, history, fullPromptFlag):
             tList[index] = extractedTranslations
             if len(tItem) != len(translatedTextList):
                 mismatch = True     # Just here so breakpoint can be set
+                increment('mismatches_total')
             history = extractedTranslations[-10:]  # Update history if we have a list
         else:
             # Ensure we're passing a single string to extractTranslation
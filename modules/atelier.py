@@ -1,23 +1,19 @@
 import os
-from pathlib import Path
 import re
 import textwrap
-import threading
 import time
 import traceback
 import tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
 import openai
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, readPrompt, readVocab, retryRequest
+from modules.metrics import recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
@@ -25,17 +21,14 @@ TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE=os.getenv('language').capitalize()
 INPUTAPICOST = .002 # Depends on the model https://openai.com/pricing
 OUTPUTAPICOST = .002
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads')) # Controls how many threads are working on a single file (May have to drop this)
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 40
 MAXHISTORY = 10
-ESTIMATE = ''
 totalTokens = [0, 0]
-NAMESLIST = []
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -47,8 +40,7 @@ FIXTEXTWRAP = True
 IGNORETLTEXT = True
 
 def handleAtelier(filename, estimate):
-    global ESTIMATE, totalTokens
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
     if estimate:
         start = time.time()
@@ -57,15 +49,13 @@ def handleAtelier(filename, estimate):
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            totalTokens[0] += translatedData[1][0]
-            totalTokens[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
-        return getResultString(['', totalTokens, None], end - start, 'TOTAL')
+        return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
+            with open(outputPath(filename), 'w', encoding='utf-8') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
                 outFile.writelines(translatedData[0])
@@ -73,16 +63,15 @@ def handleAtelier(filename, estimate):
                 # Print Result
                 end = time.time()
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    totalTokens[0] += translatedData[1][0]
-                    totalTokens[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception:
             return 'Fail'
 
-    return getResultString(['', totalTokens, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='UTF-8') as f:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='UTF-8') as f:
         translatedData = parseText(f, filename)
     
     return translatedData
@@ -112,13 +101,12 @@ def getResultString(translatedData, translationTime, filename):
         
 def parseText(data, filename):
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     linesList = data.readlines()
     totalLines = len(linesList)
     
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
         try:
@@ -289,7 +277,7 @@ def resubVars(translatedText, allList):
     #     translatedText = re.sub(r'\s*(\\+c\[0+\])', r'\1', translatedText)
     return translatedText
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(t, history, fullPromptFlag):
     # Sub Vars
     varResponse = subVars(t)
@@ -300,7 +288,8 @@ def translateGPT(t, history, fullPromptFlag):
         return(t, [0,0])
     
     # If ESTIMATE is True just count this as an execution and return.
-    if ESTIMATE:
+    if currentRun().estimate:
+        advanceOverall(subbedT)
         enc = tiktoken.encoding_for_model('gpt-4')
         historyRaw = ''
         if isinstance(history, list):
@@ -1,8 +1,18 @@
-import sys, os, traceback
+import json, sys, os, traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from colorama import Fore
 from tqdm import tqdm
 from dotenv import load_dotenv
+from modules.scheduler import scheduleFiles
+from modules.pipeline import pipelineConfig, runPipeline
+from modules.run import TranslationRun, activeRun, bindContext
+from modules.progress import startOverall, trackedHandler, trackedStage
+from modules.metrics import METRICS, MetricsExporter
+from modules.profiler import PROFILER, addProfileArguments
+from modules.tracing import TRACER, addTraceArguments
+from modules.engines import getEngine, loadEngine
+from modules.batch import runBatch
+from modules.daemon import serve
 import argparse
 import time
 
@@ -18,49 +28,13 @@ if envMissing:
     tqdm.write(Fore.RED + f'Some of the required environment values may not be set correctly. You can set \
 these values using an .env file, for an example see .env.example')
 
-
-from modules.rpgmakermvmz import handleMVMZ
-from modules.rpgmakerace import handleACE
-from modules.csv import handleCSV
-from modules.eushully import handleEushully
-from modules.alice import handleAlice
-from modules.tyrano import handleTyrano
-from modules.json import handleJSON
-from modules.kansen import handleKansen
-from modules.lune import handleLune
-from modules.atelier import handleAtelier
-from modules.anim import handleAnim
-from modules.nscript import handleOnscripter
-from modules.wolf import handleWOLF
-from modules.wolf2 import handleWOLF2
-from modules.javascript import handleJavascript
-from modules.irissoft import handleIris
-from modules.regex import handleRegex
-
 # For GPT4 rate limit will be hit if you have more than 1 thread.
 # 1 Thread for each file. Controls how many files are worked on at once.
 THREADS = int(os.getenv('fileThreads'))
 
-# [Display name, file extension, handle function]
-MODULES = [
-    ["RPGMaker MV/MZ", "json", handleMVMZ],
-    ["RPGMaker ACE", "yaml", handleACE],
-    ["CSV (From Translator++)", "csv", handleCSV],
-    ["Eushully", "csv", handleEushully],
-    ["Alice", "txt", handleAlice],
-    ["Tyrano", "ks", handleTyrano],
-    ["JSON", "json", handleJSON],
-    ["Kansen", "ks", handleKansen],
-    ["Lune", "json", handleLune],
-    ["Atelier", "txt", handleAtelier],
-    ["Anim", "json", handleAnim],
-    ["NScript", "txt", handleOnscripter],
-    ["Wolf", "json", handleWOLF],
-    ["Wolf", "txt", handleWOLF2],
-    ["Javascript", "js", handleJavascript],
-    ["Iris", "txt", handleIris],
-    ["Regex", "txt", handleRegex],
-]
+# Engines in the order they are numbered for --engine. Modules are only imported once picked.
+MODULES = [getEngine(key) for key in ['mvmz', 'ace', 'csv', 'eushully', 'alice', 'tyrano', 'json', 'kansen', 'lune',
+    'atelier', 'anim', 'nscript', 'wolf', 'wolf2', 'javascript', 'iris', 'regex', 'rvdata2', 'wolfdata']]
 
 # Info Message
 tqdm.write(Fore.LIGHTYELLOW_EX + "WARNING: Once the translation starts do not close it unless you want to lose your \
@@ -74,12 +48,50 @@ def main():
     # Generate the help string
     help_string = "Select game engine by providing the corresponding number:\n"
     for i, module in enumerate(MODULES, start=1):
-        help_string += f"{i} for {module[0]}\n"
+        help_string += f"{i} for {module[1]}\n"
 
     # Add the arguments
-    parser.add_argument('--engine', type=int, help=help_string)
+    parser.add_argument('--engine', help=help_string)
+
+    # Headless batch mode
+    parser.add_argument('--project', action='append', help='Project folder with a files folder inside. Can be repeated, every \
+project uses --engine, which can also be an engine key (mvmz, ace, ...) or auto. Runs without waiting and exits with 0 (ok), \
+1 (failed files), 2 (mismatches) or 3 (bad project or engine).')
+    parser.add_argument('--batch', help='JSON file with a list of {"project": folder, "engine": key, number or auto, "estimate": bool}.')
+    parser.add_argument('--summary', help='Write the JSON summary of a batch run here instead of printing it.')
+    parser.add_argument('--reinject', help='Traffic log recorded with apiRecord. Rewrites every --project/--batch output from \
+the translations in it without calling the API, so width, listWidth, noteWidth and the module wrap flags can be changed \
+without translating again. Lines that are not in the log fail their file.')
+
+    # Daemon mode
+    parser.add_argument('--daemon', action='store_true', help='Stay running and take jobs over a local HTTP API, see modules/daemon.py.')
+    parser.add_argument('--port', type=int, default=int(os.getenv('daemonPort', 8642)), help='Port for --daemon, only bound on 127.0.0.1.')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of a port.')
+
+    addProfileArguments(parser)
+    addTraceArguments(parser)
 
     args = parser.parse_args()
+    if args.reinject:
+        if not (args.project or args.batch):
+            parser.error('--reinject needs --project or --batch')
+        if not os.path.exists(args.reinject):
+            parser.error(f'{args.reinject} does not exist')
+
+        # Replay only, a request that isn't in the log must not reach the API
+        os.environ['apiReplay'] = args.reinject
+        os.environ.pop('apiRecord', None)
+    if args.profile or args.profile_dump:
+        PROFILER.start(args.profile_dump)
+    if args.trace:
+        TRACER.start(args.trace)
+
+    if args.daemon:
+        serve(THREADS, args.port, args.socket)
+        return
+
+    if args.project or args.batch:
+        sys.exit(batchMain(args))
 
     estimate = args.estimate
     print("estimate: ", estimate)
@@ -97,12 +109,12 @@ def main():
 
     version = args.engine
     version = int(version) - 1
-    print("version: ", MODULES[version][2])
+    print("version: ", MODULES[version][1])
     # if version not in [str(i+1) for i in range(len(MODULES))]:
     #     while True:
     #         tqdm.write("Select game engine:\n")
     #         for position, module in enumerate(MODULES):
-    #             tqdm.write(f'{str(position + 1).rjust(2)}. {module[0]} (.{module[1]})')
+    #             tqdm.write(f'{str(position + 1).rjust(2)}. {module[1]} (.{module[2]})')
     #         version = input()
     #         try:
     #             version = int(version) - 1
@@ -114,17 +126,48 @@ def main():
     totalCost = Fore.RED + 'Translation module didn\'t return the total cost. Make sure the \
 files to translate are in the /files folder and that you picked the right game engine.'
 
-    # Open File (Threads)
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = [executor.submit(MODULES[version][2], filename, estimate) \
-                    for filename in os.listdir("files") if filename.endswith(MODULES[version][1])]
-                    
-        for future in as_completed(futures):
-            try:
-                totalCost = future.result()
-            except Exception as e:
-                tracebackLineNo = str(traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
-                tqdm.write(Fore.RED + str(e) + '|' + tracebackLineNo + Fore.RESET)
+    # Import only the selected engine
+    handler, stages = loadEngine(MODULES[version])
+
+    # Every file of this run shares one set of caches and token counters
+    run = TranslationRun(estimate, {'engine': MODULES[version][0]})
+    with activeRun(run), MetricsExporter():
+        # Largest files first
+        filenames = scheduleFiles('files', MODULES[version][2])
+
+        # One bar and ETA for the whole run
+        run.overall = startOverall('files', filenames)
+
+        # Open File (Pipeline)
+        if stages is not None:
+            loadStage, translateStage, writeStage = stages
+            loadWorkers, writeWorkers, queueSize = pipelineConfig(THREADS)
+            stages = [
+                ['load', loadStage, loadWorkers],
+                ['translate', trackedStage(translateStage), THREADS],
+                ['write', writeStage, writeWorkers],
+            ]
+            for job, result, error in runPipeline([[filename, estimate] for filename in filenames], stages, queueSize):
+                if error is None:
+                    totalCost = result
+                else:
+                    tracebackLineNo = str(traceback.extract_tb(error.__traceback__)[-1].lineno)
+                    tqdm.write(Fore.RED + job[0] + ': ' + str(error) + '|' + tracebackLineNo + Fore.RESET)
+
+        # Open File (Threads)
+        else:
+            with ThreadPoolExecutor(max_workers=THREADS) as executor:
+                futures = [executor.submit(bindContext(trackedHandler(handler)), filename, estimate) for filename in filenames]
+                        
+                for future in as_completed(futures):
+                    try:
+                        totalCost = future.result()
+                    except Exception as e:
+                        tracebackLineNo = str(traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
+                        tqdm.write(Fore.RED + str(e) + '|' + tracebackLineNo + Fore.RESET)
+
+    if run.overall is not None:
+        run.overall.close()
 
     if totalCost != 'Fail':
         if estimate is False:
@@ -133,9 +176,32 @@ files to translate are in the /files folder and that you picked the right game e
 
         tqdm.write(str(totalCost))
 
+    PROFILER.report()
+    TRACER.write()
+
     print("Process completed you may close this window, closing automatically in 10 seconds...")
     time.sleep(10)
 
+def batchMain(args):
+    queue = [[project, args.engine or 'auto', args.estimate] for project in args.project or []]
+    if args.batch:
+        with open(args.batch, 'r', encoding='utf-8') as f:
+            for entry in json.load(f):
+                queue.append([entry['project'], str(entry.get('engine', 'auto')), entry.get('estimate', args.estimate)])
+
+    with MetricsExporter():
+        summary, code = runBatch(queue, THREADS)
+    summary['exitCode'] = code
+    summary['metrics'] = METRICS.snapshot()
+    PROFILER.report()
+    TRACER.write()
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as outFile:
+            json.dump(summary, outFile, ensure_ascii=False, indent=4)
+    else:
+        print(json.dumps(summary, ensure_ascii=False, indent=4))
+    return code
+
 def deleteFolderFiles(folderPath):
     for filename in os.listdir(folderPath):
         file_path = os.path.join(folderPath, filename)
@@ -0,0 +1,195 @@
+# Libraries
+import importlib, os, threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.scheduler import scheduleFiles
+from modules.pipeline import pipelineConfig, runPipeline
+from modules.run import TranslationRun, activeRun, bindContext, currentRun
+from modules.progress import startOverall, trackFile
+from modules.engines import ENGINES, getEngine, loadEngine, sniffEngines
+
+# Exit codes
+EXITOK = 0
+EXITFAILED = 1      # At least one file raised or returned 'Fail', or the run was cancelled
+EXITMISMATCH = 2    # Everything finished but some files had mismatched batches
+EXITUSAGE = 3       # Bad queue entry (missing folder, unknown engine, no files)
+
+def resolveEngine(engine, project):
+    """
+    Engine can be a registry key ('mvmz'), a 1 based position in ENGINES or 'auto' to sniff
+    it from the file names in the project's files folder.
+    """
+    if engine == 'auto':
+        candidates = sniffEngines(os.path.join(project, 'files'))
+        if len(candidates) == 0:
+            raise ValueError(f'Could not detect the engine for {project}')
+        return getEngine(candidates[0])
+    if str(engine).isdigit():
+        return ENGINES[int(engine) - 1]
+    return getEngine(engine)
+
+def fileCost(module, tokens):
+    # Pricing globals are only set for known models
+    inputCost = getattr(module, 'INPUTAPICOST', 0)
+    outputCost = getattr(module, 'OUTPUTAPICOST', 0)
+    return (tokens[0] * .001 * inputCost) + (tokens[1] * .001 * outputCost)
+
+def runProject(project, engineKey, estimate, threads, files=None, run=None):
+    """
+    Translates (or estimates) every file in project/files with one engine and returns a
+    summary dict with a record per file. The engine module, prompt, vocab and HTTP client
+    stay loaded between projects, only the run (names, mismatches, tokens) is new.
+
+    files   - Only these file names instead of the whole folder.
+    run     - TranslationRun to use, so the caller can cancel it or seed its caches.
+    """
+    summary = {'project': project, 'engine': engineKey, 'estimate': estimate, 'files': [], 'error': None, 'cancelled': False, 'seconds': 0.0}
+    start = time.time()
+    try:
+        engine = resolveEngine(engineKey, project)
+        summary['engine'] = engine[0]
+        if not os.path.isdir(os.path.join(project, 'files')):
+            raise ValueError(f'{project} has no files folder')
+    except (KeyError, IndexError, ValueError) as e:
+        summary['error'] = str(e)
+        return summary
+
+    # Engines read files/ and write translated/ under the run's root, so the process never
+    # changes folder and cache, metrics and trace files stay in the launch folder.
+    handler, stages = loadEngine(engine)
+    module = importlib.import_module(engine[3])
+    root = os.path.abspath(project)
+    try:
+        os.makedirs(os.path.join(root, 'translated'), exist_ok=True)
+        filenames = scheduleFiles(os.path.join(root, 'files'), engine[2])
+        if files is not None:
+            filenames = [filename for filename in filenames if filename in files]
+        if len(filenames) == 0:
+            summary['error'] = f'No .{engine[2]} files in {project}/files'
+            return summary
+
+        if run is None:
+            run = TranslationRun(estimate, {'engine': engine[0], 'project': project})
+        run.root = root
+        run.overall = startOverall(os.path.join(root, 'files'), filenames)
+        try:
+            with activeRun(run):
+                if stages is not None:
+                    records = runStaged(stages, filenames, estimate, threads)
+                else:
+                    records = runThreaded(handler, filenames, estimate, threads, run)
+        finally:
+            if run.overall is not None:
+                run.overall.close()
+        summary['cancelled'] = run.cancelled()
+
+        for filename in filenames:
+            record = records.get(filename, {'tokens': [0, 0], 'seconds': 0.0, 'error': 'Not run'})
+            ioTimes = run.ioTimes.get(filename, {})
+            summary['files'].append({
+                'file': filename,
+                'inputTokens': record['tokens'][0],
+                'outputTokens': record['tokens'][1],
+                'cost': round(fileCost(module, record['tokens']), 6),
+                'seconds': round(record['seconds'], 3),
+                'loadSeconds': round(ioTimes.get('load', 0.0), 3),
+                'dumpSeconds': round(ioTimes.get('dump', 0.0), 3),
+                'mismatch': filename in run.mismatch,
+                'error': record['error'],
+            })
+    finally:
+        summary['seconds'] = round(time.time() - start, 3)
+    return summary
+
+def runThreaded(handler, filenames, estimate, threads, run):
+    records = {}
+    recordsLock = threading.Lock()
+
+    def measured(filename):
+        # Handlers add their file's tokens on their own thread, so the difference in this
+        # thread's counter is what the file used.
+        counter = run.counter()
+        before = list(counter)
+        start = time.time()
+        error = None
+        try:
+            run.checkCancelled()
+            with trackFile(filename):
+                if handler(filename, estimate) == 'Fail':
+                    error = 'Fail'
+        except Exception as e:
+            traceback.print_exc()
+            error = f'{type(e).__name__}: {e}'
+        with recordsLock:
+            records[filename] = {
+                'tokens': [counter[0] - before[0], counter[1] - before[1]],
+                'seconds': time.time() - start,
+                'error': error,
+            }
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(bindContext(measured), filename) for filename in filenames]
+        for future in as_completed(futures):
+            future.result()
+    return records
+
+def runStaged(stages, filenames, estimate, threads):
+    records = {}
+    recordsLock = threading.Lock()
+    loadStage, translateStage, writeStage = stages
+
+    def load(job):
+        currentRun().checkCancelled()
+        return loadStage(job)
+
+    def translate(job):
+        with trackFile(job[0]):
+            job = translateStage(job)
+        filename, _, translatedData, translationTime = job
+        error = translatedData[2] if len(translatedData) > 2 else None
+        with recordsLock:
+            records[filename] = {
+                'tokens': list(translatedData[1]),
+                'seconds': translationTime,
+                'error': None if error is None else f'{type(error).__name__}: {error}',
+            }
+        return job
+
+    def write(job):
+        result = writeStage(job)
+        if result == 'Fail':
+            with recordsLock:
+                records[job[0]]['error'] = 'Fail'
+        return result
+
+    loadWorkers, writeWorkers, queueSize = pipelineConfig(threads)
+    pipeline = [
+        ['load', load, loadWorkers],
+        ['translate', translate, threads],
+        ['write', write, writeWorkers],
+    ]
+    for job, result, error in runPipeline([[filename, estimate] for filename in filenames], pipeline, queueSize):
+        if error is not None:
+            with recordsLock:
+                record = records.setdefault(job[0], {'tokens': [0, 0], 'seconds': 0.0, 'error': None})
+                record['error'] = f'{type(error).__name__}: {error}'
+    return records
+
+def runBatch(queue, threads):
+    """
+    Runs queue, a list of [project folder, engine, estimate], back to back and returns
+    [summary, exit code]. Exit code is the worst of all projects.
+    """
+    start = time.time()
+    projects = [runProject(project, engine, estimate, threads) for project, engine, estimate in queue]
+    return [{'projects': projects, 'seconds': round(time.time() - start, 3)}, exitCode(projects)]
+
+def exitCode(projects):
+    code = EXITOK
+    for project in projects:
+        if project['error'] is not None:
+            return EXITUSAGE
+        if project['cancelled'] or any(record['error'] is not None for record in project['files']):
+            code = EXITFAILED
+        elif code == EXITOK and any(record['mismatch'] for record in project['files']):
+            code = EXITMISMATCH
+    return code
@@ -1,40 +1,33 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai, csv
+import json, os, re, textwrap, time, traceback, tiktoken, csv
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, getProgress, inputPath, outputPath, setProgress, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = int(os.getenv('noteWidth'))
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = True    # Ignores all translated text.
-MISMATCH = []   # Lists files that thdata a mismatch error (Length of GPT list response is wrong)
 BRACKETNAMES = False
+CSVFORMAT = os.getenv('csvFormat', '')   # 1, 2 or 3 skips the format prompt (unattended runs)
 
 # Pricing - Depends on the model https://openai.com/pricing
 # Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
@@ -54,14 +47,12 @@ elif 'gpt-4' in MODEL:
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
 POSITION = 0
 LEAVE = False
-PBAR = None
 
 def handleCSV(filename, estimate):
-    global ESTIMATE, TOKENS
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if not ESTIMATE:
-        with open('translated/' + filename, 'w+t', newline='', encoding='utf-8-sig') as writeFile:
+    if not run.estimate:
+        with open(outputPath(filename), 'w+t', newline='', encoding='utf-8-sig') as writeFile:
             # Translate
             start = time.time()
             translatedData = openFiles(filename, writeFile)
@@ -69,9 +60,7 @@ def handleCSV(filename, estimate):
             # Print Result
             end = time.time()
             tqdm.write(getResultString(translatedData, end - start, filename))
-            with LOCK:
-                TOKENS[0] += translatedData[1][0]
-                TOKENS[1] += translatedData[1][1]
+            run.addTokens(translatedData[1])
     else:
         # Translate
         start = time.time()
@@ -80,28 +69,28 @@ def handleCSV(filename, estimate):
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
 
     # Print Total
-    totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
     # Print any errors on maps
-    if len(MISMATCH) > 0:
-        return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+    if len(run.mismatch) > 0:
+        return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
     else:
         return totalString
 
 def openFiles(filename, writeFile):
-    with open('files/' + filename, 'r', encoding='utf-8-sig') as readFile, writeFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='utf-8-sig') as readFile, writeFile:
         translatedData = parseCSV(readFile, writeFile, filename)
 
     return translatedData
 
 def openFilesEstimate(filename):
-    with open('files/' + filename, 'r', encoding='utf-8-sig') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='utf-8-sig') as readFile:
         translatedData = parseCSV(readFile, '', filename)
 
     return translatedData
@@ -132,9 +121,8 @@ def getResultString(translatedData, translationTime, filename):
 def parseCSV(readFile, writeFile, filename):
     totalTokens = [0,0]
     totalLines = 0
-    global LOCK
 
-    format = ''
+    format = CSVFORMAT
     while format not in ['1', '2', '3']:
         format = input('\n\nSelect the CSV Format:\n\n1. Translator++\n2. Single\n3. Multiple\n')
         match format:
@@ -150,12 +138,12 @@ def parseCSV(readFile, writeFile, filename):
     readFile.seek(0)
 
     reader = csv.reader(readFile, delimiter=',')
-    if not ESTIMATE:
+    if not currentRun().estimate:
         writer = csv.writer(writeFile, delimiter=',', quotechar='\"')
     else:
         writer = ''
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
 
@@ -165,20 +153,20 @@ def parseCSV(readFile, writeFile, filename):
             data.append(row)
 
         try:
-            response = translateCSV(data, pbar, writer, filename, None, format)
+            response = translateCSV(data, pbar, writer, filename, format)
             totalTokens[0] = response[0]
             totalTokens[1] = response[1]
         except Exception:
             traceback.print_exc()
     return [data, totalTokens, None]
 
-def translateCSV(data, pbar, writer, filename, translatedList, format):
-    global LOCK, ESTIMATE, PBAR
-    PBAR = pbar
+def translateCSV(data, pbar, writer, filename, format):
+    setProgress(pbar)
     translatedText = ''
     totalTokens = [0,0]
     i = 0
     stringList = []
+    targets = []
 
     try:
         # Translate
@@ -193,22 +181,9 @@ def translateCSV(data, pbar, writer, filename, translatedList, format):
                         # Remove Textwrap
                         jaString = jaString.replace('\n', ' ')
 
-                        # Pass 1
-                        if not translatedList:
-                            stringList.append(jaString)
-
-                        # Pass 2
-                        else:
-                            # Grab and Pop
-                            translatedText = translatedList[0]
-                            translatedList.pop(0)
-
-                            # Add Wordwrap
-                            translatedText = textwrap.fill(translatedText, WIDTH)
-                            translatedText = translatedText.replace('\n', '\\n')
-
-                            # Set Data
-                            data[i][1] = translatedText
+                        # Add String and the cell its translation goes into
+                        stringList.append(jaString)
+                        targets.append([i, 1])
                         
                     # Iterate
                     i += 1
@@ -225,22 +200,9 @@ def translateCSV(data, pbar, writer, filename, translatedList, format):
                     # Remove Textwrap
                     jaString = jaString.replace('\n', ' ')
 
-                    # Pass 1
-                    if not translatedList:
-                        stringList.append(jaString)
-
-                    # Pass 2
-                    else:
-                        # Grab and Pop
-                        translatedText = translatedList[0]
-                        translatedList.pop(0)
-
-                        # Add Wordwrap
-                        translatedText = textwrap.fill(translatedText, WIDTH)
-                        translatedText = translatedText.replace('\n', '\\n')
-
-                        # Set Data
-                        data[i][targetColumn] = translatedText
+                    # Add String
+                    stringList.append(jaString)
+                    targets.append([i, targetColumn])
                         
                     # Iterate
                     i += 1
@@ -262,25 +224,9 @@ def translateCSV(data, pbar, writer, filename, translatedList, format):
                             # Remove Textwrap
                             jaString = jaString.replace('\n', ' ')
 
-                            # Pass 1
-                            if not translatedList:
-                                stringList.append(jaString)
-
-                            # Pass 2
-                            else:
-                                # Grab and Pop
-                                translatedText = translatedList[0]
-                                translatedList.pop(0)
-
-                                # Add Wordwrap
-                                translatedText = textwrap.fill(translatedText, WIDTH)
-                                translatedText = translatedText.replace('\n', '\\n')
-
-                                # Set Data
-                                if targetNextRow:
-                                    data[i][j + 1] = translatedText
-                                else:
-                                    data[i][j] = translatedText
+                            # Add String
+                            stringList.append(jaString)
+                            targets.append([i, j + 1 if targetNextRow else j])
                         
                     # Iterate
                     i += 1
@@ -299,28 +245,30 @@ def translateCSV(data, pbar, writer, filename, translatedList, format):
 
             # Set Strings
             if len(stringList) == len(translatedList):
-                translateCSV(data, pbar, writer, filename, translatedList, format)
+                for [row, column], translatedText in zip(targets, translatedList):
+                    # Add Wordwrap
+                    translatedText = textwrap.fill(translatedText, WIDTH)
+                    translatedText = translatedText.replace('\n', '\\n')
+
+                    # Set Data
+                    data[row][column] = translatedText
 
             # Mismatch
             else:
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
 
             # Write all Data
-            with LOCK:
-                if not ESTIMATE:
-                    for row in data:
-                        writer.writerow(row)
+            if not currentRun().estimate:
+                for row in data:
+                    writer.writerow(row)
 
     except Exception:
         traceback.print_exc()
 
         # Write all Data
-        with LOCK:
-            if not ESTIMATE:
-                for row in data:
-                    writer.writerow(row)
+        if not currentRun().estimate:
+            for row in data:
+                writer.writerow(row)
         return totalTokens
     
     return totalTokens
@@ -328,6 +276,7 @@ def translateCSV(data, pbar, writer, filename, translatedList, format):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -335,7 +284,7 @@ def getSpeaker(speaker):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
@@ -347,13 +296,14 @@ def getSpeaker(speaker):
                     response[0] = response[0].replace("'S", "'s")
 
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -538,7 +488,7 @@ def translateText(characters, system, user, history, penalty):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0,
         frequency_penalty=penalty,
         model=MODEL,
@@ -590,8 +540,14 @@ def extractTranslation(translatedTextList, is_list):
         if is_list:
             string_list = list(line_dict.values())
             return string_list
+        # A single string can come back tagged too ({"Line1": ...}), or as plain JSON text
+        if isinstance(line_dict, dict) and len(line_dict) > 0:
+            return str(next(iter(line_dict.values())))
+        return translatedTextList
     except Exception as e:
-        print(e)
+        # Not JSON, the reply is the translation itself
+        if is_list:
+            print(e)
         return translatedTextList
 
 def countTokens(characters, system, user, history):
@@ -619,9 +575,8 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
-    global PBAR
     
     mismatch = False
     totalTokens = [0, 0]
@@ -651,8 +606,9 @@ def translateGPT(text, history, fullPromptFlag):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -680,6 +636,7 @@ def translateGPT(text, history, fullPromptFlag):
                     extractedTranslations = extractTranslation(translatedText, True)
                     if len(tItem) != len(extractedTranslations):
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
             
             # Set if no mismatch
             if mismatch == False:
@@ -690,9 +647,9 @@ def translateGPT(text, history, fullPromptFlag):
                 mismatch = False
 
             # Update Loading Bar
-            with LOCK:
-                if PBAR is not None:
-                    PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
         else:
             # Ensure we're passing a single string to extractTranslation
             extractedTranslations = extractTranslation(translatedText, False)
@@ -0,0 +1,201 @@
+# Libraries
+import json, os, queue, socketserver, threading, time, traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from modules.batch import runProject
+from modules.run import TranslationRun
+from modules.metrics import METRICS, MetricsExporter
+
+class Daemon:
+    """
+    Keeps the process, the imported engines, the tokenizer, the OpenAI connection pool and
+    the prompt/vocab resident and runs translation jobs one after another. Relative project
+    folders are resolved against the folder the daemon was started in. Each project keeps
+    its speaker names and other run caches between jobs.
+
+    A job is a dict with id, project, engine, estimate, files (None for all), state
+    (queued, running, done, failed, cancelled), summary and timestamps.
+    """
+    def __init__(self, threads):
+        self.threads = threads
+        self.root = os.getcwd()
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.nextID = 1
+        self.current = None
+        self.memory = {}
+        self.started = time.time()
+        self.worker = threading.Thread(target=self.work, name='daemon-worker', daemon=True)
+        self.worker.start()
+
+    def submit(self, project, engine='auto', estimate=False, files=None):
+        # Checked here so a bad request gets a 400 instead of failing later in the worker
+        if not isinstance(project, str):
+            raise ValueError('project must be a folder name')
+        if files is not None and (not isinstance(files, list) or not all(isinstance(filename, str) for filename in files)):
+            raise ValueError('files must be null or a list of file names')
+        project = os.path.normpath(os.path.join(self.root, project))
+        with self.lock:
+            job = {
+                'id': self.nextID,
+                'project': project,
+                'engine': engine,
+                'estimate': estimate,
+                'files': files,
+                'state': 'queued',
+                'summary': None,
+                'submitted': time.time(),
+                'started': None,
+                'finished': None,
+            }
+            self.jobs[job['id']] = job
+            self.nextID += 1
+        self.queue.put(job['id'])
+        return job
+
+    def cancel(self, jobID):
+        with self.lock:
+            job = self.jobs.get(jobID)
+            if job is None:
+                return None
+            if job['state'] == 'queued':
+                job['state'] = 'cancelled'
+            elif job['state'] == 'running' and self.current is not None:
+                self.current.cancel()
+            return job
+
+    def getJob(self, jobID):
+        with self.lock:
+            job = self.jobs.get(jobID)
+            return None if job is None else dict(job)
+
+    def status(self):
+        with self.lock:
+            return {
+                'uptime': round(time.time() - self.started, 1),
+                'queued': sum(1 for job in self.jobs.values() if job['state'] == 'queued'),
+                'running': next((job['id'] for job in self.jobs.values() if job['state'] == 'running'), None),
+                'projects': sorted(self.memory),
+                'jobs': [dict(job, summary=None) for job in self.jobs.values()],
+            }
+
+    def work(self):
+        while True:
+            jobID = self.queue.get()
+            with self.lock:
+                job = self.jobs[jobID]
+                if job['state'] != 'queued':
+                    continue
+
+                # Warm caches for this project from earlier jobs
+                memory = self.memory.setdefault(job['project'], {'names': [], 'caches': {}})
+                run = TranslationRun(job['estimate'], {'engine': job['engine'], 'project': job['project']})
+                run.names = memory['names']
+                run.caches = memory['caches']
+                self.current = run
+                job['state'] = 'running'
+                job['started'] = time.time()
+
+            try:
+                summary = runProject(job['project'], job['engine'], job['estimate'], self.threads, job['files'], run)
+                state = 'cancelled' if summary['cancelled'] else ('failed' if summary['error'] is not None else 'done')
+            except Exception as e:
+                traceback.print_exc()
+                summary = {'error': f'{type(e).__name__}: {e}'}
+                state = 'failed'
+
+            with self.lock:
+                job['summary'] = summary
+                job['state'] = state
+                job['finished'] = time.time()
+                self.current = None
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    """
+    GET  /status                Daemon and job overview
+    GET  /metrics               Metrics in the Prometheus text format
+    GET  /jobs/<id>             One job with its summary
+    POST /jobs                  {"project": folder, "engine": key, number or auto, "estimate": bool, "files": [names]}
+    POST /jobs/<id>/cancel      Cancel a queued or running job
+    """
+    daemon = None
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['status']:
+            return self.reply(200, self.daemon.status())
+        if parts == ['metrics']:
+            return self.replyText(200, METRICS.toPrometheus())
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.daemon.getJob(int(parts[1]))
+            if job is None:
+                return self.reply(404, {'error': 'Unknown job'})
+            return self.reply(200, job)
+        self.reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                job = self.daemon.submit(body['project'], str(body.get('engine', 'auto')), bool(body.get('estimate', False)), body.get('files'))
+            except (KeyError, TypeError, ValueError) as e:
+                return self.reply(400, {'error': f'Bad job: {e}'})
+            return self.reply(202, job)
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[1].isdigit() and parts[2] == 'cancel':
+            job = self.daemon.cancel(int(parts[1]))
+            if job is None:
+                return self.reply(404, {'error': 'Unknown job'})
+            return self.reply(200, {'id': job['id'], 'state': job['state']})
+        self.reply(404, {'error': 'Not found'})
+
+    def reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def replyText(self, code, text):
+        body = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(threads, port=None, socketPath=None):
+    """
+    Runs the daemon until interrupted. Listens on 127.0.0.1:port, or on a Unix socket when
+    socketPath is given.
+    """
+    DaemonHandler.daemon = Daemon(threads)
+    if socketPath is not None:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = UnixHTTPServer(socketPath, DaemonHandler)
+        address = socketPath
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', port), DaemonHandler)
+        address = f'http://127.0.0.1:{server.server_address[1]}'
+    print(f'Daemon listening on {address}', flush=True)
+    try:
+        with MetricsExporter():
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketPath is not None and os.path.exists(socketPath):
+            os.remove(socketPath)
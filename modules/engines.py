@@ -0,0 +1,80 @@
+# Libraries
+import importlib, os, re, threading
+from modules.profiler import PROFILER
+from modules.tracing import TRACER
+
+# Engine modules configure openai, read prompt.txt/vocab.txt and import tiktoken when they
+# are imported, so nothing here imports one until it is picked.
+
+RPGMAKERFILES = r'^(Map\d+|MapInfos|CommonEvents|Actors|Armors|Weapons|Classes|Enemies|Items|Skills|Troops|States|System|Scenario)'
+
+# [Key, display name, file extension, module, handle function, staged, file name sniffers]
+# Staged engines also provide loadFile, translateFile and writeFile and run as a pipeline.
+ENGINES = [
+    ['mvmz', 'RPGMaker MV/MZ', 'json', 'modules.rpgmakermvmz', 'handleMVMZ', True, [RPGMAKERFILES + r'\.json$']],
+    ['plugin', 'RPGMaker Plugins', 'js', 'modules.rpgmakerplugin', 'handlePlugin', False, [r'^plugins\.js$']],
+    ['ace', 'RPGMaker ACE', 'yaml', 'modules.rpgmakerace', 'handleACE', True, [RPGMAKERFILES + r'\.yaml$']],
+    ['csv', 'CSV (From Translator++)', 'csv', 'modules.csv', 'handleCSV', False, [r'\.csv$']],
+    ['eushully', 'Eushully', 'txt', 'modules.eushully', 'handleEushully', False, []],
+    ['alice', 'Alice', 'txt', 'modules.alice', 'handleAlice', False, []],
+    ['tyrano', 'Tyrano', 'ks', 'modules.tyrano', 'handleTyrano', False, [r'\.ks$']],
+    ['json', 'JSON', 'json', 'modules.json', 'handleJSON', False, []],
+    ['kansen', 'Kansen', 'ks', 'modules.kansen', 'handleKansen', False, []],
+    ['lune', 'Lune', 'json', 'modules.lune', 'handleLune', False, []],
+    ['atelier', 'Atelier', 'txt', 'modules.atelier', 'handleAtelier', False, []],
+    ['anim', 'Anim', 'json', 'modules.anim', 'handleAnim', False, []],
+    ['nscript', 'NScript', 'txt', 'modules.nscript', 'handleOnscripter', False, []],
+    ['wolf', 'Wolf', 'json', 'modules.wolf', 'handleWOLF', False, [r'^(CommonEvent|DataBase|CDataBase|SysDataBase)\.json$']],
+    ['wolf2', 'Wolf', 'txt', 'modules.wolf2', 'handleWOLF2', False, []],
+    ['javascript', 'Javascript', 'js', 'modules.javascript', 'handleJavascript', False, []],
+    ['iris', 'Iris', 'txt', 'modules.irissoft', 'handleIris', False, []],
+    ['regex', 'Regex', 'txt', 'modules.regex', 'handleRegex', False, []],
+    ['rvdata2', 'RPGMaker ACE (rvdata2)', 'rvdata2', 'modules.rpgmakerace', 'handleACE', True, [RPGMAKERFILES + r'\.rvdata2$']],
+    ['wolfdata', 'Wolf (mps/dat)', 'mps|dat', 'modules.wolf', 'handleWOLF', False, [r'\.mps$', r'^(CommonEvent|DataBase|CDataBase|SysData[Bb]ase)\.dat$']],
+]
+
+LOADLOCK = threading.Lock()
+
+def getEngine(key):
+    for engine in ENGINES:
+        if engine[0] == key:
+            return engine
+    raise KeyError(f'Unknown engine {key}')
+
+def loadEngine(engine):
+    """
+    Imports the engine's module and returns [handle function, stages]. Stages is
+    [loadFile, translateFile, writeFile] for staged engines and None for the rest.
+    """
+    with LOADLOCK:
+        module = importlib.import_module(engine[3])
+        if PROFILER.enabled:
+            PROFILER.instrument(module)
+        if TRACER.enabled:
+            TRACER.instrument(module)
+    handler = getattr(module, engine[4])
+    stages = [module.loadFile, module.translateFile, module.writeFile] if engine[5] else None
+
+    # Book everything a handler or stage does to its file
+    if PROFILER.enabled:
+        handler = PROFILER.fileTask(handler)
+        if stages is not None:
+            stages = [PROFILER.fileTask(stage) for stage in stages]
+    if TRACER.enabled:
+        handler = TRACER.wrap(handler, 'file', 'file', 0)
+    return [handler, stages]
+
+def sniffEngines(folder):
+    """
+    Guesses the engine from the file names in folder without opening or importing anything.
+    Returns the keys of every engine whose sniffers match, best match first. Generic formats
+    (plain txt or json) have no sniffers and are never guessed.
+    """
+    filenames = os.listdir(folder)
+    matches = []
+    for engine in ENGINES:
+        count = sum(1 for filename in filenames if any(re.search(sniffer, filename) for sniffer in engine[6]))
+        if count > 0:
+            matches.append([count, engine[0]])
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return [match[1] for match in matches]
@@ -1,44 +1,36 @@
 # Libraries
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, getProgress, inputPath, outputPath, setProgress, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
+from modules.splice import spliceLines
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
 POSITION = 0
 LEAVE = False
-PBAR = None
 
 # Pricing - Depends on the model https://openai.com/pricing
 # Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
@@ -53,32 +45,29 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleEushully(filename, estimate):
-    global ESTIMATE
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='utf-8', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -86,14 +75,12 @@ def handleEushully(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -120,7 +107,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='utf-8') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='utf-8') as readFile:
         translatedData = parseRegex(readFile, filename)
 
         # Delete lines marked for deletion
@@ -139,11 +127,11 @@ def parseRegex(readFile, filename):
     data = readFile.readlines()
 
     # Create Progress Bar
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
-            result = translateEushully(data, pbar, filename, [])
+            result = translateEushully(data, pbar, filename)
             totalTokens[0] += result[0]
             totalTokens[1] += result[1]
         except Exception as e:
@@ -151,17 +139,15 @@ def parseRegex(readFile, filename):
             return [data, totalTokens, e]
     return [data, totalTokens, None]
 
-def translateEushully(data, pbar, filename, translatedList):
+def translateEushully(data, pbar, filename):
     stringList = []
+    patches = []
     currentGroup = []
     tokens = [0,0]
     speaker = ''
-    voice = False
-    global LOCK, ESTIMATE, PBAR
     i = 0
 
     while i < len(data):
-        voice = False
         # Speaker
         if 'mov (global-int 46e2)' in data[i]:
             # Get Speaker
@@ -179,61 +165,26 @@ def translateEushully(data, pbar, filename, translatedList):
             match = re.search(regex, data[i])
             # Grab Strings
             if match != None and match.group(2) != '':
-                originalString = match.group(2)
+                start = i
                 jaString = match.group(2)
                 currentGroup = [jaString]
                 while 'end-text-line' in data[i+1] and any(x in data[i+2] for x in ['show-text']):
-                    match = re.search(regex, data[i+2])
-                    if match != None:
-                        currentGroup.append(match.group(2))
-                        if translatedList == []:
-                            del(data[i])
-                            del(data[i])
+                    nextMatch = re.search(regex, data[i+2])
+                    if nextMatch == None:
+                        break
+                    match = nextMatch
+                    currentGroup.append(match.group(2))
+                    i += 2
                 jaString = ' '.join(currentGroup)
+
+                # The lines are replaced by the translation once it comes back
+                patches.append([start, i + 1, None, 'show-text', match.group(1), speaker])
                 
-                # Pass 1
-                if translatedList == []:
-                    # Add String
-                    if speaker:
-                        stringList.append(f'[{speaker}]: {jaString.strip()}')
-                    else:
-                        stringList.append(jaString.strip())
-                
-                # Pass 2
+                # Add String
+                if speaker:
+                    stringList.append(f'[{speaker}]: {jaString.strip()}')
                 else:
-                    # Get Text
-                    if translatedList:
-                        # Grab and Pop
-                        translatedText = translatedList[0]
-                        translatedList.pop(0)
-
-                        # Set to None if empty list
-                        if len(translatedList) <= 0:
-                            translatedList = None
-
-                        # Replace Quotes
-                        translatedText = translatedText.replace('"', "'")
-
-                        # Remove speaker
-                        if speaker != '':
-                            translatedText = re.sub(r'^\[?(.+?)\]?\s?[|:]\s?', '', translatedText)
-
-                        # Textwrap
-                        translatedText = textwrap.fill(translatedText, width=WIDTH)
-                        translatedTextList = translatedText.split('\n')
-
-                        # Set Data
-                        if len(translatedTextList) > 1:
-                            for j in range(len(translatedTextList)):
-                                if any(x in data[i] for x in ['show-text', 'set-string', 'concat']):
-                                    del(data[i])
-                                data.insert(i, f'{match.group(1)}"{translatedTextList[j]}"\n')
-                                i += 1
-                                if 'end-text-line' not in data[i]:
-                                    data.insert(i, 'end-text-line 0\n')
-                                i += 1
-                        else:
-                            data[i] = f'{match.group(1)}"{translatedTextList[0]}"\n'
+                    stringList.append(jaString.strip())
                 speaker = ''
                 i += 1
                 
@@ -250,37 +201,13 @@ def translateEushully(data, pbar, filename, translatedList):
             if match != None and match.group(2) != '':
                 originalString = match.group(2)
                 jaString = match.group(2)
-                currentGroup = [jaString]
                 
                 # Remove Textwrap
                 jaString = jaString.replace('\\n', ' ')
                 
-                # Pass 1
-                if translatedList == []:
-                    # Add String
-                    stringList.append(jaString.strip())
-                
-                # Pass 2
-                else:
-                    # Get Text
-                    if translatedList:
-                        # Grab and Pop
-                        translatedText = translatedList[0]
-                        translatedList.pop(0)
-
-                        # Set to None if empty list
-                        if len(translatedList) <= 0:
-                            translatedList = None
-
-                        # Replace Quotes
-                        translatedText = translatedText.replace('"', "'")
-
-                        # Textwrap
-                        translatedText = textwrap.fill(translatedText, width=LISTWIDTH)
-                        translatedText = translatedText.replace('\n', '\\n')
-
-                        # Set Data
-                        data[i] = data[i].replace(originalString, translatedText)   
+                # Add String
+                patches.append([i, i + 1, None, 'set-string', originalString, ''])
+                stringList.append(jaString.strip())
                 speaker = ''    
                 i += 1
 
@@ -297,7 +224,7 @@ def translateEushully(data, pbar, filename, translatedList):
         pbar.refresh()
         
         # Translate
-        PBAR = pbar
+        setProgress(pbar)
         response = translateGPT(stringList, '', True)
         tokens[0] += response[1][0]
         tokens[1] += response[1][1]
@@ -305,15 +232,52 @@ def translateEushully(data, pbar, filename, translatedList):
 
         # Set Strings
         if len(stringList) == len(translatedList):
-            translateEushully(data, pbar, filename, translatedList)
+            for patch, translatedText in zip(patches, translatedList):
+                patch[2] = scriptLines(data, patch, translatedText)
+            data[:] = spliceLines(data, [patch[:3] for patch in patches])
 
         # Mismatch
         else:
-            with LOCK:
-                if filename not in MISMATCH:
-                    MISMATCH.append(filename)
+            currentRun().addMismatch(filename)
     return tokens
 
+def scriptLines(data, patch, translatedText):
+    """
+    Lines replacing the ones patch covers. A show-text group becomes one show-text and
+    end-text-line pair per wrapped line, reusing the end-text-line after the group.
+    """
+    start, end, _, kind, original, speaker = patch
+
+    # Replace Quotes
+    translatedText = translatedText.replace('"', "'")
+
+    # Set String
+    if kind == 'set-string':
+        # Textwrap
+        translatedText = textwrap.fill(translatedText, width=LISTWIDTH)
+        translatedText = translatedText.replace('\n', '\\n')
+        return [data[start].replace(original, translatedText)]
+
+    # Remove speaker
+    if speaker != '':
+        translatedText = re.sub(r'^\[?(.+?)\]?\s?[|:]\s?', '', translatedText)
+
+    # Textwrap
+    translatedText = textwrap.fill(translatedText, width=WIDTH)
+    translatedTextList = translatedText.split('\n')
+    if len(translatedTextList) == 1:
+        return [f'{original}"{translatedTextList[0]}"\n']
+
+    lines = []
+    for j, text in enumerate(translatedTextList):
+        lines.append(f'{original}"{text}"\n')
+        if j == 0 and end < len(data) and 'end-text-line' in data[end]:
+            lines.append(data[end])
+            patch[1] += 1
+        else:
+            lines.append('end-text-line 0\n')
+    return lines
+
 # Save some money and enter the character before translation
 def getSpeaker(speaker):
     match speaker:
@@ -539,7 +503,7 @@ def translateText(characters, system, user, history, penalty):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0,
         frequency_penalty=penalty,
         model=MODEL,
@@ -623,9 +587,8 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
-    global PBAR
     
     mismatch = False
     totalTokens = [0, 0]
@@ -647,16 +610,18 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
-            if PBAR is not None:
-                PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             continue
 
         # Create Message
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -686,11 +651,12 @@ def translateGPT(text, history, fullPromptFlag):
                     tList[index] = extractedTranslations
                     if len(tItem) != len(extractedTranslations):
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
 
             # Create History
-            with LOCK:
-                if PBAR is not None:
-                    PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             if not mismatch:
                 history = extractedTranslations[-10:]  # Update history if we have a list
             else:
@@ -1,38 +1,31 @@
 # Libraries
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
+from modules.splice import spliceLines
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,32 +45,29 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleIris(filename, estimate):
-    global ESTIMATE
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='cp932', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='cp932', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -85,14 +75,12 @@ def handleIris(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -119,7 +107,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='shift_jis') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='shift_jis') as readFile:
         translatedData = parseIris(readFile, filename)
 
         # Delete lines marked for deletion
@@ -138,11 +127,11 @@ def parseIris(readFile, filename):
     data = readFile.readlines()
 
     # Create Progress Bar
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
-            result = translateIris(data, pbar, filename, [])
+            result = translateIris(data, pbar, filename)
             totalTokens[0] += result[0]
             totalTokens[1] += result[1]
         except Exception as e:
@@ -150,18 +139,21 @@ def parseIris(readFile, filename):
             return [data, totalTokens, e]
     return [data, totalTokens, None]
 
-def translateIris(data, pbar, filename, translatedList):
+def translateIris(data, pbar, filename):
     stringList = []
+    patches = []
+    groups = []
     currentGroup = []
     tokens = [0,0]
     speaker = ''
     voice = False
-    global LOCK, ESTIMATE
+    voiceVar = ''
     i = 0
 
     while i < len(data):
         voice = False
         speaker = ''
+        fullSpeaker = ''
         if '#MSGVOICE' in data[i]:
             i += 1
             voice = True
@@ -179,9 +171,10 @@ def translateIris(data, pbar, filename, translatedList):
                     speaker = response[0]
                     tokens[0] += response[1][0]
                     tokens[1] += response[1][1]
-                    if translatedList != []:
-                        speaker = speaker.replace(' ', '\u3000')
-                        data[i] = f'\u3000{speaker}\n'
+
+                    # Written back with the translations
+                    fullSpeaker = speaker.replace(' ', '\u3000')
+                    patches.append([i, i + 1, [f'\u3000{fullSpeaker}\n']])
                 else:
                     speaker = '' 
                 i += 1
@@ -189,104 +182,45 @@ def translateIris(data, pbar, filename, translatedList):
             # Lines
             match = re.search(r'(.*)', data[i])
             if match != None and match.group(1) != '':
-                # Pass 1
-                if translatedList == []:
-                    # Grab Consecutive Strings
-                    jaString = data[i]
-                    if data[i] != '\n':
-                        if data[i][0] == '\u3000':
+                # Grab Consecutive Strings
+                start = i
+                jaString = data[i]
+                if data[i] != '\n':
+                    if data[i][0] == '\u3000':
+                        jaString = data[i][1:]
+                    currentGroup.append(jaString)
+                    i += 1
+                    while data[i] != '\n':
+                        jaString = data[i]
+                        if data[i] != '\n':
                             jaString = data[i][1:]
                         currentGroup.append(jaString)
                         i += 1
-                        while data[i] != '\n':
-                            jaString = data[i]
-                            if data[i] != '\n':
-                                jaString = data[i][1:]
-                            currentGroup.append(jaString)
-                            i += 1
-                        
-                        # Join up 401 groups for better translation.
-                        if len(currentGroup) > 0:
-                            jaString = ''.join(currentGroup)
-                            currentGroup = []
-                        
-                        # Remove any textwrap
-                        jaString = jaString.replace('\n', ' ')
-
-                        # Temporarily convert spaces (For Textwrap Later)
-                        jaString = jaString.replace('\u3000', ' ')
-
-                        # Add Speaker (If there is one)
-                        if speaker != '':
-                            jaString = f'{speaker}: {jaString}'
-
-                        # Add String
-                        stringList.append(jaString.strip())
-                
-                # Pass 2
-                else:
-                    # Insert Strings
-                    while data[i] != '\n':
-                        data.pop(i)
-
-                    # Get Text
-                    if translatedList:
-                        translatedText = translatedList[0]
-                        translatedList.pop(0)
-                        if len(translatedList) <= 0:
-                            translatedList = None
-
-                        # Remove added speaker
-                        translatedText = re.sub(r'^.+?:\s', '', translatedText)
-
-                        # Textwrap
-                        translatedText = textwrap.fill(translatedText, width=WIDTH)
-                        translatedText = translatedText.replace('\n', '\n\u3000')
-
-                        # Replace Whitespace and Commas
-                        translatedText = translatedText.replace(', ', '、')
-                        translatedText = translatedText.replace(',\u3000', '、')
-                        translatedText = translatedText.replace(',', '、')
-                        translatedText = translatedText.replace(' ', '\u3000')
-
-                        # Set Data
-                        # Game crashes on more than 3 lines. Will need to create a new MSG for long translations
-                        if translatedText.count('\n') > 2:
-                            # Split List
-                            translatedTextList = splitNewlines(translatedText)
-
-                            # MSG Voice
-                            count = 0
-                            for text in translatedTextList:
-                                if count != 0:
-                                    if voice == True:
-                                        #MSG for each item in the list
-                                        data.insert(i, f'#MSGVOICE,\n')
-                                        i += 1
-                                        data.insert(i, f'{voiceVar}')
-                                        i += 1
-                                    else:
-                                        data.insert(i, f'#MSG,\n')
-                                        i += 1
-                                    if speaker:
-                                        data[i] = f'\u3000{speaker}\n'
-                                        i += 1
-                                if text[0] == '\u3000':
-                                    data.insert(i, f'{text}\n')
-                                else:
-                                    data.insert(i, f'\u3000{text}\n')
-                                i += 1
-                                count += 1
-                            if data[i] != '\n':
-                                data.insert(i, '\n')
-                                data[i] = f'\n{data[i]}'
-                        else:
-                            data.insert(i, f'\u3000{translatedText}\n')
-                            i += 1
-                            if data[i] != '\n':
-                                data[i] = f'\n{data[i]}'
-
-        elif '#SELECT' in data[i] and translatedList == []:
+
+                    # The message is replaced by its translation once it comes back
+                    patch = [start, i, None]
+                    patches.append(patch)
+                    groups.append([patch, fullSpeaker, voice, voiceVar])
+                    
+                    # Join up 401 groups for better translation.
+                    if len(currentGroup) > 0:
+                        jaString = ''.join(currentGroup)
+                        currentGroup = []
+                    
+                    # Remove any textwrap
+                    jaString = jaString.replace('\n', ' ')
+
+                    # Temporarily convert spaces (For Textwrap Later)
+                    jaString = jaString.replace('\u3000', ' ')
+
+                    # Add Speaker (If there is one)
+                    if speaker != '':
+                        jaString = f'{speaker}: {jaString}'
+
+                    # Add String
+                    stringList.append(jaString.strip())
+
+        elif '#SELECT' in data[i]:
             Iris = r'(.+?)	+\d$'
             i += 1
             match = re.search(Iris, data[i])
@@ -338,15 +272,47 @@ def translateIris(data, pbar, filename, translatedList):
 
         # Set Strings
         if len(stringList) == len(translatedList):
-            translateIris(data, pbar, filename, translatedList)
+            for [patch, speaker, voice, voiceVar], translatedText in zip(groups, translatedList):
+                patch[2] = messageLines(translatedText, speaker, voice, voiceVar)
+            data[:] = spliceLines(data, patches)
 
         # Mismatch
         else:
-            with LOCK:
-                if filename not in MISMATCH:
-                    MISMATCH.append(filename)
+            currentRun().addMismatch(filename)
     return tokens
 
+def messageLines(translatedText, speaker, voice, voiceVar):
+    # Remove added speaker
+    translatedText = re.sub(r'^.+?:\s', '', translatedText)
+
+    # Textwrap
+    translatedText = textwrap.fill(translatedText, width=WIDTH)
+    translatedText = translatedText.replace('\n', '\n\u3000')
+
+    # Replace Whitespace and Commas
+    translatedText = translatedText.replace(', ', '、')
+    translatedText = translatedText.replace(',\u3000', '、')
+    translatedText = translatedText.replace(',', '、')
+    translatedText = translatedText.replace(' ', '\u3000')
+
+    # Game crashes on more than 3 lines. Long translations continue in a new MSG
+    if translatedText.count('\n') <= 2:
+        return [f'\u3000{translatedText}\n']
+    lines = []
+    for count, text in enumerate(splitNewlines(translatedText)):
+        if count != 0:
+            if voice == True:
+                lines += ['#MSGVOICE,\n', voiceVar]
+            else:
+                lines.append('#MSG,\n')
+            if speaker:
+                lines.append(f'\u3000{speaker}\n')
+        if text[0] == '\u3000':
+            lines.append(f'{text}\n')
+        else:
+            lines.append(f'\u3000{text}\n')
+    return lines
+
 def splitNewlines(text):
     parts = []
     newline_count = 0  # Counts the number of newline characters encountered
@@ -370,6 +336,7 @@ def splitNewlines(text):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker, pbar, filename):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -377,18 +344,19 @@ def getSpeaker(speaker, pbar, filename):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with only the '+ LANGUAGE +' translation of the NPC name.', False, pbar, filename)
                 response[0] = response[0].replace("'S", "'s")
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -555,7 +523,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -631,7 +599,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag, pbar, filename):
     mismatch = False
     totalTokens = [0, 0]
@@ -659,8 +627,9 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -689,7 +658,7 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
                     if len(tItem) == len(extractedTranslations):
                         tList[index] = extractedTranslations
                     else:
-                        MISMATCH.append(filename)
+                        currentRun().addMismatch(filename)
             else:
                 tList[index] = extractedTranslations
 
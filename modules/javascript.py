@@ -1,38 +1,30 @@
 # Libraries
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,32 +44,29 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleJavascript(filename, estimate):
-    global ESTIMATE
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='utf8', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='utf8', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -85,14 +74,12 @@ def handleJavascript(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -119,7 +106,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='utf-8') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='utf-8') as readFile:
         translatedData = parseJS(readFile, filename)
     
     return translatedData
@@ -128,7 +116,7 @@ def parseJS(readFile, filename):
     totalTokens = [0,0]
     data = readFile.readlines()
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
@@ -346,7 +334,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -422,7 +410,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag, pbar):
     mismatch = False
     totalTokens = [0, 0]
@@ -450,8 +438,9 @@ def translateGPT(text, history, fullPromptFlag, pbar):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -482,6 +471,7 @@ def translateGPT(text, history, fullPromptFlag, pbar):
                         tList[index] = extractedTranslations
                     else:
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
 
             # Create History
             history = tList[index]  # Update history if we have a list
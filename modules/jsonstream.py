@@ -0,0 +1,184 @@
+# Libraries
+import json, os
+from modules.offload import compactLayout, serialiseJSON
+
+# Incremental reading and writing of RPG Maker JSON. Only the value being decoded and the
+# chunk it sits in are kept in memory, so a huge CommonEvents.json or map can be translated
+# one event at a time and written back in order as each one is done.
+
+CHUNK = 1 << 20
+DECODER = json.JSONDecoder()
+
+def streamThreshold():
+    # streamJSON=MB streams map and common event files at least that big, 0 turns it off
+    return float(os.getenv('streamJSON', 0) or 0) * 1e6
+
+def shouldStream(path):
+    threshold = streamThreshold()
+    return threshold > 0 and os.path.getsize(path) >= threshold
+
+class Scanner:
+    """
+    Reads JSON values one at a time from a text file, decoding each straight from a
+    buffer that only grows past a chunk when a single value is bigger than that.
+    """
+    def __init__(self, f):
+        self.file = f
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        # Reads the next chunk, dropping what has been consumed. False at the end of the file.
+        if self.eof:
+            return False
+        chunk = self.file.read(CHUNK)
+        if chunk == '':
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Next character that isn't whitespace, without consuming it
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                raise ValueError('JSON ends early')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} in JSON, found {self.buffer[self.pos]!r}')
+        self.pos += 1
+
+    def value(self):
+        # A value cut short by the end of the buffer fails to decode, or for a number
+        # ends right at it, so read on and decode again
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.more():
+                    continue
+                raise
+            if end == len(self.buffer) and self.more():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        # Values of the array whose [ was just consumed, up to and including its ]
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def members(self, streamed):
+        """
+        Members of the object whose { was just consumed, as [key, value]. Arrays under a
+        key in streamed come as a generator of their items instead, to be used up before
+        the next member is read.
+        """
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key in streamed and self.peek() == '[':
+                self.pos += 1
+                yield [key, self.items()]
+            else:
+                yield [key, self.value()]
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            self.expect(',')
+
+class Writer:
+    """
+    Writes a top level array or object piece by piece, byte for byte what dumpJSON writes
+    for the whole value in the same jsonStyle. None as the file only counts nothing.
+    """
+    def __init__(self, outFile):
+        self.file = outFile
+        self.compact = os.getenv('jsonStyle', 'indent') == 'compact'
+        self.counts = []
+        self.held = []
+
+    def write(self, text):
+        if self.file is not None:
+            self.file.write(text)
+
+    def dumps(self, value, depth):
+        if self.compact:
+            return serialiseJSON(value)
+        return json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n' + '    ' * depth)
+
+    def separator(self):
+        # Opening newline before the first entry, a comma before the others
+        depth = len(self.counts)
+        self.write(('\n' if self.counts[-1] == 0 else ',\n') + ('' if self.compact else '    ' * depth))
+        self.counts[-1] += 1
+
+    def startArray(self):
+        self.write('[')
+        self.counts.append(0)
+        self.held = []
+
+    def item(self, value):
+        # Compact arrays inside an object are only split once they hold an object, like compactLayout
+        if self.compact and len(self.counts) > 1 and self.held is not None:
+            self.held.append(value)
+            if not isinstance(value, dict):
+                return
+            held, self.held = self.held, None
+            for value in held:
+                self.separator()
+                self.write(self.dumps(value, len(self.counts)))
+            return
+        self.separator()
+        self.write(self.dumps(value, len(self.counts)))
+
+    def endArray(self):
+        if self.compact and len(self.counts) > 1 and self.held is not None:
+            self.write(serialiseJSON(self.held)[1:])
+            self.held = []
+            self.counts.pop()
+            return
+        self.held = []
+        count = self.counts.pop()
+        self.write(']' if count == 0 else '\n' + ('' if self.compact else '    ' * len(self.counts)) + ']')
+
+    def startObject(self):
+        self.write('{')
+        self.counts.append(0)
+
+    def key(self, key):
+        self.separator()
+        if self.compact:
+            self.write(serialiseJSON(str(key)) + ':')
+        else:
+            self.write(json.dumps(str(key), ensure_ascii=False) + ': ')
+
+    def member(self, key, value):
+        self.key(key)
+        if self.compact:
+            split = isinstance(value, list) and any(isinstance(item, dict) for item in value)
+            self.write(compactLayout(value) if split else serialiseJSON(value))
+        else:
+            self.write(self.dumps(value, len(self.counts)))
+
+    def endObject(self):
+        count = self.counts.pop()
+        self.write('}' if count == 0 else '\n' + ('' if self.compact else '    ' * len(self.counts)) + '}')
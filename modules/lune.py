@@ -1,38 +1,31 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
+from modules.offload import dumpJSON, loadJSON, timedSerialise
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,8 +45,7 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 50
 
 def handleLune(filename, estimate):
-    global ESTIMATE, totalTokens
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
     if estimate:
         start = time.time()
@@ -62,40 +54,35 @@ def handleLune(filename, estimate):
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
-        return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='UTF-8') as outFile:
-                start = time.time()
-                translatedData = openFiles(filename)
-
-                # Print Result
-                end = time.time()
-                json.dump(translatedData[0], outFile, ensure_ascii=False, indent=4)
-                tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+            start = time.time()
+            translatedData = openFiles(filename)
+
+            # Print Result
+            end = time.time()
+            timedSerialise('dump', filename, dumpJSON, translatedData[0], outputPath(filename))
+            tqdm.write(getResultString(translatedData, end - start, filename))
+            run.addTokens(translatedData[1])
         except Exception as e:
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='UTF-8-sig') as f:
-        data = json.load(f)
+    recordFile(inputPath(filename))
+    data = timedSerialise('load', filename, loadJSON, inputPath(filename))
 
-        # Map Files
-        if '.json' in filename:
-            translatedData = parseJSON(data, filename)
+    # Map Files
+    if '.json' in filename:
+        translatedData = parseJSON(data, filename)
 
-        else:
-            raise NameError(filename + ' Not Supported')
+    else:
+        raise NameError(filename + ' Not Supported')
     
     return translatedData
 
@@ -127,9 +114,8 @@ def parseJSON(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     totalLines = len(data)
-    global LOCK
     
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
         try:
@@ -197,7 +183,7 @@ def translateJSON(data, pbar):
                                 # Mismatch
                                 else:
                                     pbar.write(f'Mismatch: {batchStartIndex} - {i}')
-                                    MISMATCH.append(batch)
+                                    currentRun().addMismatch(batch)
                                     batchStartIndex = i
                                     batch.clear()
 
@@ -251,7 +237,7 @@ def translateJSON(data, pbar):
             # Mismatch
             else:
                 pbar.write(f'Mismatch: {batchStartIndex} - {i}')
-                MISMATCH.append(batch)
+                currentRun().addMismatch(batch)
                 batchStartIndex = i
                 batch.clear()
 
@@ -427,7 +413,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -489,7 +475,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
     totalTokens = [0, 0]
     if isinstance(text, list):
@@ -516,8 +502,9 @@ def translateGPT(text, history, fullPromptFlag):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -535,6 +522,7 @@ def translateGPT(text, history, fullPromptFlag):
             tList[index] = extractedTranslations
             if len(tItem) != len(translatedTextList):
                 mismatch = True     # Just here so breakpoint can be set
+                increment('mismatches_total')
             history = extractedTranslations[-10:]  # Update history if we have a list
         else:
             # Ensure we're passing a single string to extractTranslation
@@ -1,8 +1,16 @@
-import sys, os, traceback
+import argparse, sys, os, traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from colorama import Fore
 from tqdm import tqdm
 from dotenv import load_dotenv
+from modules.scheduler import scheduleFiles
+from modules.pipeline import pipelineConfig, runPipeline
+from modules.run import TranslationRun, activeRun, bindContext
+from modules.progress import startOverall, trackedHandler, trackedStage
+from modules.metrics import MetricsExporter
+from modules.profiler import PROFILER, addProfileArguments
+from modules.tracing import TRACER, addTraceArguments
+from modules.engines import ENGINES, loadEngine
 
 # This needs to be before the module imports as some of them currently try to read and use some of these values
 # upon import, in which case if they are unset the script will crash before we can output these messages.
@@ -16,50 +24,12 @@ if envMissing:
     tqdm.write(Fore.RED + f'Some of the required environment values may not be set correctly. You can set \
 these values using an .env file, for an example see .env.example')
 
-from modules.rpgmakermvmz import handleMVMZ
-from modules.rpgmakerace import handleACE
-from modules.csv import handleCSV
-from modules.eushully import handleEushully
-from modules.alice import handleAlice
-from modules.tyrano import handleTyrano
-from modules.json import handleJSON
-from modules.kansen import handleKansen
-from modules.lune import handleLune
-from modules.atelier import handleAtelier
-from modules.anim import handleAnim
-from modules.nscript import handleOnscripter
-from modules.wolf import handleWOLF
-from modules.wolf2 import handleWOLF2
-from modules.javascript import handleJavascript
-from modules.irissoft import handleIris
-from modules.regex import handleRegex
-from modules.rpgmakerplugin import handlePlugin
-
 # For GPT4 rate limit will be hit if you have more than 1 thread.
 # 1 Thread for each file. Controls how many files are worked on at once.
 THREADS = int(os.getenv('fileThreads'))
 
-# [Display name, file extension, handle function]
-MODULES = [
-    ["RPGMaker MV/MZ", "json", handleMVMZ],
-    ["RPGMaker Plugins", "js", handlePlugin],
-    ["RPGMaker ACE", "yaml", handleACE],
-    ["CSV (From Translator++)", "csv", handleCSV],
-    ["Eushully", "txt", handleEushully],
-    ["Alice", "txt", handleAlice],
-    ["Tyrano", "ks", handleTyrano],
-    ["JSON", "json", handleJSON],
-    ["Kansen", "ks", handleKansen],
-    ["Lune", "json", handleLune],
-    ["Atelier", "txt", handleAtelier],
-    ["Anim", "json", handleAnim],
-    ["NScript", "txt", handleOnscripter],
-    ["Wolf", "json", handleWOLF],
-    ["Wolf", "txt", handleWOLF2],
-    ["Javascript", "js", handleJavascript],
-    ["Iris", "txt", handleIris],
-    ["Regex", "txt", handleRegex],
-]
+# Engines in menu order. Modules are only imported once picked.
+MODULES = ENGINES
 
 # Info Message
 tqdm.write(Fore.LIGHTYELLOW_EX + "WARNING: Once the translation starts do not close it unless you want to lose your \
@@ -68,6 +38,15 @@ to worry about being charged twice. You can simply copy the file generated in /t
 /files and start the script again. It will skip over any translated text." + Fore.RESET, end='\n\n')
 
 def main():
+    parser = argparse.ArgumentParser(description='Interactive Translation or Cost Estimation')
+    addProfileArguments(parser)
+    addTraceArguments(parser)
+    args = parser.parse_args()
+    if args.profile or args.profile_dump:
+        PROFILER.start(args.profile_dump)
+    if args.trace:
+        TRACER.start(args.trace)
+
     estimate = ''
     while estimate == '':
         estimate = input('Select Translation or Cost Estimation:\n\n 1. Translate\n 2. Estimate\n')
@@ -83,7 +62,7 @@ def main():
     while True:
         tqdm.write("Select game engine:\n")
         for position, module in enumerate(MODULES):
-            tqdm.write(f'{str(position + 1).rjust(2)}. {module[0]} (.{module[1]})')
+            tqdm.write(f'{str(position + 1).rjust(2)}. {module[1]} (.{module[2]})')
         version = input()
         try:
             version = int(version) - 1
@@ -95,17 +74,48 @@ def main():
     totalCost = Fore.RED + 'Translation module didn\'t return the total cost. Make sure the \
 files to translate are in the /files folder and that you picked the right game engine.'
 
-    # Open File (Threads)
-    with ThreadPoolExecutor(max_workers=THREADS) as executor:
-        futures = [executor.submit(MODULES[version][2], filename, estimate) \
-                    for filename in os.listdir("files") if filename.endswith(MODULES[version][1])]
-                    
-        for future in as_completed(futures):
-            try:
-                totalCost = future.result()
-            except Exception as e:
-                tracebackLineNo = str(traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
-                tqdm.write(Fore.RED + str(e) + '|' + tracebackLineNo + Fore.RESET)
+    # Import only the selected engine
+    handler, stages = loadEngine(MODULES[version])
+
+    # Every file of this run shares one set of caches and token counters
+    run = TranslationRun(estimate, {'engine': MODULES[version][0]})
+    with activeRun(run), MetricsExporter():
+        # Largest files first
+        filenames = scheduleFiles('files', MODULES[version][2])
+
+        # One bar and ETA for the whole run
+        run.overall = startOverall('files', filenames)
+
+        # Open File (Pipeline)
+        if stages is not None:
+            loadStage, translateStage, writeStage = stages
+            loadWorkers, writeWorkers, queueSize = pipelineConfig(THREADS)
+            stages = [
+                ['load', loadStage, loadWorkers],
+                ['translate', trackedStage(translateStage), THREADS],
+                ['write', writeStage, writeWorkers],
+            ]
+            for job, result, error in runPipeline([[filename, estimate] for filename in filenames], stages, queueSize):
+                if error is None:
+                    totalCost = result
+                else:
+                    tracebackLineNo = str(traceback.extract_tb(error.__traceback__)[-1].lineno)
+                    tqdm.write(Fore.RED + job[0] + ': ' + str(error) + '|' + tracebackLineNo + Fore.RESET)
+
+        # Open File (Threads)
+        else:
+            with ThreadPoolExecutor(max_workers=THREADS) as executor:
+                futures = [executor.submit(bindContext(trackedHandler(handler)), filename, estimate) for filename in filenames]
+                        
+                for future in as_completed(futures):
+                    try:
+                        totalCost = future.result()
+                    except Exception as e:
+                        tracebackLineNo = str(traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
+                        tqdm.write(Fore.RED + str(e) + '|' + tracebackLineNo + Fore.RESET)
+
+    if run.overall is not None:
+        run.overall.close()
 
     if totalCost != 'Fail':
         if estimate is False:
@@ -114,6 +124,9 @@ files to translate are in the /files folder and that you picked the right game e
 
         tqdm.write(str(totalCost))
 
+    PROFILER.report()
+    TRACER.write()
+
 def deleteFolderFiles(folderPath):
     for filename in os.listdir(folderPath):
         file_path = os.path.join(folderPath, filename)
@@ -0,0 +1,186 @@
+# Libraries
+import bisect, json, logging, os, threading, time
+from modules.run import currentRun
+from modules.tracing import TRACER
+
+# Seconds. Covers a cached page (ms) up to a request that sits through the whole timeout.
+BUCKETS = [.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120]
+PREFIX = 'translator_'
+
+HELP = {
+    'request_seconds': ['histogram', 'Chat completion latency, including failed requests.'],
+    'queue_wait_seconds': ['histogram', 'Time a job waited in a queue before a worker picked it up.'],
+    'requests_failed_total': ['counter', 'Chat completions that raised, by exception type.'],
+    'tokens_input_total': ['counter', 'Prompt tokens reported by the API.'],
+    'tokens_output_total': ['counter', 'Completion tokens reported by the API.'],
+    'retries_total': ['counter', 'Calls retried by the retry decorator.'],
+    'mismatches_total': ['counter', 'Responses with the wrong number of lines.'],
+    'cache_hits_total': ['counter', 'Lookups answered from a cache instead of the API.'],
+    'bytes_parsed_total': ['counter', 'Bytes of input files opened for parsing.'],
+}
+
+class Metrics:
+    """
+    Counters and histograms keyed by name and labels. Everything is kept in process and
+    only turned into JSON or Prometheus text when written out.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+                self.histograms[key] = histogram
+            histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        with self.lock:
+            counters = [{'name': key[0], 'labels': dict(key[1]), 'value': value} for key, value in self.counters.items()]
+            histograms = [{
+                'name': key[0],
+                'labels': dict(key[1]),
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], histogram[0])),
+                'sum': round(histogram[1], 6),
+                'count': histogram[2],
+            } for key, histogram in self.histograms.items()]
+        return {'time': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def toPrometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        described = set()
+        for kind in ['counters', 'histograms']:
+            for metric in sorted(snapshot[kind], key=lambda metric: metric['name']):
+                name = PREFIX + metric['name']
+                if name not in described:
+                    described.add(name)
+                    metricType, text = HELP.get(metric['name'], ['counter' if kind == 'counters' else 'histogram', ''])
+                    lines.append(f'# HELP {name} {text}')
+                    lines.append(f'# TYPE {name} {metricType}')
+                if kind == 'counters':
+                    lines.append(f'{name}{formatLabels(metric["labels"])} {metric["value"]}')
+                    continue
+
+                # Prometheus buckets are cumulative
+                total = 0
+                for bound, count in metric['buckets'].items():
+                    total += count
+                    lines.append(f'{name}_bucket{formatLabels(dict(metric["labels"], le=bound))} {total}')
+                lines.append(f'{name}_sum{formatLabels(metric["labels"])} {metric["sum"]}')
+                lines.append(f'{name}_count{formatLabels(metric["labels"])} {metric["count"]}')
+        return '\n'.join(lines) + '\n'
+
+def formatLabels(labels):
+    if len(labels) == 0:
+        return ''
+    escaped = [f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, value in sorted(labels.items())]
+    return '{' + ','.join(escaped) + '}'
+
+METRICS = Metrics()
+
+def engineLabel():
+    return currentRun().config.get('engine', 'unknown')
+
+def increment(name, amount=1, **labels):
+    METRICS.increment(name, amount, engine=engineLabel(), **labels)
+
+def observe(name, value, **labels):
+    METRICS.observe(name, value, engine=engineLabel(), **labels)
+
+def recordRequest(seconds, response=None, error=None):
+    observe('request_seconds', seconds, status='error' if error is not None else 'ok')
+    if error is not None:
+        increment('requests_failed_total', error=type(error).__name__)
+    if response is not None and getattr(response, 'usage', None) is not None:
+        increment('tokens_input_total', response.usage.prompt_tokens)
+        increment('tokens_output_total', response.usage.completion_tokens)
+
+def recordFile(path):
+    try:
+        increment('bytes_parsed_total', os.path.getsize(path))
+    except OSError:
+        pass
+
+class RetryLogger:
+    """
+    Passed as logger to the retry decorator, which calls warning() once per retry.
+    Counts the retry and logs like the decorator's default logger.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('retry.api')
+
+    def warning(self, message, *args):
+        increment('retries_total')
+        self.logger.warning(message, *args)
+
+        # The decorator sleeps right after logging, args are (error, delay)
+        if TRACER.enabled and len(args) > 1:
+            TRACER.complete('retry sleep', 'retry', TRACER.now(), float(args[1]) * 1e6, {'error': str(args[0])})
+
+RETRYLOG = RetryLogger()
+
+# Export
+def metricsPaths():
+    # JSON and Prometheus textfile paths, either can be empty to skip it
+    return os.getenv('metricsFile', ''), os.getenv('metricsPrometheus', '')
+
+def writeMetrics():
+    jsonPath, prometheusPath = metricsPaths()
+    if jsonPath:
+        writeAtomic(jsonPath, json.dumps(METRICS.snapshot(), indent=4))
+    if prometheusPath:
+        writeAtomic(prometheusPath, METRICS.toPrometheus())
+
+def writeAtomic(path, text):
+    # node_exporter can read the textfile at any time, never let it see half a file
+    temp = path + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as outFile:
+        outFile.write(text)
+    os.replace(temp, path)
+
+class MetricsExporter:
+    """
+    Writes the metrics every metricsInterval seconds while a run is going and once more
+    when it stops. Does nothing unless metricsFile or metricsPrometheus is set.
+    """
+    def __init__(self, interval=None):
+        self.interval = float(os.getenv('metricsInterval', 30)) if interval is None else interval
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        if any(metricsPaths()) and self.interval > 0:
+            self.thread = threading.Thread(target=self.loop, name='metrics', daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+        if any(metricsPaths()):
+            writeMetrics()
+
+    def loop(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                writeMetrics()
+            except OSError:
+                pass
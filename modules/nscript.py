@@ -1,45 +1,36 @@
 # Libraries
 import json
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, getProgress, inputPath, outputPath, setProgress, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
 POSITION = 0
 LEAVE = False
-PBAR = None
 FILENAME = None
 
 # Full Width
@@ -61,33 +52,30 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleOnscripter(filename, estimate):
-    global ESTIMATE, FILENAME
-    ESTIMATE = estimate
+    run = startRun(estimate)
     FILENAME = filename
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='cp932', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='cp932', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -95,14 +83,12 @@ def handleOnscripter(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -129,7 +115,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='cp932') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='cp932') as readFile:
         translatedData = parseOnscripter(readFile, filename)
 
         # Delete lines marked for deletion
@@ -148,7 +135,7 @@ def parseOnscripter(readFile, filename):
     data = readFile.readlines()
 
     # Create Progress Bar
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
@@ -166,8 +153,7 @@ def translateOnscripter(data, pbar, filename, translatedList):
     tokens = [0,0]
     speaker = ''
     voice = False
-    global LOCK, ESTIMATE, PBAR
-    PBAR = pbar
+    setProgress(pbar)
     i = 0
 
     # Dialogue
@@ -292,9 +278,7 @@ def translateOnscripter(data, pbar, filename, translatedList):
 
         # Mismatch
         else:
-            with LOCK:
-                if filename not in MISMATCH:
-                    MISMATCH.append(filename)
+            currentRun().addMismatch(filename)
     return tokens
 
 def fixText(translatedText):
@@ -330,6 +314,7 @@ def fixText(translatedText):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -337,7 +322,7 @@ def getSpeaker(speaker):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
@@ -349,13 +334,14 @@ def getSpeaker(speaker):
                     response[0] = response[0].replace("'S", "'s")
 
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -540,7 +526,7 @@ def translateText(characters, system, user, history, penalty):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0,
         frequency_penalty=penalty,
         model=MODEL,
@@ -592,8 +578,14 @@ def extractTranslation(translatedTextList, is_list):
         if is_list:
             string_list = list(line_dict.values())
             return string_list
+        # A single string can come back tagged too ({"Line1": ...}), or as plain JSON text
+        if isinstance(line_dict, dict) and len(line_dict) > 0:
+            return str(next(iter(line_dict.values())))
+        return translatedTextList
     except Exception as e:
-        print(e)
+        # Not JSON, the reply is the translation itself
+        if is_list:
+            print(e)
         return translatedTextList
 
 def countTokens(characters, system, user, history):
@@ -621,9 +613,8 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
-    global PBAR
     
     mismatch = False
     totalTokens = [0, 0]
@@ -645,16 +636,18 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
-            if PBAR is not None:
-                PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             continue
 
         # Create Message
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -682,6 +675,7 @@ def translateGPT(text, history, fullPromptFlag):
                     extractedTranslations = extractTranslation(translatedText, True)
                     if len(tItem) != len(extractedTranslations):
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
             
             # Set if no mismatch
             if mismatch == False:
@@ -692,9 +686,9 @@ def translateGPT(text, history, fullPromptFlag):
                 mismatch = False
 
             # Update Loading Bar
-            with LOCK:
-                if PBAR is not None:
-                    PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
         else:
             # Ensure we're passing a single string to extractTranslation
             extractedTranslations = extractTranslation(translatedText, False)
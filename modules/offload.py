@@ -0,0 +1,183 @@
+# Libraries
+import hashlib, io, json, multiprocessing, os, pickle, threading, time
+from concurrent.futures import ProcessPoolExecutor
+from modules.run import currentRun
+
+#Globals
+PROCESSPOOL = None
+POOLLOCK = threading.Lock()
+
+def processCount():
+    # Number of processes used for loading and writing files (see runSerialise). 0, the default,
+    # keeps everything in the calling thread.
+    return int(os.getenv('processes', 0))
+
+def getProcessPool():
+    global PROCESSPOOL
+    if processCount() <= 0:
+        return None
+    with POOLLOCK:
+        if PROCESSPOOL is None:
+            # Spawn so the workers don't inherit the parent's threads and locks
+            PROCESSPOOL = ProcessPoolExecutor(max_workers=processCount(), mp_context=multiprocessing.get_context('spawn'))
+    return PROCESSPOOL
+
+def runSerialise(function, *args):
+    """
+    Runs a file load or dump in the process pool when one is configured. This is the only
+    work that is ever offloaded: the ruamel YAML load and dump, the Marshal reader and
+    writer, the Wolf .mps/.dat reader and writer and the indented JSON dump. Extraction,
+    translation and injection always stay in the calling thread.
+
+    These are plain Python and hold the GIL, so on threads alone every file worker ends up
+    parsing and dumping on the same core. The whole tree is pickled on the way back from a
+    load and on the way out to a dump, which is a fraction of a pure Python parse but about
+    as slow as the C JSON parser itself, so functions that run in C (see inThread) stay in
+    the calling thread. Off unless processes is set; worth it for ACE YAML/rvdata2 projects
+    and indented MV/MZ dumps.
+    """
+    pool = getProcessPool()
+    if pool is None or inThread(function):
+        return function(*args)
+    return pool.submit(function, *args).result()
+
+def inThread(function):
+    # orjson / json parse in C, and compact dumps are orjson too when it is installed
+    if function is loadJSON:
+        return True
+    if function is dumpJSON:
+        return os.getenv('jsonStyle', 'indent') == 'compact' and jsonLibrary() is not None
+    return False
+
+def timedSerialise(kind, filename, function, *args):
+    # runSerialise, adding the time to filename's load or dump seconds in the run summary
+    start = time.perf_counter()
+    try:
+        return runSerialise(function, *args)
+    finally:
+        currentRun().addIOTime(filename, kind, time.perf_counter() - start)
+
+def jsonLibrary():
+    """
+    orjson when it is installed, unless jsonBackend=json. It parses and serialises in C,
+    several times faster than the json module on large map and event files.
+    """
+    if os.getenv('jsonBackend', 'orjson') != 'orjson':
+        return None
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+def parseJSON(content):
+    orjson = jsonLibrary()
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass    # NaN, Infinity or integers past 64 bits, which json accepts
+    return json.loads(content)
+
+def serialiseJSON(data):
+    # One value on a single line without spaces
+    orjson = jsonLibrary()
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+def compactLayout(data):
+    """
+    The layout RPG Maker saves in: compact, with each entry of a top level list on its own
+    line. In a top level object each key gets a line and lists of objects (map events)
+    are split the same way.
+    """
+    if isinstance(data, list) and len(data) > 0:
+        return '[\n' + ',\n'.join(serialiseJSON(item) for item in data) + '\n]'
+    if isinstance(data, dict) and len(data) > 0:
+        lines = []
+        for key, value in data.items():
+            split = isinstance(value, list) and any(isinstance(item, dict) for item in value)
+            lines.append(serialiseJSON(str(key)) + ':' + (compactLayout(value) if split else serialiseJSON(value)))
+        return '{\n' + ',\n'.join(lines) + '\n}'
+    return serialiseJSON(data)
+
+# Workers. These are top level so they can be pickled by the process pool.
+def loadJSON(path):
+    with open(path, 'rb') as f:
+        content = f.read()
+    if content.startswith(b'\xef\xbb\xbf'):
+        content = content[3:]
+    return parseJSON(content)
+
+def dumpJSON(data, path):
+    """
+    jsonStyle=indent (default) writes with indent=4, compact keeps RPG Maker's own layout
+    so the files stay their original size and diff line by line against the game's.
+    """
+    if os.getenv('jsonStyle', 'indent') == 'compact':
+        text = compactLayout(data)
+    else:
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+    with open(path, 'w', encoding='utf-8') as outFile:
+        outFile.write(text)
+
+def createYAML():
+    from ruamel.yaml import YAML
+    yaml=YAML(pure=True)   # Need a yaml instance per thread.
+    yaml.width = 4096
+    yaml.default_style = "'"
+    return yaml
+
+def yamlCachePath(content):
+    # Pickle of a parsed YAML file, keyed by its content and the ruamel version that parsed it
+    folder = os.getenv('yamlCache', 'cache')
+    if not folder:
+        return None
+    import ruamel.yaml
+    key = hashlib.sha256(content + ruamel.yaml.__version__.encode('ascii')).hexdigest()
+    return os.path.join(folder, 'yaml', key + '.pickle')
+
+def loadYAML(path):
+    """
+    Parses a YAML file, from the parsed tree cached by an earlier run when the file hasn't
+    changed. ruamel in pure mode is the slowest part of an ACE run, an estimate followed by
+    a translation would otherwise parse every file twice. yamlCache sets the folder, empty
+    turns the cache off.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    cachePath = yamlCachePath(content)
+    if cachePath is not None and os.path.exists(cachePath):
+        try:
+            with open(cachePath, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            pass
+
+    data = createYAML().load(io.TextIOWrapper(io.BytesIO(content), encoding='UTF-8'))
+    if cachePath is not None:
+        # Written under a temporary name so other workers never read half a file
+        os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+        tempPath = f'{cachePath}.{os.getpid()}.{threading.get_ident()}'
+        with open(tempPath, 'wb') as outFile:
+            pickle.dump(data, outFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, cachePath)
+    return data
+
+def dumpYAML(data, path):
+    with open(path, 'w', encoding='utf-8') as outFile:
+        createYAML().dump(data, outFile)
+
+def loadMarshal(path):
+    from modules.rubymarshal import loads
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+def dumpMarshal(data, path):
+    from modules.rubymarshal import dumps
+    with open(path, 'wb') as outFile:
+        outFile.write(dumps(data))
@@ -0,0 +1,92 @@
+# Libraries
+import contextvars, os, queue, threading, time, traceback
+from modules.offload import processCount
+from modules.metrics import observe
+from modules.tracing import TRACER
+
+# Marks the end of the input for a stage
+DONE = object()
+
+def pipelineConfig(translateWorkers):
+    """
+    Worker counts and queue size for the staged pipeline. Loading and writing are cheap
+    compared to translating so they default to a single worker each, or one per process
+    when they are offloaded to the process pool. The queue size caps how many parsed files
+    can wait in memory between two stages.
+    """
+    loadWorkers = int(os.getenv('loadThreads', max(1, processCount())))
+    writeWorkers = int(os.getenv('writeThreads', max(1, processCount())))
+    queueSize = int(os.getenv('pipelineQueue', max(1, translateWorkers)))
+    return loadWorkers, writeWorkers, queueSize
+
+def runPipeline(jobs, stages, queueSize):
+    """
+    Runs every job through stages, a list of [name, function, workers]. Stages are joined
+    by bounded queues so file N + 1 can be loading while file N waits on the API and file
+    N - 1 is being written. Each function takes what the previous stage returned.
+
+    Returns a list of [job, result, error] in completion order. A job whose stage raises
+    is dropped from the rest of the pipeline and reported with its error. Workers run in a
+    copy of the caller's context so every stage sees the caller's run.
+    """
+    if len(stages) == 0:
+        raise ValueError("stages must not be empty")
+
+    queues = [queue.Queue(maxsize=max(1, queueSize)) for _ in stages]
+    results = []
+    resultsLock = threading.Lock()
+    remaining = [stage[2] for stage in stages]
+    remainingLock = threading.Lock()
+
+    def worker(index):
+        name, function, workers = stages[index]
+        while True:
+            item = queues[index].get()
+            if item is DONE:
+                break
+
+            job, value, queued = item
+            observe('queue_wait_seconds', time.perf_counter() - queued, queue=name)
+            try:
+                with TRACER.span(name, 'stage', file=str(job[0])):
+                    value = function(value)
+            except Exception as e:
+                traceback.print_exc()
+                with resultsLock:
+                    results.append([job, None, e])
+                continue
+
+            # Hand off to the next stage, blocks while it is full
+            if index + 1 < len(stages):
+                queues[index + 1].put([job, value, time.perf_counter()])
+            else:
+                with resultsLock:
+                    results.append([job, value, None])
+
+        # Last worker of this stage closes the next one
+        with remainingLock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and index + 1 < len(stages):
+            for _ in range(stages[index + 1][2]):
+                queues[index + 1].put(DONE)
+
+    context = contextvars.copy_context()
+    threads = []
+    for index, stage in enumerate(stages):
+        if stage[2] <= 0:
+            raise ValueError(f"Stage {stage[0]} needs at least one worker")
+        for n in range(stage[2]):
+            thread = threading.Thread(target=context.copy().run, args=(worker, index), name=f'{stage[0]}-{n}', daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    # Feed the first stage, blocks once it is full so memory stays bounded
+    for job in jobs:
+        queues[0].put([job, job, time.perf_counter()])
+    for _ in range(stages[0][2]):
+        queues[0].put(DONE)
+
+    for thread in threads:
+        thread.join()
+    return results
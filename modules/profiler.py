@@ -0,0 +1,227 @@
+# Libraries
+import contextvars, cProfile, functools, inspect, pstats, textwrap, threading, time
+from contextlib import contextmanager, nullcontext
+from tqdm import tqdm
+
+# Stage for each engine function that gets wrapped. Functions starting with parse or
+# search are extraction. Anything not listed counts towards whatever stage called it.
+STAGES = {
+    'loadFile': 'load',
+    'openFiles': 'load',
+    'openFilesEstimate': 'load',
+    'subVars': 'subVars',
+    'translateGPT': 'prompt',
+    'createContext': 'prompt',
+    'batchList': 'prompt',
+    'countTokens': 'tokenize',
+    'translateText': 'api',
+    'cleanTranslatedText': 'clean',
+    'resubVars': 'clean',
+    'extractTranslation': 'clean',
+    'combineList': 'clean',
+    'writeFile': 'write',
+}
+COLUMNS = ['load', 'extract', 'subVars', 'prompt', 'tokenize', 'api', 'clean', 'textwrap', 'write', 'wait', 'other']
+
+CURRENTFILE = contextvars.ContextVar('file', default='-')
+
+class Profiler:
+    """
+    Times the stages of a run per file. Times are exclusive, a stage that calls another
+    stage is paused while the inner one runs, so the columns add up to the thread time
+    spent on a file. Pages run on many threads at once so that is usually more than the
+    file's wall time.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tables = []
+        self.walls = {}
+        self.dumpPath = None
+        self.profiles = []
+
+    def start(self, dumpPath=None):
+        self.enabled = True
+        self.dumpPath = dumpPath
+        if dumpPath is not None:
+            # cProfile only sees the thread it was enabled on, give every new thread its own
+            self.enableThreadProfile()
+            threading.setprofile(self.enableThreadProfile)
+
+    def enableThreadProfile(self, *args):
+        import sys
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Only one profiler can be active per process on newer Pythons
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def table(self):
+        table = getattr(self.local, 'table', None)
+        if table is None:
+            table = {}
+            self.local.table = table
+            with self.lock:
+                self.tables.append(table)
+        return table
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = []
+            self.local.stack = stack
+        return stack
+
+    def add(self, frame, now):
+        table = self.table()
+        key = (frame[1], frame[0])
+        table[key] = table.get(key, 0.0) + now - frame[2]
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        stack = self.stack()
+        if stack:
+            self.add(stack[-1], now)
+        stack.append([stage, CURRENTFILE.get(), now])
+
+    def exit(self):
+        now = time.perf_counter()
+        stack = self.stack()
+        self.add(stack.pop(), now)
+        if stack:
+            stack[-1][2] = now
+
+    def wrap(self, function, stage):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            self.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        return timed
+
+    def stage(self, stage):
+        # For code that isn't a function of its own, like waiting on a pool
+        if not self.enabled:
+            return nullcontext()
+        return self.timedBlock(stage)
+
+    @contextmanager
+    def timedBlock(self, stage):
+        self.enter(stage)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def fileTask(self, function):
+        """
+        Wraps a handler or pipeline stage so everything it does is booked to its file. The
+        first argument is the file name, or a pipeline job starting with it.
+        """
+        @functools.wraps(function)
+        def task(job, *args, **kwargs):
+            filename = job[0] if isinstance(job, list) else job
+            token = CURRENTFILE.set(filename)
+            start = time.perf_counter()
+            self.enter('other')
+            try:
+                return function(job, *args, **kwargs)
+            finally:
+                self.exit()
+                end = time.perf_counter()
+                CURRENTFILE.reset(token)
+                with self.lock:
+                    first, last = self.walls.get(filename, (start, end))
+                    self.walls[filename] = (min(first, start), max(last, end))
+        return task
+
+    def instrument(self, module):
+        # Swap the module's stage functions for timed ones. Calls between engine functions go
+        # through module globals so the engine picks them up without changes.
+        if getattr(module, '_profiled', False):
+            return
+        for name, function in list(vars(module).items()):
+            if not inspect.isfunction(function) or function.__module__ != module.__name__:
+                continue
+            stage = STAGES.get(name)
+            if stage is None and name.startswith(('parse', 'search')):
+                stage = 'extract'
+            if stage is not None and not inspect.isgeneratorfunction(function):
+                setattr(module, name, self.wrap(function, stage))
+        if getattr(module, 'textwrap', None) is textwrap:
+            module.textwrap = TimedTextwrap(self)
+        module._profiled = True
+
+    def report(self):
+        if not self.enabled:
+            return
+        totals = {}
+        with self.lock:
+            tables = list(self.tables)
+            walls = dict(self.walls)
+        for table in tables:
+            for (filename, stage), seconds in list(table.items()):
+                row = totals.setdefault(filename, {})
+                row[stage] = row.get(stage, 0.0) + seconds
+
+        # Per file breakdown, largest first
+        width = max([len('File'), len('TOTAL')] + [len(filename) for filename in totals])
+        header = 'File'.ljust(width) + ''.join(column.rjust(10) for column in COLUMNS + ['thread', 'wall'])
+        lines = [header, '-' * len(header)]
+        total = {}
+        rows = sorted(totals.items(), key=lambda item: sum(item[1].values()), reverse=True)
+        for filename, row in rows:
+            wall = walls.get(filename, (0.0, 0.0))
+            lines.append(formatRow(filename, width, row, wall[1] - wall[0]))
+            for stage, seconds in row.items():
+                total[stage] = total.get(stage, 0.0) + seconds
+        if walls:
+            wall = max(end for start, end in walls.values()) - min(start for start, end in walls.values())
+        else:
+            wall = 0.0
+        lines.append('-' * len(header))
+        lines.append(formatRow('TOTAL', width, total, wall))
+
+        # Where the time went
+        threadTime = sum(total.values())
+        if threadTime > 0:
+            shares = sorted(total.items(), key=lambda item: item[1], reverse=True)
+            lines.append('Share: ' + ', '.join(f'{stage} {seconds / threadTime:.0%}' for stage, seconds in shares))
+        tqdm.write('\n'.join(lines))
+
+        if self.dumpPath is not None:
+            threading.setprofile(None)
+            with self.lock:
+                profiles = list(self.profiles)
+            for profile in profiles:
+                profile.disable()
+            if profiles:
+                pstats.Stats(*profiles).dump_stats(self.dumpPath)
+                tqdm.write(f'cProfile stats written to {self.dumpPath}')
+
+def addProfileArguments(parser):
+    parser.add_argument('--profile', action='store_true', help='Print a per file table of where the time went (load, extract, \
+subVars, prompt, api, clean, textwrap, write, waiting on pages).')
+    parser.add_argument('--profile-dump', help='Also write cProfile stats for every worker thread to this file (implies --profile).')
+
+def formatRow(name, width, row, wall):
+    cells = ''.join(f'{row.get(column, 0.0):10.2f}' for column in COLUMNS)
+    return name.ljust(width) + cells + f'{sum(row.values()):10.2f}' + f'{wall:10.2f}'
+
+class TimedTextwrap:
+    # Stands in for the textwrap module inside an engine, fill and wrap are timed
+    def __init__(self, profiler):
+        self.fill = profiler.wrap(textwrap.fill, 'textwrap')
+        self.wrap = profiler.wrap(textwrap.wrap, 'textwrap')
+
+    def __getattr__(self, name):
+        return getattr(textwrap, name)
+
+PROFILER = Profiler()
@@ -0,0 +1,157 @@
+# Libraries
+import contextvars, os, re, threading
+from contextlib import contextmanager
+from tqdm import tqdm
+from modules.run import currentRun
+
+#Globals
+FILE = contextvars.ContextVar('progressFile', default=None)
+
+# Same character class the engines use to decide if a string still needs translating
+JAPANESE = re.compile(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]')
+SEGMENTS = re.compile(r'\n|"|\\n')
+BAR_FORMAT = '{desc}: {percentage:3.0f}%|{bar:20}| {n_fmt}/{total_fmt} tok [{elapsed}<{remaining}, {rate_fmt}]{postfix}'
+
+def readText(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    for encoding in ['utf-8-sig', 'cp932', 'utf-16']:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='ignore')
+
+def scanText(text):
+    """
+    Returns [lines, tokens] still to translate in text. A line is a string or script line
+    with Japanese in it, tokens are estimated as one per Japanese character. Only the ratio
+    of done to total matters, so the estimate just has to be consistent with scanRequest.
+    """
+    lines = sum(1 for segment in SEGMENTS.split(text) if JAPANESE.search(segment))
+    return [lines, len(JAPANESE.findall(text))]
+
+def scanFile(path):
+    # Binary files only hold text in their strings, reading them as text counts random bytes
+    if path.endswith('.rvdata2'):
+        # Marshal strings are stored as UTF-8
+        with open(path, 'rb') as f:
+            return scanText(f.read().decode('utf-8', errors='ignore'))
+    if path.endswith(('.mps', '.dat')):
+        from modules.wolfdata import loadWolfData
+        try:
+            data = loadWolfData(path)
+        except (ValueError, NameError):
+            return [0, 0]
+        return scanText('\n'.join(span[4] for span in data['spans']))
+    return scanText(readText(path))
+
+def prescan(folder, filenames):
+    # Reads every file once without parsing it, a few ms per MB. Returns {filename: [lines, tokens]}
+    totals = {}
+    for filename in filenames:
+        try:
+            totals[filename] = scanFile(os.path.join(folder, filename))
+        except OSError:
+            continue
+    return totals
+
+class OverallProgress:
+    """
+    One bar for the whole run. The total comes from prescan and completion moves with the
+    text sent for translation (or counted, when estimating), so the ETA and rate cover
+    every file and thread.
+
+    Prescan counts every Japanese character in a file, engines skip notes, switches and
+    whatever their settings leave out. Text is counted against the file it came from and
+    when a file is done whatever it didn't send is taken off the total, so the total
+    settles on what the engines actually send as the run goes on.
+    """
+    def __init__(self, files):
+        self.lock = threading.Lock()
+        self.files = {filename: list(counts) for filename, counts in files.items()}
+        self.sent = {filename: [0, 0] for filename in files}
+        self.lines = sum(counts[0] for counts in self.files.values())
+        self.linesDone = 0
+        tokens = sum(counts[1] for counts in self.files.values())
+        self.bar = tqdm(total=max(1, tokens), desc='TOTAL', unit='tok', bar_format=BAR_FORMAT, position=0, leave=True, dynamic_ncols=True)
+        self.bar.set_postfix_str(f'0/{self.lines} lines')
+
+    def advance(self, lines, tokens, filename=None):
+        with self.lock:
+            # Mismatch retries send the same text twice, don't run past the file's total
+            if filename in self.files:
+                planned, sent = self.files[filename], self.sent[filename]
+                lines = max(0, min(lines, planned[0] - sent[0]))
+                tokens = max(0, min(tokens, planned[1] - sent[1]))
+                sent[0] += lines
+                sent[1] += tokens
+            tokens = max(0, min(tokens, self.bar.total - self.bar.n))
+            self.linesDone = min(self.lines, self.linesDone + lines)
+            self.bar.set_postfix_str(f'{self.linesDone}/{self.lines} lines', refresh=False)
+            self.bar.update(tokens)
+
+    def finish(self, filename):
+        # Drop what the file had but never sent from the total
+        with self.lock:
+            if filename not in self.files:
+                return
+            planned, sent = self.files.pop(filename), self.sent.pop(filename)
+            self.lines -= planned[0] - sent[0]
+            self.bar.total = max(1, self.bar.total - (planned[1] - sent[1]))
+            self.bar.set_postfix_str(f'{self.linesDone}/{self.lines} lines', refresh=False)
+            self.bar.refresh()
+
+    def close(self):
+        self.bar.close()
+
+def overallEnabled():
+    return os.getenv('overallProgress', '1') != '0'
+
+def startOverall(folder, filenames):
+    if not overallEnabled():
+        return None
+    return OverallProgress(prescan(folder, filenames))
+
+@contextmanager
+def trackFile(filename):
+    # Text sent inside this block, and in pools started from it, counts against filename
+    token = FILE.set(filename)
+    try:
+        yield
+    finally:
+        FILE.reset(token)
+        overall = currentRun().overall
+        if overall is not None:
+            overall.finish(filename)
+
+def trackedHandler(handler):
+    # handler(filename, estimate) with its text counted against filename
+    def tracked(filename, *args):
+        with trackFile(filename):
+            return handler(filename, *args)
+    return tracked
+
+def trackedStage(stage):
+    # Pipeline stage taking [filename, ...] jobs
+    def tracked(job):
+        with trackFile(job[0]):
+            return stage(job)
+    return tracked
+
+def advanceOverall(text):
+    # Called with the text of every request, sent or only counted for an estimate
+    overall = currentRun().overall
+    if overall is not None:
+        lines, tokens = scanText(str(text))
+        overall.advance(lines, tokens, FILE.get())
+
+def scanRequest(messages):
+    # The text to translate is always the last message
+    if not messages:
+        return
+    advanceOverall(messages[-1].get('content', ''))
+
+def fileBar(**kwargs):
+    # Per file bars stay hidden while the overall bar is shown, they would draw over it
+    return tqdm(disable=currentRun().overall is not None, **kwargs)
@@ -1,38 +1,30 @@
 # Libraries
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,32 +44,29 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleRegex(filename, estimate):
-    global ESTIMATE
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='cp932', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='cp932', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -85,14 +74,12 @@ def handleRegex(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -119,7 +106,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='shift_jis') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='shift_jis') as readFile:
         translatedData = parseRegex(readFile, filename)
 
         # Delete lines marked for deletion
@@ -138,11 +126,11 @@ def parseRegex(readFile, filename):
     data = readFile.readlines()
 
     # Create Progress Bar
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
-            result = translateRegex(data, pbar, filename, [])
+            result = translateRegex(data, pbar, filename)
             totalTokens[0] += result[0]
             totalTokens[1] += result[1]
         except Exception as e:
@@ -150,53 +138,28 @@ def parseRegex(readFile, filename):
             return [data, totalTokens, e]
     return [data, totalTokens, None]
 
-def translateRegex(data, pbar, filename, translatedList):
+def translateRegex(data, pbar, filename):
     stringList = []
-    currentGroup = []
+    targets = []
     tokens = [0,0]
-    speaker = ''
-    voice = False
-    global LOCK, ESTIMATE
     i = 0
 
     while i < len(data):
-        voice = False
-        speaker = ''
         if 'mov' in data[i]:
             # Lines
             match = re.search(r'mov\s\$\d+?,"(.*?)"', data[i])
-            if match == None:
-                match = re.search(r'mov\s\$\d+?,"(.*?)"', data[i])
             if match != None and match.group(1) != '':
-                originalString = match.group(1)
-                # Pass 1
-                if translatedList == []:
-                    # Grab Consecutive Strings
-                    jaString = match.group(1)
-                        
-                    # Remove any textwrap
-                    jaString = jaString.replace('\n', ' ')
-
-                    # Add String
-                    stringList.append(jaString.strip())
-                
-                # Pass 2
-                else:
-                    # Get Text
-                    if translatedList:
-                        # Grab and Pop
-                        translatedText = translatedList[0]
-                        translatedList.pop(0)
-
-                        # Set to None if empty list
-                        if len(translatedList) <= 0:
-                            translatedList = None
-
-                        # Textwrap
-                        translatedText = textwrap.fill(translatedText, width=WIDTH)
-
-                        # Set Data
-                        data[i] = data[i].replace(originalString, translatedText)
+                # Line and text the translation goes into
+                targets.append([i, match.group(1)])
+
+                # Grab Consecutive Strings
+                jaString = match.group(1)
+                    
+                # Remove any textwrap
+                jaString = jaString.replace('\n', ' ')
+
+                # Add String
+                stringList.append(jaString.strip())
                 i += 1
 
             # Nothing relevant. Skip Line.
@@ -219,17 +182,21 @@ def translateRegex(data, pbar, filename, translatedList):
 
         # Set Strings
         if len(stringList) == len(translatedList):
-            translateRegex(data, pbar, filename, translatedList)
+            for [i, originalString], translatedText in zip(targets, translatedList):
+                # Textwrap
+                translatedText = textwrap.fill(translatedText, width=WIDTH)
+
+                # Set Data
+                data[i] = data[i].replace(originalString, translatedText)
 
         # Mismatch
         else:
-            with LOCK:
-                if filename not in MISMATCH:
-                    MISMATCH.append(filename)
+            currentRun().addMismatch(filename)
     return tokens
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker, pbar, filename):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -237,18 +204,19 @@ def getSpeaker(speaker, pbar, filename):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with only the '+ LANGUAGE +' translation of the NPC name.', False, pbar, filename)
                 response[0] = response[0].replace("'S", "'s")
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -415,7 +383,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -491,7 +459,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag, pbar, filename):
     mismatch = False
     totalTokens = [0, 0]
@@ -519,8 +487,9 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -549,7 +518,7 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
                     if len(tItem) == len(extractedTranslations):
                         tList[index] = extractedTranslations
                     else:
-                        MISMATCH.append(filename)
+                        currentRun().addMismatch(filename)
             else:
                 tList[index] = extractedTranslations
 
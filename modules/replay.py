@@ -0,0 +1,95 @@
+# Libraries
+import functools, hashlib, json, os, threading, time
+
+# Parameters that don't change what the model answers
+UNKEYED = ['timeout']
+
+class ReplayMiss(Exception):
+    pass
+
+def requestKey(kwargs):
+    # Hash of the message list, model and sampling parameters of a chat completion
+    keyed = {key: value for key, value in kwargs.items() if key not in UNKEYED}
+    text = json.dumps(keyed, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class TrafficLog:
+    """
+    Chat completion requests and responses in a JSONL file, one pair per line.
+
+    record  - Append every request sent to the API and its response.
+    replay  - Answer requests from the log instead of calling the API. A request sent
+              more than once gets its recorded responses in order, then the last one
+              again. Misses go to the API when recording too, otherwise raise ReplayMiss.
+
+    Replaying a log against the same files and settings sends the same requests and so
+    writes the same output, without the API, its latency or its cost.
+    """
+    def __init__(self, path, record=False, replay=False):
+        self.path = path
+        self.recording = record
+        self.replaying = replay
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.served = {}
+        if replay and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                entry = json.loads(line)
+                self.responses.setdefault(entry['key'], []).append(entry['response'])
+
+    def replay(self, kwargs):
+        # Recorded response for the request, None when it goes to the API instead
+        if not self.replaying:
+            return None
+        key = requestKey(kwargs)
+        with self.lock:
+            responses = self.responses.get(key)
+            if responses is None:
+                if self.recording:
+                    return None
+                raise ReplayMiss(f'No recorded response for request {key[:12]}')
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+            data = responses[min(index, len(responses) - 1)]
+
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(data)
+
+    def record(self, kwargs, response):
+        if not self.recording:
+            return
+        key = requestKey(kwargs)
+        data = response.model_dump(mode='json')
+        line = json.dumps({
+            'key': key,
+            'time': round(time.time(), 3),
+            'request': {name: value for name, value in kwargs.items() if name not in UNKEYED},
+            'response': data,
+        }, ensure_ascii=False, default=str)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as outFile:
+                outFile.write(line + '\n')
+
+            # Recorded answers can be replayed later in the same process
+            self.responses.setdefault(key, []).append(data)
+            self.served[key] = len(self.responses[key])
+
+@functools.cache
+def trafficLog():
+    """
+    The log set up by apiRecord and apiReplay, or None. Both can point at the same file
+    to replay what is there and record whatever is missing.
+    """
+    recordPath = os.getenv('apiRecord', '')
+    replayPath = os.getenv('apiReplay', '')
+    if not recordPath and not replayPath:
+        return None
+    if recordPath and replayPath and os.path.abspath(recordPath) != os.path.abspath(replayPath):
+        raise ValueError('apiRecord and apiReplay must be the same file when both are set')
+    return TrafficLog(os.path.abspath(recordPath or replayPath), record=bool(recordPath), replay=bool(replayPath))
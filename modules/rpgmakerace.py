@@ -1,43 +1,34 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
-from ruamel.yaml import YAML
+from modules.workqueue import getPagePool, poolSize, submitBounded
+from modules.offload import dumpMarshal, dumpYAML, loadMarshal, loadYAML, timedSerialise
+from modules.run import currentRun, getProgress, inputPath, outputPath, setProgress, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = int(os.getenv('noteWidth'))
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = True    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 BRACKETNAMES = False
-PBAR = None
 
 # Pricing - Depends on the model https://openai.com/pricing
 # Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
@@ -83,119 +74,123 @@ CODE111 = False
 CODE108 = False
 
 def handleACE(filename, estimate):
-    global ESTIMATE, TOKENS
-    ESTIMATE = estimate
+    return writeFile(translateFile(loadFile([filename, estimate])))
+
+# Pipeline Stages: Load -> Translate -> Write
+def loadFile(job):
+    filename, estimate = job
+    startRun(estimate)
+    recordFile(inputPath(filename))
+
+    # .rvdata2 straight from the game, anything else is a YAML export
+    if filename.endswith('.rvdata2'):
+        data = timedSerialise('load', filename, loadMarshal, inputPath(filename))
+    else:
+        data = timedSerialise('load', filename, loadYAML, inputPath(filename))
+    return [filename, estimate, data]
+
+def translateFile(job):
+    filename, estimate, data = job
 
     # Translate
     start = time.time()
-    translatedData = openFiles(filename)
-    
-    # Translate
+    translatedData = parseFile(data, filename)
+    end = time.time()
+    return [filename, estimate, translatedData, end - start]
+
+def writeFile(job):
+    filename, estimate, translatedData, translationTime = job
+    run = currentRun()
+
+    # Write
     if not estimate:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                yaml=YAML(pure=True)
-                yaml.width = 4096
-                yaml.default_style = "'"
-                yaml.dump(translatedData[0], outFile)
+            if filename.endswith('.rvdata2'):
+                timedSerialise('dump', filename, dumpMarshal, translatedData[0], outputPath(filename))
+            else:
+                timedSerialise('dump', filename, dumpYAML, translatedData[0], outputPath(filename))
         except Exception:
             traceback.print_exc()
             return 'Fail'
     
     # Print File
-    end = time.time()
-    tqdm.write(getResultString(translatedData, end - start, filename))
-    with LOCK:
-        TOKENS[0] += translatedData[1][0]
-        TOKENS[1] += translatedData[1][1]
+    tqdm.write(getResultString(translatedData, translationTime, filename))
+    run.addTokens(translatedData[1])
 
     # Print Total
-    totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    totalString = getResultString(['', run.totalTokens(), None], translationTime, 'TOTAL')
 
     # Print any errors on maps
-    if len(MISMATCH) > 0:
-        return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+    if len(run.mismatch) > 0:
+        return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
     else:
         return totalString
 
-def openFiles(filename):
-    yaml=YAML(pure=True)   # Need a yaml instance per thread.
-    yaml.width = 4096
-    yaml.default_style = "'"
-
-    with open('files/' + filename, 'r', encoding='UTF-8') as f:
-        # Map Files
-        if 'Map' in filename and filename != 'MapInfos.json':
-            data = yaml.load(f)
-            translatedData = parseMap(data, filename)
-
-        # CommonEvents Files
-        elif 'CommonEvents' in filename:
-            data = yaml.load(f)
-            translatedData = parseCommonEvents(data, filename)
-
-        # Actor File
-        elif 'Actors' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Actors')
-
-        # Armor File
-        elif 'Armors' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Armors')
-
-        # Weapons File
-        elif 'Weapons' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Weapons')
-        
-        # Classes File
-        elif 'Classes' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Classes')
-
-        # Enemies File
-        elif 'Enemies' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Enemies')
-
-        # Items File
-        elif 'Items' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Items')
-
-        # MapInfo File
-        elif 'MapInfos' in filename:
-            data = yaml.load(f)
+def parseFile(data, filename):
+    # Map Files
+    if 'Map' in filename and not filename.startswith('MapInfos'):
+        translatedData = parseMap(data, filename)
+
+    # CommonEvents Files
+    elif 'CommonEvents' in filename:
+        translatedData = parseCommonEvents(data, filename)
+
+    # Actor File
+    elif 'Actors' in filename:
+        translatedData = parseNames(data, filename, 'Actors')
+
+    # Armor File
+    elif 'Armors' in filename:
+        translatedData = parseNames(data, filename, 'Armors')
+
+    # Weapons File
+    elif 'Weapons' in filename:
+        translatedData = parseNames(data, filename, 'Weapons')
+    
+    # Classes File
+    elif 'Classes' in filename:
+        translatedData = parseNames(data, filename, 'Classes')
+
+    # Enemies File
+    elif 'Enemies' in filename:
+        translatedData = parseNames(data, filename, 'Enemies')
+
+    # Items File
+    elif 'Items' in filename:
+        translatedData = parseNames(data, filename, 'Items')
+
+    # MapInfo File
+    elif 'MapInfos' in filename:
+        # .rvdata2 MapInfos is a Hash keyed by map id. Names are translated in place on
+        # the MapInfo objects, so the Hash is written back as it was read.
+        if isinstance(data, dict):
+            translatedData = parseNames([None] + [data[key] for key in sorted(data)], filename, 'MapInfos')
+            translatedData[0] = data
+        else:
             translatedData = parseNames(data, filename, 'MapInfos')
 
-        # Skills File
-        elif 'Skills' in filename:
-            data = yaml.load(f)
-            translatedData = parseNames(data, filename, 'Skills')
+    # Skills File
+    elif 'Skills' in filename:
+        translatedData = parseNames(data, filename, 'Skills')
 
-        # Troops File
-        elif 'Troops' in filename:
-            data = yaml.load(f)
-            translatedData = parseTroops(data, filename)
+    # Troops File
+    elif 'Troops' in filename:
+        translatedData = parseTroops(data, filename)
 
-        # States File
-        elif 'States' in filename:
-            data = yaml.load(f)
-            translatedData = parseSS(data, filename)
+    # States File
+    elif 'States' in filename:
+        translatedData = parseSS(data, filename)
 
-        # System File
-        elif 'System' in filename:
-            data = yaml.load(f)
-            translatedData = parseSystem(data, filename)
+    # System File
+    elif 'System' in filename:
+        translatedData = parseSystem(data, filename)
 
-        # Scenario File
-        elif 'Scenario' in filename:
-            data = yaml.load(f)
-            translatedData = parseScenario(data, filename)
+    # Scenario File
+    elif 'Scenario' in filename:
+        translatedData = parseScenario(data, filename)
 
-        else:
-            raise NameError(filename + ' Not Supported')
+    else:
+        raise NameError(filename + ' Not Supported')
     
     return translatedData
 
@@ -226,7 +221,6 @@ def parseMap(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     events = data['events']
-    global LOCK
 
     # Translate displayName for Map files
     if 'Map' in filename:
@@ -236,20 +230,22 @@ def parseMap(data, filename):
         data['display_name'] = response[0].replace('\"', '')
     
     # Thread for each page in file
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            for key in events:
-                if key is not None:
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in events[key]['pages'] if page is not None]
-                    for future in as_completed(futures):
-                        try:
-                            totalTokensFuture = future.result()
-                            totalTokens[0] += totalTokensFuture[0]
-                            totalTokens[1] += totalTokensFuture[1]
-                        except Exception as e:
-                            traceback.print_exc()
-                            return [data, totalTokens, e]
+
+        # Queue every page of every event up front so the pool stays busy across events
+        jobs = [(searchCodes, page, pbar, [], filename) for key in events if key is not None \
+                for page in events[key]['pages'] if page is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def translateNote(event, regex):
@@ -303,31 +299,30 @@ def translateNoteOmitSpace(event, regex):
 def parseCommonEvents(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for page in data:
         if page is not None:
             totalLines += len(page['list'])
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in data if page is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    traceback.print_exc()
-                    return [data, totalTokens, e]
+        jobs = [(searchCodes, page, pbar, [], filename) for page in data if page is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def parseTroops(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for troop in data:
@@ -335,20 +330,20 @@ def parseTroops(data, filename):
             for page in troop['pages']:
                 totalLines += len(page['list']) + 1 # The +1 is because each page has a name.
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        for troop in data:
-            if troop is not None:
-                with ThreadPoolExecutor(max_workers=THREADS) as executor:
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in troop['pages'] if page is not None]
-                    for future in as_completed(futures):
-                        try:
-                            totalTokensFuture = future.result()
-                            totalTokens[0] += totalTokensFuture[0]
-                            totalTokens[1] += totalTokensFuture[1]
-                        except Exception as e:
-                            traceback.print_exc()
-                            return [data, totalTokens, e]
+        jobs = [(searchCodes, page, pbar, [], filename) for troop in data if troop is not None \
+                for page in troop['pages'] if page is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
     
 def parseNames(data, filename, context):
@@ -356,7 +351,7 @@ def parseNames(data, filename, context):
     totalLines = 0
     totalLines += len(data)
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
             pbar.desc=filename
             try:
                 result = searchNames(data, pbar, context)       
@@ -372,7 +367,7 @@ def parseSS(data, filename):
     totalLines = 0
     totalLines += len(data)
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
             pbar.desc=filename
             for ss in data:
                 if ss is not None:
@@ -399,7 +394,7 @@ def parseSystem(data, filename):
     totalLines += len(data['armor_types'])
     totalLines += len(data['skill_types'])
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
         try:
             result = searchSystem(data, pbar)       
@@ -413,24 +408,24 @@ def parseSystem(data, filename):
 def parseScenario(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for page in data.items():
         totalLines += len(page[1])
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    traceback.print_exc()
-                    return [data, totalTokens, e]
+        jobs = [(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def searchNames(data, pbar, context):
@@ -610,6 +605,7 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
 
             if context in ['Armors', 'Weapons', 'Items', 'Skills']:
                 # Name
@@ -648,6 +644,7 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
             if context in ['Enemies', 'Classes', 'MapInfos']:
                 response = translateGPT(nameList, newContext, True)
                 translatedNameBatch = response[0]
@@ -675,10 +672,11 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
 
             # Mismatch
             if mismatch == True:
-                MISMATCH.append(nameList)
+                currentRun().addMismatch(nameList)
                 nameList.clear()
                 profileList.clear()
                 descriptionList.clear()
@@ -709,12 +707,7 @@ def searchCodes(page, pbar, jobList, filename):
     syncIndex = 0
     CLFlag = False
     maxHistory = MAXHISTORY
-    global LOCK
-    global NAMESLIST
-    global MISMATCH
-    global PBAR
-    with LOCK:
-        PBAR = pbar
+    setProgress(pbar)
 
 
     # Begin Parsing File
@@ -730,12 +723,11 @@ def searchCodes(page, pbar, jobList, filename):
         # Iterate through page
         i = 0
         while i < len(codeList):
-            with LOCK:  
-                # syncIndex will keep i in sync when it gets modified
-                if syncIndex > i:
-                    i = syncIndex
-                if len(codeList) <= i:
-                    break
+            # syncIndex will keep i in sync when it gets modified
+            if syncIndex > i:
+                i = syncIndex
+            if len(codeList) <= i:
+                break
 
             ## Event Code: 401 Show Text
             if 'c' in codeList[i] and codeList[i]['c'] in [401, 405, -1] and (CODE401 or CODE405):
@@ -1611,8 +1603,7 @@ def searchCodes(page, pbar, jobList, filename):
                             translatedText = varList[choice] + translatedText
                         codeList[i]['p'][0][choice] = translatedText
                 else:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                    currentRun().addMismatch(filename)
 
             ### Event Code: 111 Script
             if 'c' in codeList[i] and codeList[i]['c'] == 111 and CODE111 is True:
@@ -1690,7 +1681,7 @@ def searchCodes(page, pbar, jobList, filename):
         docListTL = []
         scriptListTL = []
         setData = False
-        PBAR = pbar
+        setProgress(pbar)
         
         # 401
         if len(docList) > 0:
@@ -1699,9 +1690,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(docListTL) != len(docList):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1712,9 +1701,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(scriptListTL) != len(scriptList):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1877,6 +1864,7 @@ def searchSystem(data, pbar):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -1884,7 +1872,7 @@ def getSpeaker(speaker):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
@@ -1896,13 +1884,14 @@ def getSpeaker(speaker):
                     response[0] = response[0].replace("'S", "'s")
 
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -2073,7 +2062,7 @@ def translateText(characters, system, user, history, penalty):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0,
         frequency_penalty=penalty,
         model=MODEL,
@@ -2153,9 +2142,8 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
-    global PBAR
     
     mismatch = False
     totalTokens = [0, 0]
@@ -2177,16 +2165,18 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
-            if PBAR is not None:
-                PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             continue
 
         # Create Message
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -2216,11 +2206,12 @@ def translateGPT(text, history, fullPromptFlag):
                     tList[index] = extractedTranslations
                     if len(tItem) != len(extractedTranslations):
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
 
             # Create History
-            with LOCK:
-                if PBAR is not None:
-                    PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             if not mismatch:
                 history = extractedTranslations[-10:]  # Update history if we have a list
             else:
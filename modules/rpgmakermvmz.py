@@ -1,42 +1,35 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
+import json, os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.workqueue import getPagePool, poolSize, submitBounded, submitOrdered
+from modules.offload import dumpJSON, loadJSON, timedSerialise
+from modules.jsonstream import Scanner, Writer, shouldStream
+from modules.run import currentRun, getProgress, inputPath, outputPath, setProgress, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = int(os.getenv('noteWidth'))
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 FIRSTLINESPEAKERS = True    # If 1st line of dialogue is a speaker, set to True 
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 BRACKETNAMES = False
-PBAR = None
 
 # Pricing - Depends on the model https://openai.com/pricing
 # Batch Size - GPT 3.5 Struggles past 15 lines per request. GPT4 struggles past 50 lines per request
@@ -82,100 +75,210 @@ CODE111 = False
 CODE108 = False
 
 def handleMVMZ(filename, estimate):
-    global ESTIMATE, TOKENS
-    ESTIMATE = estimate
+    return writeFile(translateFile(loadFile([filename, estimate])))
+
+# Pipeline Stages: Load -> Translate -> Write
+def loadFile(job):
+    filename, estimate = job
+    startRun(estimate)
+    recordFile(inputPath(filename))
+
+    # Big maps and common events are read an event at a time while they are translated
+    if streamable(filename):
+        return [filename, estimate, None]
+    data = timedSerialise('load', filename, loadJSON, inputPath(filename))
+    return [filename, estimate, data]
+
+def translateFile(job):
+    filename, estimate, data = job
 
     # Translate
     start = time.time()
-    translatedData = openFiles(filename)
-    
-    # Translate
+    if data is None:
+        translatedData = streamFile(filename, estimate)
+    else:
+        translatedData = parseFile(data, filename)
+    end = time.time()
+    return [filename, estimate, translatedData, end - start]
+
+def writeFile(job):
+    filename, estimate, translatedData, translationTime = job
+    run = currentRun()
+
+    # Write
     if not estimate:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                json.dump(translatedData[0], outFile, ensure_ascii=False, indent=4)
+            if translatedData[0] is None:
+                # Streamed files are already written next to their final name
+                os.replace(outputPath(filename) + '.part', outputPath(filename))
+            else:
+                timedSerialise('dump', filename, dumpJSON, translatedData[0], outputPath(filename))
         except Exception:
             traceback.print_exc()
             return 'Fail'
     
     # Print File
-    end = time.time()
-    tqdm.write(getResultString(translatedData, end - start, filename))
-    with LOCK:
-        TOKENS[0] += translatedData[1][0]
-        TOKENS[1] += translatedData[1][1]
+    tqdm.write(getResultString(translatedData, translationTime, filename))
+    run.addTokens(translatedData[1])
 
     # Print Total
-    totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    totalString = getResultString(['', run.totalTokens(), None], translationTime, 'TOTAL')
 
     # Print any errors on maps
-    if len(MISMATCH) > 0:
-        return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+    if len(run.mismatch) > 0:
+        return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
     else:
         return totalString
 
-def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='utf-8-sig') as f:
-        data = json.load(f)
+def streamable(filename):
+    return ((filename.startswith('Map') and not filename.startswith('MapInfos')) or 'CommonEvents' in filename) \
+        and shouldStream(inputPath(filename))
+
+def streamFile(filename, estimate):
+    """
+    Translates a map or CommonEvents file one event at a time (streamJSON). Events are
+    written out in order as soon as they and every one before them are done, so memory
+    holds the events in flight instead of the whole file. Returns the parse result
+    without the data.
+    """
+    totalTokens = [0, 0]
+    failed = []
+    outPath = outputPath(filename) + '.part'
+    outFile = None if estimate else open(outPath, 'w', encoding='utf-8')
+    try:
+        with open(inputPath(filename), 'r', encoding='utf-8-sig') as f, \
+                fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+            pbar.desc=filename
+            scanner = Scanner(f)
+            writer = Writer(outFile)
 
-        # Map Files
-        if 'Map' in filename and filename != 'MapInfos.json':
-            translatedData = parseMap(data, filename)
+            # CommonEvents
+            if scanner.peek() == '[':
+                scanner.expect('[')
+                writer.startArray()
+                streamEvents(scanner.items(), writer, pbar, filename, totalTokens, failed)
+                writer.endArray()
 
-        # CommonEvents Files
-        elif 'CommonEvents' in filename:
-            translatedData = parseCommonEvents(data, filename)
+            # Map Files
+            else:
+                scanner.expect('{')
+                writer.startObject()
+                for key, value in scanner.members(['events']):
+                    if key == 'events' and not isinstance(value, list):
+                        writer.key(key)
+                        writer.startArray()
+                        streamEvents(value, writer, pbar, filename, totalTokens, failed)
+                        writer.endArray()
+                        continue
+                    if key == 'displayName' and not failed:
+                        response = translateGPT(value, 'Reply with only the '+ LANGUAGE +' translation of the RPG location name', False)
+                        totalTokens[0] += response[1][0]
+                        totalTokens[1] += response[1][1]
+                        value = response[0].replace('\"', '')
+                    writer.member(key, value)
+                writer.endObject()
+    except Exception:
+        if outFile is not None:
+            outFile.close()
+            os.remove(outPath)
+        raise
+    if outFile is not None:
+        outFile.close()
+    return [None, totalTokens, failed[0] if failed else None]
+
+def streamEvents(events, writer, pbar, filename, totalTokens, failed):
+    # Events translate on the page pool and are written in file order
+    jobs = ((translateStreamedEvent, event, pbar, filename, failed) for event in events)
+    for job, future in submitOrdered(getPagePool(), jobs, poolSize() * 2):
+        try:
+            tokens = future.result()
+            totalTokens[0] += tokens[0]
+            totalTokens[1] += tokens[1]
+        except Exception as e:
+            traceback.print_exc()
+            failed.append(e)
+        writer.item(job[1])
 
-        # Actor File
-        elif 'Actors' in filename:
-            translatedData = parseNames(data, filename, 'Actors')
+def translateStreamedEvent(event, pbar, filename, failed):
+    # A map event with its notes and pages, or a common event. After a failure the rest
+    # of the file is copied untranslated, like the parse functions returning early.
+    totalTokens = [0, 0]
+    if event is None or failed or currentRun().cancelled():
+        return totalTokens
+    if 'pages' not in event:
+        return searchCodes(event, pbar, [], filename)
+
+    # This translates ID of events. (May break the game)
+    if '<namePop:' in event['note'] or '<LB:' in event['note']:
+        tokens = translateEventNotes(event)
+        totalTokens[0] += tokens[0]
+        totalTokens[1] += tokens[1]
+    for page in event['pages']:
+        if page is not None:
+            tokens = searchCodes(page, pbar, [], filename)
+            totalTokens[0] += tokens[0]
+            totalTokens[1] += tokens[1]
+    return totalTokens
 
-        # Armor File
-        elif 'Armors' in filename:
-            translatedData = parseNames(data, filename, 'Armors')
+def parseFile(data, filename):
+    # Map Files
+    if 'Map' in filename and filename != 'MapInfos.json':
+        translatedData = parseMap(data, filename)
 
-        # Weapons File
-        elif 'Weapons' in filename:
-            translatedData = parseNames(data, filename, 'Weapons')
-        
-        # Classes File
-        elif 'Classes' in filename:
-            translatedData = parseNames(data, filename, 'Classes')
+    # CommonEvents Files
+    elif 'CommonEvents' in filename:
+        translatedData = parseCommonEvents(data, filename)
 
-        # Enemies File
-        elif 'Enemies' in filename:
-            translatedData = parseNames(data, filename, 'Enemies')
+    # Actor File
+    elif 'Actors' in filename:
+        translatedData = parseNames(data, filename, 'Actors')
 
-        # Items File
-        elif 'Items' in filename:
-            translatedData = parseNames(data, filename, 'Items')
+    # Armor File
+    elif 'Armors' in filename:
+        translatedData = parseNames(data, filename, 'Armors')
 
-        # MapInfo File
-        elif 'MapInfos' in filename:
-            translatedData = parseNames(data, filename, 'MapInfos')
+    # Weapons File
+    elif 'Weapons' in filename:
+        translatedData = parseNames(data, filename, 'Weapons')
+    
+    # Classes File
+    elif 'Classes' in filename:
+        translatedData = parseNames(data, filename, 'Classes')
 
-        # Skills File
-        elif 'Skills' in filename:
-            translatedData = parseNames(data, filename, 'Skills')
+    # Enemies File
+    elif 'Enemies' in filename:
+        translatedData = parseNames(data, filename, 'Enemies')
 
-        # Troops File
-        elif 'Troops' in filename:
-            translatedData = parseTroops(data, filename)
+    # Items File
+    elif 'Items' in filename:
+        translatedData = parseNames(data, filename, 'Items')
 
-        # States File
-        elif 'States' in filename:
-            translatedData = parseSS(data, filename)
+    # MapInfo File
+    elif 'MapInfos' in filename:
+        translatedData = parseNames(data, filename, 'MapInfos')
 
-        # System File
-        elif 'System' in filename:
-            translatedData = parseSystem(data, filename)
+    # Skills File
+    elif 'Skills' in filename:
+        translatedData = parseNames(data, filename, 'Skills')
 
-        # Scenario File
-        elif 'Scenario' in filename:
-            translatedData = parseScenario(data, filename)
+    # Troops File
+    elif 'Troops' in filename:
+        translatedData = parseTroops(data, filename)
 
-        else:
-            raise NameError(filename + ' Not Supported')
+    # States File
+    elif 'States' in filename:
+        translatedData = parseSS(data, filename)
+
+    # System File
+    elif 'System' in filename:
+        translatedData = parseSystem(data, filename)
+
+    # Scenario File
+    elif 'Scenario' in filename:
+        translatedData = parseScenario(data, filename)
+
+    else:
+        raise NameError(filename + ' Not Supported')
     
     return translatedData
 
@@ -206,7 +309,6 @@ def parseMap(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     events = data['events']
-    global LOCK
 
     # Translate displayName for Map files
     if 'Map' in filename:
@@ -222,30 +324,28 @@ def parseMap(data, filename):
                 totalLines += len(page['list'])
     
     # Thread for each page in file
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            for event in events:
-                if event is not None:
-                    # This translates ID of events. (May break the game)
-                    if '<namePop:' in event['note']:
-                        response = translateNoteOmitSpace(event, r'<namePop:(.*?)\s?>.*')
-                        totalTokens[0] += response[0]
-                        totalTokens[1] += response[1]
-                    if '<LB:' in event['note']:
-                        response = translateNoteOmitSpace(event, r'<LB:(.*?)\s?>.*')
-                        totalTokens[0] += response[0]
-                        totalTokens[1] += response[1]
-
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in event['pages'] if page is not None]
-                    for future in as_completed(futures):
-                        try:
-                            totalTokensFuture = future.result()
-                            totalTokens[0] += totalTokensFuture[0]
-                            totalTokens[1] += totalTokensFuture[1]
-                        except Exception as e:
-                            traceback.print_exc()
-                            return [data, totalTokens, e]
+
+        # Queue every page of every event up front so the pool stays busy across events
+        jobs = []
+        for event in events:
+            if event is not None:
+                # This translates ID of events. (May break the game)
+                if '<namePop:' in event['note'] or '<LB:' in event['note']:
+                    jobs.append((translateEventNotes, event))
+                jobs.extend((searchCodes, page, pbar, [], filename) for page in event['pages'] if page is not None)
+
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def translateNote(event, regex):
@@ -275,6 +375,19 @@ def translateNote(event, regex):
         return tokens
     return [0,0]
 
+# Both notes live in the same string so they are translated one after the other.
+def translateEventNotes(event):
+    totalTokens = [0, 0]
+    if '<namePop:' in event['note']:
+        response = translateNoteOmitSpace(event, r'<namePop:(.*?)\s?>.*')
+        totalTokens[0] += response[0]
+        totalTokens[1] += response[1]
+    if '<LB:' in event['note']:
+        response = translateNoteOmitSpace(event, r'<LB:(.*?)\s?>.*')
+        totalTokens[0] += response[0]
+        totalTokens[1] += response[1]
+    return totalTokens
+
 # For notes that can't have spaces.
 def translateNoteOmitSpace(event, regex):
     # Regex that only matches text inside LB.
@@ -299,31 +412,30 @@ def translateNoteOmitSpace(event, regex):
 def parseCommonEvents(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for page in data:
         if page is not None:
             totalLines += len(page['list'])
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in data if page is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    traceback.print_exc()
-                    return [data, totalTokens, e]
+        jobs = [(searchCodes, page, pbar, [], filename) for page in data if page is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def parseTroops(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for troop in data:
@@ -331,20 +443,20 @@ def parseTroops(data, filename):
             for page in troop['pages']:
                 totalLines += len(page['list']) + 1 # The +1 is because each page has a name.
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        for troop in data:
-            if troop is not None:
-                with ThreadPoolExecutor(max_workers=THREADS) as executor:
-                    futures = [executor.submit(searchCodes, page, pbar, [], filename) for page in troop['pages'] if page is not None]
-                    for future in as_completed(futures):
-                        try:
-                            totalTokensFuture = future.result()
-                            totalTokens[0] += totalTokensFuture[0]
-                            totalTokens[1] += totalTokensFuture[1]
-                        except Exception as e:
-                            traceback.print_exc()
-                            return [data, totalTokens, e]
+        jobs = [(searchCodes, page, pbar, [], filename) for troop in data if troop is not None \
+                for page in troop['pages'] if page is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
     
 def parseNames(data, filename, context):
@@ -352,7 +464,7 @@ def parseNames(data, filename, context):
     totalLines = 0
     totalLines += len(data)
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
             pbar.desc=filename
             try:
                 result = searchNames(data, pbar, context)       
@@ -368,7 +480,7 @@ def parseSS(data, filename):
     totalLines = 0
     totalLines += len(data)
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
             pbar.desc=filename
             for ss in data:
                 if ss is not None:
@@ -396,7 +508,7 @@ def parseSystem(data, filename):
     totalLines += len(data['armorTypes'])
     totalLines += len(data['skillTypes'])
                 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
         try:
             result = searchSystem(data, pbar)       
@@ -410,24 +522,24 @@ def parseSystem(data, filename):
 def parseScenario(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
-    global LOCK
 
     # Get total for progress bar
     for page in data.items():
         totalLines += len(page[1])
 
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = [executor.submit(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
-            for future in as_completed(futures):
-                try:
-                    totalTokensFuture = future.result()
-                    totalTokens[0] += totalTokensFuture[0]
-                    totalTokens[1] += totalTokensFuture[1]
-                except Exception as e:
-                    traceback.print_exc()
-                    return [data, totalTokens, e]
+        jobs = [(searchCodes, page[1], pbar, [], filename) for page in data.items() if page[1] is not None]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                traceback.print_exc()
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def searchNames(data, pbar, context):
@@ -610,6 +722,7 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
 
             if context in ['Armors', 'Weapons', 'Items', 'Skills']:
                 # Name
@@ -649,6 +762,7 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
             if context in ['Enemies', 'Classes', 'MapInfos']:
                 response = translateGPT(nameList, newContext, True)
                 translatedNameBatch = response[0]
@@ -676,10 +790,11 @@ def searchNames(data, pbar, context):
                             j += 1
                 else:
                     mismatch = True
+                    increment('mismatches_total')
 
             # Mismatch
             if mismatch == True:
-                MISMATCH.append(nameList)
+                currentRun().addMismatch(nameList)
                 nameList.clear()
                 profileList.clear()
                 descriptionList.clear()
@@ -714,12 +829,7 @@ def searchCodes(page, pbar, jobList, filename):
     syncIndex = 0
     CLFlag = False
     maxHistory = MAXHISTORY
-    global LOCK
-    global NAMESLIST
-    global MISMATCH
-    global PBAR
-    with LOCK:
-        PBAR = pbar
+    setProgress(pbar)
 
 
     # Begin Parsing File
@@ -735,12 +845,11 @@ def searchCodes(page, pbar, jobList, filename):
         # Iterate through page
         i = 0
         while i < len(codeList):
-            with LOCK:  
-                # syncIndex will keep i in sync when it gets modified
-                if syncIndex > i:
-                    i = syncIndex
-                if len(codeList) <= i:
-                    break
+            # syncIndex will keep i in sync when it gets modified
+            if syncIndex > i:
+                i = syncIndex
+            if len(codeList) <= i:
+                break
 
             ## Event Code: 401 Show Text
             if 'code' in codeList[i] and codeList[i]['code'] in [401, 405, -1] and (CODE401 or CODE405):
@@ -1641,8 +1750,7 @@ def searchCodes(page, pbar, jobList, filename):
                             translatedText = varList[choice] + translatedText
                         codeList[i]['parameters'][0][choice] = translatedText
                 else:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                    currentRun().addMismatch(filename)
 
             ### Event Code: 111 Script
             if 'code' in codeList[i] and codeList[i]['code'] == 111 and CODE111 is True:
@@ -1722,7 +1830,7 @@ def searchCodes(page, pbar, jobList, filename):
         list355655TL = []
         list108TL = []
         setData = False
-        PBAR = pbar
+        setProgress(pbar)
         
         # 401
         if len(list401) > 0:
@@ -1731,9 +1839,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(list401TL) != len(list401):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1744,9 +1850,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(list122TL) != len(list122):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1757,9 +1861,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(list355655TL) != len(list355655):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1770,9 +1872,7 @@ def searchCodes(page, pbar, jobList, filename):
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(list108TL) != len(list108):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 setData = True
 
@@ -1960,6 +2060,7 @@ def searchSystem(data, pbar):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -1967,7 +2068,7 @@ def getSpeaker(speaker):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with the '+ LANGUAGE +' translation of the NPC name.', False)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
@@ -1979,13 +2080,14 @@ def getSpeaker(speaker):
                     response[0] = response[0].replace("'S", "'s")
 
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -2170,7 +2272,7 @@ def translateText(characters, system, user, history, penalty):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0,
         frequency_penalty=penalty,
         model=MODEL,
@@ -2222,7 +2324,14 @@ def extractTranslation(translatedTextList, is_list):
         if is_list:
             string_list = list(line_dict.values())
             return string_list
+        # A single string can come back tagged too ({"Line1": ...}), or as plain JSON text
+        if isinstance(line_dict, dict) and len(line_dict) > 0:
+            return str(next(iter(line_dict.values())))
+        return translatedTextList
     except Exception as e:
+        # Not JSON, the reply is the translation itself
+        if not is_list:
+            return translatedTextList
         print(e)
 
 def countTokens(characters, system, user, history):
@@ -2250,9 +2359,8 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag):
-    global PBAR
     
     mismatch = False
     totalTokens = [0, 0]
@@ -2274,16 +2382,18 @@ def translateGPT(text, history, fullPromptFlag):
 
         # Things to Check before starting translation
         if not re.search(r'[一-龠ぁ-ゔァ-ヴーａ-ｚＡ-Ｚ０-９]+', subbedT):
-            if PBAR is not None:
-                PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
             continue
 
         # Create Message
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -2311,6 +2421,7 @@ def translateGPT(text, history, fullPromptFlag):
                     extractedTranslations = extractTranslation(translatedText, True)
                     if len(tItem) != len(extractedTranslations):
                         mismatch = True # Just here for breakpoint
+                        increment('mismatches_total')
             
             # Set if no mismatch
             if mismatch == False:
@@ -2321,9 +2432,9 @@ def translateGPT(text, history, fullPromptFlag):
                 mismatch = False
 
             # Update Loading Bar
-            with LOCK:
-                if PBAR is not None:
-                    PBAR.update(len(tItem))
+            progress = getProgress()
+            if progress is not None:
+                progress.update(len(tItem))
         else:
             # Ensure we're passing a single string to extractTranslation
             extractedTranslations = extractTranslation(translatedText, False)
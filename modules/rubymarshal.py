@@ -0,0 +1,416 @@
+# Ruby Marshal 4.8, the format of RPG Maker VX Ace's .rvdata2 files.
+#
+# Objects load as RubyObject, a dict of their instance variables without the @, so Map,
+# CommonEvents and the database files have the same shape as the YAML exports the ACE
+# module walks. Event commands use the c/i/p keys of those exports. Strings with an
+# encoding load as RubyString, written back in that encoding and linked where Ruby shared
+# them. Any other str (a translation) is written as UTF-8, strings without an encoding
+# (binary data) load as bytes. Table, Color and Tone are kept as opaque RubyUserData and
+# written back as is. Floats are written the way Ruby writes them, so a file that wasn't
+# changed is written back byte for byte.
+
+# Libraries
+import decimal, math, struct
+
+VERSION = b'\x04\x08'
+
+# Instance variables renamed to the keys the YAML exports use, per class
+RENAMES = {
+    'RPG::EventCommand': {'@code': 'c', '@indent': 'i', '@parameters': 'p'},
+}
+UNRENAMES = {className: {key: ivar for ivar, key in names.items()} for className, names in RENAMES.items()}
+
+# Range Ruby writes as a fixnum, anything else is a bignum
+FIXNUMMIN = -(1 << 30)
+FIXNUMMAX = (1 << 30) - 1
+
+class RubySymbol(str):
+    pass
+
+class RubyString(str):
+    # String as read, with the encoding it had: True for UTF-8, False for US-ASCII or the name
+    def __new__(cls, value, encoding):
+        string = super().__new__(cls, value)
+        string.encoding = encoding
+        return string
+
+    def __reduce__(self):
+        # Pickled through the process pool
+        return (RubyString, (str(self), self.encoding))
+
+class RubyObject(dict):
+    # Instance of className, instance variables as keys
+    def __init__(self, className, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.className = className
+
+class RubyHash(dict):
+    # Hash with a default value
+    def __init__(self, default, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
+
+class RubyUserData:
+    # Object serialised by its class' _dump (Table, Color, Tone)
+    def __init__(self, className, data):
+        self.className = className
+        self.data = data
+
+    def __eq__(self, other):
+        return isinstance(other, RubyUserData) and other.className == self.className and other.data == self.data
+
+class RubyUserMarshal:
+    # Object serialised by its class' marshal_dump
+    def __init__(self, className, data):
+        self.className = className
+        self.data = data
+
+    def __eq__(self, other):
+        return isinstance(other, RubyUserMarshal) and other.className == self.className and other.data == self.data
+
+def codec(encoding):
+    # Python codec for a Ruby string encoding
+    if encoding is True:
+        return 'utf-8'
+    if encoding is False:
+        return 'ascii'
+    return {'Windows-31J': 'cp932', 'CP932': 'cp932', 'ASCII-8BIT': 'latin-1'}.get(encoding, encoding)
+
+def floatText(value):
+    # Shortest digits, laid out like Ruby's w_float
+    if value != value:
+        return 'nan'
+    if value in (float('inf'), float('-inf')):
+        return 'inf' if value > 0 else '-inf'
+    if value == 0:
+        return '-0' if math.copysign(1, value) < 0 else '0'
+    sign, digits, exponent = decimal.Decimal(repr(value)).normalize().as_tuple()
+    digits = ''.join(map(str, digits))
+    point = len(digits) + exponent
+    text = '-' if sign else ''
+    if point < -3 or point > len(digits):
+        text += digits[0] + ('.' + digits[1:] if len(digits) > 1 else '') + f'e{point - 1}'
+    elif point > 0:
+        text += digits[:point] + ('.' + digits[point:] if len(digits) > point else '')
+    else:
+        text += '0.' + '0' * -point + digits
+    return text
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.symbols = []
+        self.objects = []
+
+    def byte(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def bytes(self, size):
+        value = self.data[self.pos:self.pos + size]
+        if len(value) != size:
+            raise ValueError('Marshal data ends early')
+        self.pos += size
+        return value
+
+    def long(self):
+        c = self.byte()
+        if c > 127:
+            c -= 256
+        if c == 0:
+            return 0
+        if 4 < c < 128:
+            return c - 5
+        if -129 < c < -4:
+            return c + 5
+        if c > 0:
+            return int.from_bytes(self.bytes(c), 'little')
+        return int.from_bytes(self.bytes(-c), 'little') - (1 << (-8 * c))
+
+    def string(self):
+        return self.bytes(self.long())
+
+    def entry(self, value):
+        self.objects.append(value)
+        return value
+
+    def symbol(self):
+        kind = self.byte()
+        if kind == 0x3b:   # ;
+            return self.symbols[self.long()]
+        ivars = kind == 0x49   # I
+        if ivars:
+            kind = self.byte()
+        if kind != 0x3a:   # :
+            raise ValueError(f'Expected a symbol at {self.pos - 1}')
+        name = self.string()
+        if ivars:
+            for _ in range(self.long()):
+                self.symbol()
+                self.read()
+        value = RubySymbol(name.decode('utf-8', 'surrogateescape'))
+        self.symbols.append(value)
+        return value
+
+    def encoded(self, value, ivars):
+        # Decodes a string by its encoding instance variable, bytes when it has none
+        encoding = None
+        for _ in range(ivars):
+            name = self.symbol()
+            ivar = self.read()
+            if name == 'E':
+                encoding = bool(ivar)
+            elif name == 'encoding':
+                encoding = ivar if isinstance(ivar, str) else ivar.decode('ascii')
+        if encoding is None:
+            return value
+        return RubyString(value.decode(codec(encoding), 'surrogateescape'), encoding)
+
+    def read(self):
+        kind = self.byte()
+        if kind == 0x30:   # 0
+            return None
+        if kind == 0x54:   # T
+            return True
+        if kind == 0x46:   # F
+            return False
+        if kind == 0x69:   # i
+            return self.long()
+        if kind in (0x3a, 0x3b):
+            self.pos -= 1
+            return self.symbol()
+        if kind == 0x40:   # @
+            return self.objects[self.long()]
+        if kind == 0x49:   # I
+            if self.data[self.pos] != 0x22:
+                # Instance variables on anything but a string carry nothing we use
+                value = self.read()
+                self.encoded(b'', self.long())
+                return value
+            self.pos += 1
+            index = len(self.objects)
+            value = self.encoded(self.entry(self.string()), self.long())
+            self.objects[index] = value
+            return value
+        if kind == 0x22:   # "
+            return self.entry(self.string())
+        if kind == 0x5b:   # [
+            value = self.entry([])
+            for _ in range(self.long()):
+                value.append(self.read())
+            return value
+        if kind in (0x7b, 0x7d):   # { }
+            value = self.entry(RubyHash(None) if kind == 0x7d else {})
+            for _ in range(self.long()):
+                key = self.read()
+                value[key] = self.read()
+            if kind == 0x7d:
+                value.default = self.read()
+            return value
+        if kind == 0x6f:   # o
+            className = self.symbol()
+            value = self.entry(RubyObject(className))
+            renames = RENAMES.get(className, {})
+            for _ in range(self.long()):
+                name = self.symbol()
+                value[renames.get(name, name[1:])] = self.read()
+            return value
+        if kind == 0x66:   # f
+            text = self.string().split(b'\x00')[0].decode('ascii')
+            return self.entry({'inf': float('inf'), '-inf': float('-inf'), 'nan': float('nan')}.get(text) or float(text))
+        if kind == 0x6c:   # l
+            sign = self.byte()
+            value = int.from_bytes(self.bytes(self.long() * 2), 'little')
+            return self.entry(-value if sign == 0x2d else value)
+        if kind == 0x75:   # u
+            className = self.symbol()
+            return self.entry(RubyUserData(className, self.string()))
+        if kind == 0x55:   # U
+            value = self.entry(RubyUserMarshal(self.symbol(), None))
+            value.data = self.read()
+            return value
+        raise ValueError(f'Unsupported Marshal type {chr(kind)!r} at {self.pos - 1}')
+
+class Writer:
+    def __init__(self):
+        self.out = bytearray(VERSION)
+        self.symbols = {}
+        self.objects = {}
+        self.floats = {}
+        self.encodings = {}
+        self.count = 0
+        self.alive = []
+
+    def long(self, value):
+        if value == 0:
+            self.out.append(0)
+        elif 0 < value < 123:
+            self.out.append(value + 5)
+        elif -124 < value < 0:
+            self.out.append((value - 5) & 0xff)
+        else:
+            buffer = bytearray()
+            for i in range(1, 5):
+                buffer.append(value & 0xff)
+                value >>= 8
+                if value == 0:
+                    self.out.append(i)
+                    break
+                if value == -1:
+                    self.out.append(256 - i)
+                    break
+            self.out += buffer
+
+    def string(self, value):
+        self.long(len(value))
+        self.out += value
+
+    def symbol(self, name):
+        index = self.symbols.get(name)
+        if index is not None:
+            self.out.append(0x3b)
+            self.long(index)
+            return
+        self.symbols[name] = len(self.symbols)
+        encoded = name.encode('utf-8', 'surrogateescape')
+        if encoded.isascii():
+            self.out.append(0x3a)
+            self.string(encoded)
+        else:
+            self.out += b'I:'
+            self.string(encoded)
+            self.long(1)
+            self.symbol('E')
+            self.out.append(0x54)
+
+    def entry(self, value):
+        # Writes a link for an object already written, otherwise registers it
+        index = self.objects.get(id(value))
+        if index is not None:
+            self.out.append(0x40)
+            self.long(index)
+            return False
+        self.objects[id(value)] = self.count
+        self.alive.append(value)
+        self.count += 1
+        return True
+
+    def write(self, value):
+        if value is None:
+            self.out.append(0x30)
+        elif value is True:
+            self.out.append(0x54)
+        elif value is False:
+            self.out.append(0x46)
+        elif isinstance(value, RubySymbol):
+            self.symbol(value)
+        elif isinstance(value, int):
+            if FIXNUMMIN <= value <= FIXNUMMAX:
+                self.out.append(0x69)
+                self.long(value)
+            else:
+                # Bignums are objects, but never shared
+                self.count += 1
+                self.out += b'l+' if value >= 0 else b'l-'
+                magnitude = abs(value).to_bytes((abs(value).bit_length() + 15) // 16 * 2, 'little')
+                self.long(len(magnitude) // 2)
+                self.out += magnitude
+        elif isinstance(value, RubyString):
+            # Each RubyString is one Ruby string, linked wherever Ruby shared it
+            if self.entry(value):
+                self.out += b'I"'
+                self.string(value.encode(codec(value.encoding), 'surrogateescape'))
+                self.long(1)
+                if isinstance(value.encoding, bool):
+                    self.symbol('E')
+                    self.out.append(0x54 if value.encoding else 0x46)
+                else:
+                    # Ruby writes each encoding name once as a string and links it after
+                    self.symbol('encoding')
+                    index = self.encodings.get(value.encoding)
+                    if index is not None:
+                        self.out.append(0x40)
+                        self.long(index)
+                    else:
+                        self.encodings[value.encoding] = self.count
+                        self.count += 1
+                        self.out.append(0x22)
+                        self.string(value.encoding.encode('ascii'))
+        elif isinstance(value, str):
+            # Other strings are never linked, equal Python strings can be the same object
+            self.count += 1
+            self.out += b'I"'
+            self.string(value.encode('utf-8', 'surrogateescape'))
+            self.long(1)
+            self.symbol('E')
+            self.out.append(0x54)
+        elif isinstance(value, (bytes, bytearray)):
+            self.count += 1
+            self.out.append(0x22)
+            self.string(bytes(value))
+        elif isinstance(value, float):
+            # Ruby links equal floats it keeps as immediates (flonums), other floats are
+            # separate objects
+            bits = struct.unpack('<Q', struct.pack('<d', value))[0]
+            flonum = bits == 0 or ((bits >> 60) & 7 in (3, 4) and bits != 0x3000000000000000)
+            index = self.floats.get(bits) if flonum else None
+            if index is not None:
+                self.out.append(0x40)
+                self.long(index)
+                return
+            if flonum:
+                self.floats[bits] = self.count
+            self.count += 1
+            self.out.append(0x66)
+            self.string(floatText(value).encode('ascii'))
+        elif isinstance(value, (list, tuple)):
+            if self.entry(value):
+                self.out.append(0x5b)
+                self.long(len(value))
+                for item in value:
+                    self.write(item)
+        elif isinstance(value, RubyObject):
+            if self.entry(value):
+                self.out.append(0x6f)
+                self.symbol(value.className)
+                renames = UNRENAMES.get(value.className, {})
+                self.long(len(value))
+                for key, item in value.items():
+                    self.symbol(renames.get(key, '@' + key))
+                    self.write(item)
+        elif isinstance(value, dict):
+            if self.entry(value):
+                default = isinstance(value, RubyHash)
+                self.out.append(0x7d if default else 0x7b)
+                self.long(len(value))
+                for key, item in value.items():
+                    self.write(key)
+                    self.write(item)
+                if default:
+                    self.write(value.default)
+        elif isinstance(value, RubyUserData):
+            if self.entry(value):
+                self.out.append(0x75)
+                self.symbol(value.className)
+                self.string(value.data)
+        elif isinstance(value, RubyUserMarshal):
+            if self.entry(value):
+                self.out.append(0x55)
+                self.symbol(value.className)
+                self.write(value.data)
+        else:
+            raise TypeError(f'Cannot marshal {type(value).__name__}')
+
+def loads(data):
+    if data[:2] != VERSION:
+        raise ValueError('Not Ruby Marshal 4.8 data')
+    reader = Reader(data)
+    reader.pos = 2
+    return reader.read()
+
+def dumps(value):
+    writer = Writer()
+    writer.write(value)
+    return bytes(writer.out)
@@ -0,0 +1,135 @@
+# Libraries
+import contextvars, os, threading
+from contextlib import contextmanager
+
+#Globals
+CURRENTRUN = contextvars.ContextVar('run', default=None)
+PROGRESS = contextvars.ContextVar('progress', default=None)
+
+class RunCancelled(Exception):
+    pass
+
+class TranslationRun:
+    """
+    Everything a single translate or estimate run used to keep in module globals.
+
+    estimate    - Only count tokens, don't call the API.
+    config      - Free form settings for the run (engine, folders, ...).
+    root        - Project folder holding files/ and translated/, '' for the working folder.
+    names       - Speaker cache, a list of [original, translated].
+    caches      - Other per run caches keyed by name.
+    mismatch    - Files (or batches) that came back with the wrong number of lines.
+    ioTimes     - Seconds spent loading and dumping each file, {file: {'load': s, 'dump': s}}.
+    progress    - Default progress bar used when a task hasn't set its own.
+    overall     - OverallProgress for the whole run, None when per file bars are used.
+
+    A run can be cancelled from another thread. Work that hasn't started yet is skipped,
+    requests already sent are allowed to finish.
+
+    Token counters are kept per worker thread so adding to them never takes a lock.
+    They are merged when read.
+    """
+    def __init__(self, estimate=False, config=None, progress=None, root=''):
+        self.estimate = estimate
+        self.config = config if config is not None else {}
+        self.root = root
+        self.names = []
+        self.caches = {}
+        self.mismatch = []
+        self.ioTimes = {}
+        self.progress = progress
+        self.overall = None
+        self.lock = threading.Lock()
+        self.counters = []
+        self.local = threading.local()
+        self.cancelEvent = threading.Event()
+
+    def counter(self):
+        counter = getattr(self.local, 'counter', None)
+        if counter is None:
+            counter = [0, 0]
+            self.local.counter = counter
+            with self.lock:
+                self.counters.append(counter)
+        return counter
+
+    def addTokens(self, tokens):
+        counter = self.counter()
+        counter[0] += tokens[0]
+        counter[1] += tokens[1]
+
+    def totalTokens(self):
+        return [sum(counter[0] for counter in self.counters), sum(counter[1] for counter in self.counters)]
+
+    def addIOTime(self, filename, kind, seconds):
+        with self.lock:
+            times = self.ioTimes.setdefault(filename, {})
+            times[kind] = times.get(kind, 0.0) + seconds
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def cancelled(self):
+        return self.cancelEvent.is_set()
+
+    def checkCancelled(self):
+        if self.cancelEvent.is_set():
+            raise RunCancelled('Run was cancelled')
+
+    def addMismatch(self, item):
+        with self.lock:
+            if item not in self.mismatch:
+                self.mismatch.append(item)
+
+# Used by handlers that are called outside of a run, same behaviour as the old module globals.
+DEFAULTRUN = TranslationRun()
+
+def currentRun():
+    run = CURRENTRUN.get()
+    return run if run is not None else DEFAULTRUN
+
+def startRun(estimate):
+    """
+    Returns the run a handler should report into. Handlers called without an active run
+    share the default run and set its estimate flag, like the old ESTIMATE global.
+    """
+    run = CURRENTRUN.get()
+    if run is None:
+        run = DEFAULTRUN
+        run.estimate = estimate
+    return run
+
+def inputPath(filename):
+    # files/<filename> in the current run's project
+    return os.path.join(currentRun().root, 'files', filename)
+
+def outputPath(filename):
+    # translated/<filename> in the current run's project
+    return os.path.join(currentRun().root, 'translated', filename)
+
+@contextmanager
+def activeRun(run):
+    token = CURRENTRUN.set(run)
+    try:
+        yield run
+    finally:
+        CURRENTRUN.reset(token)
+
+def setProgress(pbar):
+    # Progress bar for the current task only. Each pooled task runs in its own context copy.
+    PROGRESS.set(pbar)
+
+def getProgress():
+    pbar = PROGRESS.get()
+    return pbar if pbar is not None else currentRun().progress
+
+def bindContext(function):
+    """
+    Wraps function so it runs in a copy of the caller's context. Thread pools don't carry
+    context variables over on their own, so anything handed to a pool needs this to see
+    the active run.
+    """
+    context = contextvars.copy_context()
+    def bound(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return bound
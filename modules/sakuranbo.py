@@ -1,24 +1,20 @@
 import os
 import re
 import textwrap
-import threading
 import time
 import traceback
-from pathlib import Path
 
 import openai
 import tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, readPrompt, retryRequest
+from modules.metrics import recordFile
 
 # Open AI
-load_dotenv()
-if os.getenv("api").replace(" ", "") != "":
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv("org")
-openai.api_key = os.getenv("key")
+configureOpenAI()
 
 # Globals
 MODEL = os.getenv("model")
@@ -26,18 +22,15 @@ TIMEOUT = int(os.getenv("timeout"))
 LANGUAGE = os.getenv("language").capitalize()
 INPUTAPICOST = 0.002  # Depends on the model https://openai.com/pricing
 OUTPUTAPICOST = 0.002
-PROMPT = Path("prompt.txt").read_text(encoding="utf-8")
+PROMPT = readPrompt()
 THREADS = int(
     os.getenv("threads")
 )  # Controls how many threads are working on a single file (May have to drop this)
-LOCK = threading.Lock()
 WIDTH = int(os.getenv("width"))
 LISTWIDTH = int(os.getenv("listWidth"))
 NOTEWIDTH = 40
 MAXHISTORY = 10
-ESTIMATE = ""
 totalTokens = [0, 0]
-NAMESLIST = []
 
 # tqdm Globals
 BAR_FORMAT = "{l_bar}{bar:10}{r_bar}{bar:-10b}"
@@ -52,9 +45,7 @@ IGNORETLTEXT = False
 
 
 def handleSakuranbo(filename, estimate):
-    global ESTIMATE
-    totalTokens = [0, 0]
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
     if estimate:
         start = time.time()
@@ -64,16 +55,14 @@ def handleSakuranbo(filename, estimate):
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
         if NAMES is True:
-            tqdm.write(str(NAMESLIST))
-        with LOCK:
-            totalTokens[0] += translatedData[1][0]
-            totalTokens[1] += translatedData[1][1]
+            tqdm.write(str(currentRun().names))
+        run.addTokens(translatedData[1])
 
-        return getResultString(["", totalTokens, None], end - start, "TOTAL")
+        return getResultString(["", run.totalTokens(), None], end - start, "TOTAL")
 
     else:
         try:
-            with open("translated/" + filename, "w", encoding="utf-16") as outFile:
+            with open(outputPath(filename), "w", encoding="utf-16") as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
                 outFile.writelines(translatedData[0])
@@ -81,14 +70,12 @@ def handleSakuranbo(filename, estimate):
                 # Print Result
                 end = time.time()
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    totalTokens[0] += translatedData[1][0]
-                    totalTokens[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception:
             traceback.print_exc()
             return "Fail"
 
-    return getResultString(["", totalTokens, None], end - start, "TOTAL")
+    return getResultString(["", run.totalTokens(), None], end - start, "TOTAL")
 
 
 def getResultString(translatedData, translationTime, filename):
@@ -135,7 +122,8 @@ def getResultString(translatedData, translationTime, filename):
 
 
 def openFiles(filename):
-    with open("files/" + filename, "r", encoding="utf-16") as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), "r", encoding="utf-16") as readFile:
         translatedData = parseTyrano(readFile, filename)
 
         # Delete lines marked for deletion
@@ -156,7 +144,7 @@ def parseTyrano(readFile, filename):
     data = readFile.readlines()
     totalLines = len(data)
 
-    with tqdm(
+    with fileBar(
         bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE
     ) as pbar:
         pbar.desc = filename
@@ -180,7 +168,6 @@ def translateTyrano(data, pbar):
     syncIndex = 0
     speaker = ""
     delFlag = False
-    global LOCK, ESTIMATE
 
     for i in range(len(data)):
         currentGroup = []
@@ -539,7 +526,7 @@ def resubVars(translatedText, allList):
     return translatedText
 
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(t, history, fullPromptFlag):
     # Sub Vars
     varResponse = subVars(t)
@@ -550,7 +537,8 @@ def translateGPT(t, history, fullPromptFlag):
         return (t, [0, 0])
 
     # If ESTIMATE is True just count this as an execution and return.
-    if ESTIMATE:
+    if currentRun().estimate:
+        advanceOverall(subbedT)
         enc = tiktoken.encoding_for_model('gpt-4')
         historyRaw = ""
         if isinstance(history, list):
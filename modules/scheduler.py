@@ -0,0 +1,55 @@
+# Libraries
+import os
+
+def fileWeight(path):
+    """
+    Cheap size estimate for a file used to order work. Bytes on disk track the amount of
+    extracted text closely enough for every engine and cost a single stat call.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def scheduleFiles(folder, extension):
+    """
+    Returns the files in folder ending with extension ('mps|dat' for several), largest
+    first (LPT scheduling).
+    Starting the biggest files first stops a huge CommonEvents file from being picked up
+    last and dominating the run while the other workers sit idle.
+    """
+    filenames = [filename for filename in os.listdir(folder) if filename.endswith(tuple(extension.split('|')))]
+    weights = {filename: fileWeight(os.path.join(folder, filename)) for filename in filenames}
+    return sorted(filenames, key=lambda filename: weights[filename], reverse=True)
+
+def listSchedule(durations, workers):
+    """
+    Greedy list scheduling. Each duration goes to whichever worker frees up first, in the
+    given order. Returns the makespan.
+    """
+    if workers <= 0:
+        raise ValueError("workers must be a positive integer")
+
+    slots = [0.0] * workers
+    for duration in durations:
+        slot = slots.index(min(slots))
+        slots[slot] += duration
+    return max(slots)
+
+def simulateMakespan(files, fileThreads, threads, order='lpt', shared=False):
+    """
+    Simulates a run over files, a list of (name, [page durations]).
+
+    order   - 'listdir' keeps the given order, 'lpt' starts the largest files first.
+    shared  - False gives every file its own pool of threads workers (one file per file
+              worker). True puts every page on a single pool of fileThreads * threads
+              workers so idle workers pick up pages from whatever file is still running.
+    """
+    if order == 'lpt':
+        files = sorted(files, key=lambda file: sum(file[1]), reverse=True)
+
+    if shared:
+        return listSchedule([page for file in files for page in file[1]], fileThreads * threads)
+
+    fileDurations = [listSchedule(pages, threads) if pages else 0.0 for name, pages in files]
+    return listSchedule(fileDurations, fileThreads)
@@ -0,0 +1,81 @@
+# Libraries
+import functools, os, time
+from pathlib import Path
+from dotenv import load_dotenv
+from retry import retry
+from modules.metrics import RETRYLOG, increment, recordRequest
+from modules.replay import ReplayMiss, trafficLog
+from modules.tracing import TRACER
+from modules.progress import scanRequest
+
+# State every engine used to load for itself on import. Each function only does the work
+# once per process no matter how many engines are imported.
+
+@functools.cache
+def configureOpenAI():
+    import openai
+    load_dotenv()
+    if os.getenv('api').replace(' ', '') != '':
+        openai.base_url = os.getenv('api')
+    openai.organization = os.getenv('org')
+    openai.api_key = os.getenv('key')
+
+    # Build the module client now, while only one thread is here. It is otherwise built on
+    # first use, and when several threads send their first request together each builds
+    # one. The spare closes the shared connection pool when it is garbage collected.
+    openai.chat.completions
+
+    # Read the replay log once here instead of in whichever request thread gets there first
+    trafficLog()
+
+def retryRequest(function):
+    """
+    translateGPT's retry: five tries, five seconds apart, logged to RETRYLOG. A ReplayMiss
+    is raised on the first try, the log won't have the answer the next time either.
+    """
+    def attempt(*args, **kwargs):
+        try:
+            return [function(*args, **kwargs), None]
+        except ReplayMiss as e:
+            return [None, e]
+    retried = retry(exceptions=Exception, tries=5, delay=5, logger=RETRYLOG)(attempt)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        result, miss = retried(*args, **kwargs)
+        if miss is not None:
+            raise miss
+        return result
+    return wrapper
+
+@functools.cache
+def readPrompt():
+    return Path('prompt.txt').read_text(encoding='utf-8')
+
+@functools.cache
+def readVocab():
+    return Path('vocab.txt').read_text(encoding='utf-8')
+
+def createCompletion(**kwargs):
+    # Every chat completion goes through here so latency, failures and tokens are recorded
+    import openai
+    traffic = trafficLog()
+    if traffic is not None:
+        response = traffic.replay(kwargs)
+        if response is not None:
+            increment('cache_hits_total', cache='replay')
+            scanRequest(kwargs.get('messages'))
+            return response
+
+    start = time.perf_counter()
+    with TRACER.span('request', 'http', model=kwargs.get('model')):
+        try:
+            response = openai.chat.completions.create(**kwargs)
+        except Exception as e:
+            recordRequest(time.perf_counter() - start, error=e)
+            raise
+    recordRequest(time.perf_counter() - start, response)
+    scanRequest(kwargs.get('messages'))
+    if traffic is not None:
+        traffic.record(kwargs, response)
+    return response
@@ -0,0 +1,17 @@
+# Line based engines note what replaces which lines while they read a script and build the
+# translated script once at the end. Popping and inserting in place moves the rest of the
+# list on every edit, which makes big scripts quadratic.
+
+def spliceLines(lines, patches):
+    """
+    Returns lines with every [start, end, replacement] patch applied, lines[start:end]
+    swapped for the list replacement. Patches are in order and don't overlap.
+    """
+    out = []
+    position = 0
+    for start, end, replacement in patches:
+        out.extend(lines[position:start])
+        out.extend(replacement)
+        position = end
+    out.extend(lines[position:])
+    return out
@@ -0,0 +1,84 @@
+# Libraries
+import functools, json, os, threading, time
+from contextlib import contextmanager, nullcontext
+
+class Tracer:
+    """
+    Collects spans in the Chrome trace event format so a run can be opened in Perfetto
+    (ui.perfetto.dev) or chrome://tracing. Each worker thread gets its own track, which
+    shows idle workers, files that hold up the pool and retry stalls at a glance.
+
+    Spans: file, pipeline stage, page, translateGPT, HTTP request and retry sleep.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def start(self, path):
+        self.enabled = True
+        self.path = path
+        self.origin = time.perf_counter()
+
+    def now(self):
+        # Microseconds since the trace started
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def complete(self, name, category, start, duration, args=None):
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            with self.lock:
+                self.threads[thread.ident] = thread.name
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': round(start, 1), 'dur': round(duration, 1), 'pid': os.getpid(), 'tid': thread.ident}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def span(self, name, category, **args):
+        if not self.enabled:
+            return nullcontext()
+        return self.timedSpan(name, category, args)
+
+    @contextmanager
+    def timedSpan(self, name, category, args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, self.now() - start, args)
+
+    def wrap(self, function, name, category, argument=None):
+        # argument - index of a positional argument to show on the span, like the file name
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            spanArgs = {}
+            if argument is not None and len(args) > argument:
+                value = args[argument]
+                spanArgs['file'] = value[0] if isinstance(value, list) else value
+            with self.timedSpan(name, category, spanArgs):
+                return function(*args, **kwargs)
+        return traced
+
+    def instrument(self, module):
+        if getattr(module, '_traced', False):
+            return
+        if hasattr(module, 'translateGPT'):
+            module.translateGPT = self.wrap(module.translateGPT, 'translateGPT', 'batch')
+        module._traced = True
+
+    def write(self):
+        if not self.enabled or self.path is None:
+            return
+        with self.lock:
+            threads = dict(self.threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}} for ident, name in threads.items()]
+        with open(self.path, 'w', encoding='utf-8') as outFile:
+            json.dump({'traceEvents': metadata + list(self.events), 'displayTimeUnit': 'ms'}, outFile)
+
+def addTraceArguments(parser):
+    parser.add_argument('--trace', help='Write a Chrome trace (open in ui.perfetto.dev) of files, pages, batches, requests and retries to this file.')
+
+TRACER = Tracer()
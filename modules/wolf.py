@@ -1,40 +1,34 @@
 # Libraries
-import json, os, re, textwrap, threading, time, traceback, tiktoken, openai
+import os, re, textwrap, time, traceback, tiktoken
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from pathlib import Path
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.workqueue import getPagePool, poolSize, submitBounded
+from modules.run import bindContext, currentRun, inputPath, outputPath, startRun
+from modules.progress import JAPANESE, advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
+from modules.offload import dumpJSON, loadJSON, timedSerialise
+from modules.wolfdata import dumpWolfData, isWolfData, loadWolfData
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = int(os.getenv('noteWidth'))
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []   # Keep list for consistency
-TERMSLIST = []   # Keep list for consistency
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 BRACKETNAMES = False
 
 # Pricing - Depends on the model https://openai.com/pricing
@@ -51,6 +45,10 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 20
     FREQUENCY_PENALTY = 0.1
 
+# Common events are split into pieces of about this many tokens of text that translate in
+# parallel. Each piece starts its own batches and history, so smaller pieces cost more.
+PIECETOKENS = int(os.getenv('wolfPieceTokens', 8000))
+
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
 POSITION = 0
@@ -76,8 +74,12 @@ ENEMYFLAG = False
 WEAPONFLAG = False
 
 def handleWOLF(filename, estimate):
-    global ESTIMATE, TOKENS
-    ESTIMATE = estimate
+    run = startRun(estimate)
+
+    # Other .dat files in the Data folder have no text to translate, leave them as they are
+    if not filename.endswith('.json') and not isWolfData(inputPath(filename)):
+        tqdm.write(Fore.YELLOW + filename + ': Skipped, not a map, CommonEvent.dat or database with a .project' + Fore.RESET)
+        return getResultString(['', run.totalTokens(), None], 0, 'TOTAL')
 
     # Translate
     start = time.time()
@@ -86,8 +88,13 @@ def handleWOLF(filename, estimate):
     # Translate
     if not estimate:
         try:
-            with open('translated/' + filename, 'w', encoding='utf-8') as outFile:
-                json.dump(translatedData[0], outFile, ensure_ascii=False, indent=4)
+            dump = dumpJSON if filename.endswith('.json') else dumpWolfData
+            failed = timedSerialise('dump', filename, dump, translatedData[0], outputPath(filename))
+
+            # Binaries are cp932, translations it can't hold keep the original text
+            if failed:
+                run.addMismatch(filename)
+                tqdm.write(Fore.RED + f'{filename}: {len(failed)} strings kept in Japanese, not encodable in cp932: {failed[:3]}' + Fore.RESET)
         except Exception:
             traceback.print_exc()
             return 'Fail'
@@ -95,40 +102,43 @@ def handleWOLF(filename, estimate):
     # Print File
     end = time.time()
     tqdm.write(getResultString(translatedData, end - start, filename))
-    with LOCK:
-        TOKENS[0] += translatedData[1][0]
-        TOKENS[1] += translatedData[1][1]
+    run.addTokens(translatedData[1])
 
     # Print Total
-    totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
     # Print any errors on maps
-    if len(MISMATCH) > 0:
-        return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+    if len(run.mismatch) > 0:
+        return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
     else:
         return totalString
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='utf-8-sig') as f:
-        data = json.load(f)
-
-        # Map Files
-        if "'events':" in str(data):
-            if len(data['events']) > 0:
-                translatedData = parseMap(data, filename)
-            else:
-                return [data, [0,0], None]
+    recordFile(inputPath(filename))
+    # Maps and .dat files are read straight from the game's binaries
+    load = loadJSON if filename.endswith('.json') else loadWolfData
+    data = timedSerialise('load', filename, load, inputPath(filename))
+
+    # The format shows in the top level keys, no need to look through the whole tree
+    keys = data.keys() if isinstance(data, dict) else []
+
+    # Map Files
+    if 'events' in keys:
+        if len(data['events']) > 0:
+            translatedData = parseMap(data, filename)
+        else:
+            return [data, [0,0], None]
 
-        # Map Files
-        elif "'types':" in str(data):
-            translatedData = parseDB(data, filename)
+    # Map Files
+    elif 'types' in keys:
+        translatedData = parseDB(data, filename)
 
-        # Other Files
-        elif "'commands':" in str(data):
-            translatedData = parseOther(data, filename)
-            
-        else:
-            raise NameError(filename + ' Not Supported')
+    # Other Files
+    elif 'commands' in keys:
+        translatedData = parseOther(data, filename)
+        
+    else:
+        raise NameError(filename + ' Not Supported')
     
     return translatedData
 
@@ -159,58 +169,85 @@ def parseOther(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     events = data['commands']
-    global LOCK
-    
-    # Thread for each page in file
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+
+    # Split into pieces at blank (code 0) commands, which close every common event, once a
+    # piece holds PIECETOKENS of text (about one token per Japanese character)
+    pieces = [[]]
+    tokens = 0
+    for command in events:
+        pieces[-1].append(command)
+        tokens += sum(len(JAPANESE.findall(string)) for string in command['stringArgs'] if isinstance(string, str))
+        if command['code'] == 0 and tokens >= PIECETOKENS:
+            pieces.append([])
+            tokens = 0
+
+    # Get total for progress bar
+    totalLines = countCommands(events)
+
+    # Thread for each piece in file
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
-        translationData = searchCodes(events, pbar, [], filename)
-        try:
-            totalTokens[0] += translationData[0]
-            totalTokens[1] += translationData[1]
-        except Exception as e:
-            return [data, totalTokens, e]
+        jobs = [(searchCodes, piece, pbar, [], filename) for piece in pieces if len(piece) > 0]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def parseDB(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     events = data['types']
-    global LOCK
-    
-    # Thread for each page in file
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+
+    # Get total for progress bar. Groups run at the same time, so only this sets it.
+    totalLines = countFields(events)
+
+    # Thread for each group of entries in file
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
-        translationData = searchDB(events, pbar, [], filename)
-        try:
-            totalTokens[0] += translationData[0]
-            totalTokens[1] += translationData[1]
-        except Exception as e:
-            return [data, totalTokens, e]
+
+        # Each type in groups of BATCHSIZE entries. A group fills one request per field, the
+        # same requests searchDB sends for the whole type, and entries are updated in place.
+        jobs = [(searchDB, [dict(table, data=table['data'][start:start + BATCHSIZE])], pbar, [], filename)
+                for table in events for start in range(0, len(table['data']), BATCHSIZE)]
+        futures = submitBounded(getPagePool(), jobs, poolSize() * 2)
+        for future in futures:
+            try:
+                totalTokensFuture = future.result()
+                totalTokens[0] += totalTokensFuture[0]
+                totalTokens[1] += totalTokensFuture[1]
+            except Exception as e:
+                futures.close()
+                return [data, totalTokens, e]
     return [data, totalTokens, None]
 
 def parseMap(data, filename):
     totalTokens = [0, 0]
     totalLines = 0
     events = data['events']
-    global LOCK
 
     # Get total for progress bar
     for event in events:
         if event is not None:
             for page in event['pages']:
-                totalLines += len(page['list'])
+                if page is not None:
+                    totalLines += countCommands(page['list'])
     
     # Thread for each page in file
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, total=totalLines, leave=LEAVE) as pbar:
         pbar.desc=filename
         pbar.total=totalLines
         with ThreadPoolExecutor(max_workers=THREADS) as executor:
             for event in events:
                 if event is not None:
-                    futures = [executor.submit(searchCodes, page['list'], pbar, [], filename) for page in event['pages'] if page is not None]
+                    futures = [executor.submit(bindContext(searchCodes), page['list'], pbar, [], filename) for page in event['pages'] if page is not None]
                     for future in as_completed(futures):
                         try:
                             totalTokensFuture = future.result()
@@ -220,7 +257,32 @@ def parseMap(data, filename):
                             return [data, totalTokens, e]
     return [data, totalTokens, None]
 
+def countCommands(commands):
+    # Commands searchCodes translates
+    codeFlags = {
+        101: CODE101,
+        102: CODE102,
+        122: CODE122,
+        300: CODE300,
+        250: CODE250
+    }
+    return sum(1 for command in commands if codeFlags.get(command['code'], False))
+
+def countFields(tables):
+    # Fields of the entries in the types searchDB translates
+    tableFlags = {
+        '主人公ステータス': NPCFLAG,
+        'Hシナリオ': SCENARIOFLAG,
+        'アイテム': ITEMFLAG,
+        '防具': ARMORFLAG,
+        '敵ｷｬﾗ個体ﾃﾞｰﾀ': ENEMYFLAG,
+        '武器': WEAPONFLAG,
+        '鍛冶師用DB': COLLECTIONFLAG
+    }
+    return sum(len(entry['data']) for table in tables if tableFlags.get(table['name'], False) for entry in table['data'])
+
 def searchCodes(events, pbar, translatedList, filename):
+    termsList = currentRun().caches.setdefault('terms', [])
     codeList = events
     stringList = []
     textHistory = []
@@ -229,24 +291,7 @@ def searchCodes(events, pbar, translatedList, filename):
     speaker = ''
     nametag = ''
     initialJAString = ''
-    global LOCK
-    global NAMESLIST
-    global MISMATCH
 
-    # Calculate Total Length
-    code_flags = {
-        102: CODE102,
-        122: CODE122,
-        300: CODE300,
-        250: CODE250
-    }
-    totalList = 0
-    for code_item in codeList:
-        if code_flags.get(code_item['code'], False):
-            totalList += 1
-    pbar.total = totalList
-    pbar.refresh()
-    
     # Begin Parsing File
     try:
         # Iterate through events
@@ -471,9 +516,9 @@ def searchCodes(events, pbar, translatedList, filename):
                         jaString = jaString.replace(matchList[0], '')
 
                     # Check if term already translated
-                    for j in range(len(TERMSLIST)):
-                        if jaString == TERMSLIST[j][0]:
-                            translatedText = TERMSLIST[j][1]
+                    for j in range(len(termsList)):
+                        if jaString == termsList[j][0]:
+                            translatedText = termsList[j][1]
                             foundTerm = True
 
                     # Translate
@@ -482,7 +527,7 @@ def searchCodes(events, pbar, translatedList, filename):
                         translatedText = response[0]
                         totalTokens[0] = response[1][0]
                         totalTokens[1] = response[1][1]
-                        TERMSLIST.append([jaString, translatedText])
+                        termsList.append([jaString, translatedText])
 
                     # Add back Potential Variables in String
                     translatedText = varString + translatedText
@@ -495,16 +540,12 @@ def searchCodes(events, pbar, translatedList, filename):
              
         # End of the line
         if translatedList == [] and stringList != []:
-            pbar.total = len(stringList)
-            pbar.refresh()
             response = translateGPT(stringList, textHistory, True, pbar, filename)
             translatedList = response[0]
             totalTokens[0] += response[1][0]
             totalTokens[1] += response[1][1]
             if len(translatedList) != len(stringList):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 stringList = []
                 searchCodes(events, pbar, translatedList, filename)
@@ -549,21 +590,7 @@ def searchDB(events, pbar, jobList, filename):
     initialJAString = ''
     tableList = events
     font = '\\f[18]'
-    global LOCK
-    global NAMESLIST
-    global MISMATCH
     
-    # Calculate Total
-    totalLines = 0
-    for table in tableList:
-        if table['name'] == 'NPC' and NPCFLAG == True:
-            for NPC in table['data']:
-                totalLines += len(NPC['data'])
-        if table['name'] == 'Hシナリオ' and SCENARIOFLAG == True:
-            for hScenario in table['data']:
-                totalLines += len(hScenario['data'])
-    pbar.total = totalLines
-    pbar.refresh()
 
     # Begin Parsing File
     try:
@@ -1003,13 +1030,6 @@ def searchDB(events, pbar, jobList, filename):
 
         # NPCs
         if len(NPCList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for itemArray in NPCList:
-                total += len(itemArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(NPCList[0], 'Reply with only the '+ LANGUAGE +' translation of the RPG item name', True, pbar, filename)
             nameListTL = response[0]
@@ -1036,22 +1056,13 @@ def searchDB(events, pbar, jobList, filename):
             len(descListTL1) != len(NPCList[1]) or\
             len(descListTL2) != len(NPCList[2])or\
             len(descListTL3) != len(NPCList[3]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 NPCListTL = [nameListTL, descListTL1, descListTL2, descListTL3]
                 translate = True  
 
         # SCENARIO
         if len(scenarioList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for scenarioArray in scenarioList:
-                total += len(scenarioArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(scenarioList[0], 'Reply with only the '+ LANGUAGE +' translation', True, pbar, filename)
             nameListTL = response[0]
@@ -1072,22 +1083,13 @@ def searchDB(events, pbar, jobList, filename):
             if len(nameListTL) != len(scenarioList[0]) or\
             len(descListTL1) != len(scenarioList[1]) or\
             len(descListTL2) != len(scenarioList[2]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 scenarioListTL = [nameListTL, descListTL1, descListTL2]
                 translate = True 
 
         # ITEMS
         if len(itemList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for itemArray in itemList:
-                total += len(itemArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(itemList[0], 'Reply with only the '+ LANGUAGE +' translation of the RPG item name', True, pbar, filename)
             nameListTL = response[0]
@@ -1114,22 +1116,13 @@ def searchDB(events, pbar, jobList, filename):
             len(descListTL1) != len(itemList[1]) or\
             len(descListTL2) != len(itemList[2])or\
             len(descListTL3) != len(itemList[3]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 itemListTL = [nameListTL, descListTL1, descListTL2, descListTL3]
                 translate = True  
 
         # Armor
         if len(armorList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for armorArray in armorList:
-                total += len(armorArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(armorList[0], 'Reply with only the '+ LANGUAGE +' translation of the RPG item name', True, pbar, filename)
             nameListTL = response[0]
@@ -1144,22 +1137,13 @@ def searchDB(events, pbar, jobList, filename):
             # Check Mismatch
             if len(nameListTL) != len(armorList[0]) or\
             len(descListTL1) != len(armorList[1]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 armorListTL = [nameListTL, descListTL1]
                 translate = True  
 
         # Enemies
         if len(enemyList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for enemyArray in enemyList:
-                total += len(enemyArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(enemyList[0], 'Reply with only the '+ LANGUAGE +' translation of the RPG item name', True, pbar, filename)
             nameListTL = response[0]
@@ -1174,22 +1158,13 @@ def searchDB(events, pbar, jobList, filename):
             # Check Mismatch
             if len(nameListTL) != len(enemyList[0]) or\
             len(descListTL1) != len(enemyList[1]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 enemyListTL = [nameListTL, descListTL1]
                 translate = True  
 
         # Weapons
         if len(weaponsList[0]) > 0:
-            # Progress Bar
-            total = 0
-            for weaponsArray in weaponsList:
-                total += len(weaponsArray)
-            pbar.total = total
-            pbar.refresh()
-
             # Name
             response = translateGPT(weaponsList[0], 'Reply with only the '+ LANGUAGE +' translation of the RPG item name', True, pbar, filename)
             nameListTL = response[0]
@@ -1210,9 +1185,7 @@ def searchDB(events, pbar, jobList, filename):
             if len(nameListTL) != len(weaponsList[0]) or\
             len(descListTL1) != len(weaponsList[1]) or\
             len(descListTL2) != len(weaponsList[2]):
-                with LOCK:
-                    if filename not in MISMATCH:
-                        MISMATCH.append(filename)
+                currentRun().addMismatch(filename)
             else:
                 weaponsListTL = [nameListTL, descListTL1, descListTL2]
                 translate = True  
@@ -1220,13 +1193,6 @@ def searchDB(events, pbar, jobList, filename):
         # Collection
         for list in collectionList:
             if len(list) > 0:
-                # Progress Bar
-                total = 0
-                for collectionArray in collectionList:
-                    total += len(collectionArray)
-                pbar.total = total
-                pbar.refresh()
-
                 # Name
                 response = translateGPT(collectionList[0], '', True, pbar, filename)
                 nameListTL = response[0]
@@ -1249,9 +1215,7 @@ def searchDB(events, pbar, jobList, filename):
                 if len(nameListTL) != len(collectionList[0]) or\
                 len(descListTL1) != len(collectionList[1]) or\
                 len(descListTL2) != len(collectionList[2]):
-                    with LOCK:
-                        if filename not in MISMATCH:
-                            MISMATCH.append(filename)
+                    currentRun().addMismatch(filename)
                 else:
                     collectionListTL = [nameListTL, descListTL1, descListTL2]
                     translate = True  
@@ -1278,6 +1242,7 @@ def searchDB(events, pbar, jobList, filename):
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker, pbar, filename):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -1285,19 +1250,20 @@ def getSpeaker(speaker, pbar, filename):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with only the '+ LANGUAGE +' translation of the NPC name.', False, pbar, filename)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -1472,7 +1438,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -1554,7 +1520,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag, pbar, filename):
     mismatch = False
     totalTokens = [0, 0]
@@ -1582,8 +1548,9 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -1612,7 +1579,7 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
                     if len(tItem) == len(extractedTranslations):
                         tList[index] = extractedTranslations
                     else:
-                        MISMATCH.append(filename)
+                        currentRun().addMismatch(filename)
             else:
                 tList[index] = extractedTranslations
 
@@ -1,38 +1,31 @@
 # Libraries
-import os, re, textwrap, threading, time, traceback, tiktoken, openai
-from pathlib import Path
+import os, re, textwrap, time, traceback, tiktoken
 from colorama import Fore
-from dotenv import load_dotenv
-from retry import retry
 from tqdm import tqdm
+from modules.run import currentRun, inputPath, outputPath, startRun
+from modules.progress import advanceOverall, fileBar
+from modules.shared import configureOpenAI, createCompletion, readPrompt, readVocab, retryRequest
+from modules.metrics import increment, recordFile
+from modules.splice import spliceLines
 
 # Open AI
-load_dotenv()
-if os.getenv('api').replace(' ', '') != '':
-    openai.base_url = os.getenv('api')
-openai.organization = os.getenv('org')
-openai.api_key = os.getenv('key')
+configureOpenAI()
 
 #Globals
 MODEL = os.getenv('model')
 TIMEOUT = int(os.getenv('timeout'))
 LANGUAGE = os.getenv('language').capitalize()
-PROMPT = Path('prompt.txt').read_text(encoding='utf-8')
-VOCAB = Path('vocab.txt').read_text(encoding='utf-8')
+PROMPT = readPrompt()
+VOCAB = readVocab()
 THREADS = int(os.getenv('threads'))
-LOCK = threading.Lock()
 WIDTH = int(os.getenv('width'))
 LISTWIDTH = int(os.getenv('listWidth'))
 NOTEWIDTH = 70
 MAXHISTORY = 10
-ESTIMATE = ''
-TOKENS = [0, 0]
-NAMESLIST = []
 NAMES = False    # Output a list of all the character names found
 BRFLAG = False   # If the game uses <br> instead
 FIXTEXTWRAP = True  # Overwrites textwrap
 IGNORETLTEXT = False    # Ignores all translated text.
-MISMATCH = []   # Lists files that throw a mismatch error (Length of GPT list response is wrong)
 
 #tqdm Globals
 BAR_FORMAT='{l_bar}{bar:10}{r_bar}{bar:-10b}'
@@ -52,32 +45,29 @@ elif 'gpt-4' in MODEL:
     BATCHSIZE = 40
 
 def handleWOLF2(filename, estimate):
-    global ESTIMATE
-    ESTIMATE = estimate
+    run = startRun(estimate)
 
-    if ESTIMATE:
+    if run.estimate:
         start = time.time()
         translatedData = openFiles(filename)
 
         # Print Result
         end = time.time()
         tqdm.write(getResultString(translatedData, end - start, filename))
-        with LOCK:
-            TOKENS[0] += translatedData[1][0]
-            TOKENS[1] += translatedData[1][1]
+        run.addTokens(translatedData[1])
 
         # Print Total
-        totalString = getResultString(['', TOKENS, None], end - start, 'TOTAL')
+        totalString = getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
         # Print any errors on maps
-        if len(MISMATCH) > 0:
-            return totalString + Fore.RED + f'\nMismatch Errors: {MISMATCH}' + Fore.RESET
+        if len(run.mismatch) > 0:
+            return totalString + Fore.RED + f'\nMismatch Errors: {run.mismatch}' + Fore.RESET
         else:
             return totalString
     
     else:
         try:
-            with open('translated/' + filename, 'w', encoding='cp932', errors='ignore') as outFile:
+            with open(outputPath(filename), 'w', encoding='cp932', errors='ignore') as outFile:
                 start = time.time()
                 translatedData = openFiles(filename)
 
@@ -85,14 +75,12 @@ def handleWOLF2(filename, estimate):
                 end = time.time()
                 outFile.writelines(translatedData[0])
                 tqdm.write(getResultString(translatedData, end - start, filename))
-                with LOCK:
-                    TOKENS[0] += translatedData[1][0]
-                    TOKENS[1] += translatedData[1][1]
+                run.addTokens(translatedData[1])
         except Exception as e:
             traceback.print_exc()
             return 'Fail'
 
-    return getResultString(['', TOKENS, None], end - start, 'TOTAL')
+    return getResultString(['', run.totalTokens(), None], end - start, 'TOTAL')
 
 def getResultString(translatedData, translationTime, filename):
     # File Print String
@@ -119,7 +107,8 @@ def getResultString(translatedData, translationTime, filename):
                 errorString + Fore.RESET
 
 def openFiles(filename):
-    with open('files/' + filename, 'r', encoding='shift_jis') as readFile:
+    recordFile(inputPath(filename))
+    with open(inputPath(filename), 'r', encoding='shift_jis') as readFile:
         translatedData = parseWOLF(readFile, filename)
 
         # Delete lines marked for deletion
@@ -138,11 +127,11 @@ def parseWOLF(readFile, filename):
     data = readFile.readlines()
 
     # Create Progress Bar
-    with tqdm(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
+    with fileBar(bar_format=BAR_FORMAT, position=POSITION, leave=LEAVE) as pbar:
         pbar.desc=filename
 
         try:
-            result = translateWOLF(data, pbar, filename, [])
+            result = translateWOLF(data, pbar, filename)
             totalTokens[0] += result[0]
             totalTokens[1] += result[1]
         except Exception as e:
@@ -150,12 +139,12 @@ def parseWOLF(readFile, filename):
             return [data, totalTokens, e]
     return [data, totalTokens, None]
 
-def translateWOLF(data, pbar, filename, translatedList):
+def translateWOLF(data, pbar, filename):
     stringList = []
+    patches = []
     currentGroup = []
     tokens = [0,0]
     speaker = ''
-    global LOCK, ESTIMATE
     i = 0
 
     while i < len(data):
@@ -173,53 +162,31 @@ def translateWOLF(data, pbar, filename, translatedList):
 
         # Lines
         if r'/' not in data[i] and data[i] != '\n':
-            # Pass 1
-            if translatedList == []:
-                # Grab Consecutive Strings
+            # Grab Consecutive Strings
+            start = i
+            currentGroup.append(data[i])
+            i += 1
+            while  i < len(data) and r'/' not in data[i] and data[i] != '\n':
                 currentGroup.append(data[i])
                 i += 1
-                while  i < len(data) and r'/' not in data[i] and data[i] != '\n':
-                    currentGroup.append(data[i])
-                    i += 1
-                
-                # Join up 401 groups for better translation.
-                if len(currentGroup) > 0:
-                    jaString = ''.join(currentGroup)
-                    currentGroup = []
-                
-                # Remove any textwrap
-                jaString = jaString.replace('\n', ' ')
-
-                # Add Speaker (If there is one)
-                if speaker != '':
-                    jaString = f'{speaker}: {jaString}'
-
-                # Add String
-                stringList.append(jaString)
-                i += 1
-            
-            # Pass 2
-            else:
-                # Insert Strings
-                while  i < len(data) and r'/' not in data[i] and data[i] != '\n':
-                    data.pop(i)
-
-                # Get Text
-                translatedText = translatedList[0]
-                translatedList.pop(0)
 
-                if len(translatedList) <= 0:
-                    translatedList = None
+            # The group is replaced by its translation once it comes back
+            patches.append([start, i, None])
+            
+            # Join up 401 groups for better translation.
+            jaString = ''.join(currentGroup)
+            currentGroup = []
+            
+            # Remove any textwrap
+            jaString = jaString.replace('\n', ' ')
 
-                # Remove added speaker
-                translatedText = re.sub(r'^.+?:\s', '', translatedText)
+            # Add Speaker (If there is one)
+            if speaker != '':
+                jaString = f'{speaker}: {jaString}'
 
-                # Textwrap
-                translatedText = textwrap.fill(translatedText, width=WIDTH)
-
-                # Set Data
-                data.insert(i, f'{translatedText}\n')
-                i += 1
+            # Add String
+            stringList.append(jaString)
+            i += 1
 
         # Nothing relevant. Skip Line.
         else:
@@ -239,17 +206,23 @@ def translateWOLF(data, pbar, filename, translatedList):
 
         # Set Strings
         if len(stringList) == len(translatedList):
-            translateWOLF(data, pbar, filename, translatedList)
+            for patch, translatedText in zip(patches, translatedList):
+                # Remove added speaker
+                translatedText = re.sub(r'^.+?:\s', '', translatedText)
+
+                # Textwrap
+                translatedText = textwrap.fill(translatedText, width=WIDTH)
+                patch[2] = [f'{translatedText}\n']
+            data[:] = spliceLines(data, patches)
 
         # Mismatch
         else:
-            with LOCK:
-                if filename not in MISMATCH:
-                    MISMATCH.append(filename)
+            currentRun().addMismatch(filename)
     return tokens
 
 # Save some money and enter the character before translation
 def getSpeaker(speaker, pbar, filename):
+    namesList = currentRun().names
     match speaker:
         case 'ファイン':
             return ['Fine', [0,0]]
@@ -257,19 +230,20 @@ def getSpeaker(speaker, pbar, filename):
             return ['', [0,0]]
         case _:
             # Store Speaker
-            if speaker not in str(NAMESLIST):
+            if speaker not in str(namesList):
                 response = translateGPT(speaker, 'Reply with only the '+ LANGUAGE +' translation of the NPC name.', False, pbar, filename)
                 response[0] = response[0].title()
                 response[0] = response[0].replace("'S", "'s")
                 speakerList = [speaker, response[0]]
-                NAMESLIST.append(speakerList)
+                namesList.append(speakerList)
                 return response
             
             # Find Speaker
             else:
-                for i in range(len(NAMESLIST)):
-                    if speaker == NAMESLIST[i][0]:
-                        return [NAMESLIST[i][1],[0,0]]
+                for i in range(len(namesList)):
+                    if speaker == namesList[i][0]:
+                        increment('cache_hits_total', cache='names')
+                        return [namesList[i][1],[0,0]]
                                
     return [speaker,[0,0]]
 
@@ -432,7 +406,7 @@ def translateText(characters, system, user, history):
     
     # Content to TL
     msg.append({"role": "user", "content": f'{user}'})
-    response = openai.chat.completions.create(
+    response = createCompletion(
         temperature=0.1,
         frequency_penalty=0.1,
         model=MODEL,
@@ -508,7 +482,7 @@ def combineList(tlist, text):
         return [t for sublist in tlist for t in sublist]
     return tlist[0]
 
-@retry(exceptions=Exception, tries=5, delay=5)
+@retryRequest
 def translateGPT(text, history, fullPromptFlag, pbar, filename):
     mismatch = False
     totalTokens = [0, 0]
@@ -536,8 +510,9 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
         characters, system, user = createContext(fullPromptFlag, subbedT)
 
         # Calculate Estimate
-        if ESTIMATE:
+        if currentRun().estimate:
             estimate = countTokens(characters, system, user, history)
+            advanceOverall(user)
             totalTokens[0] += estimate[0]
             totalTokens[1] += estimate[1]
             continue
@@ -566,7 +541,7 @@ def translateGPT(text, history, fullPromptFlag, pbar, filename):
                     if len(tItem) == len(extractedTranslations):
                         tList[index] = extractedTranslations
                     else:
-                        MISMATCH.append(filename)
+                        currentRun().addMismatch(filename)
             else:
                 tList[index] = extractedTranslations
 
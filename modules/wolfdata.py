@@ -0,0 +1,293 @@
+# Libraries
+import os, struct
+
+# Wolf RPG Editor binaries: maps (.mps), CommonEvent.dat and the databases (.project with
+# the type, field and entry names, .dat with the values). The layout follows the open
+# source WolfTrans and WolfTL readers for unencrypted 2.x files.
+#
+# Files load into the shapes the JSON exports have, so searchCodes and searchDB walk them
+# unchanged: {'events': [{'id', 'name', 'pages': [{'list': [command]}]}]} for maps,
+# {'commands': [command]} with every common event's commands in order for CommonEvent.dat,
+# {'types': [{'name', 'data': [{'name', 'data': [{'name', 'value'}]}]}]}
+# for databases. Commands are {'code', 'intArgs', 'stringArgs', 'indent'}.
+#
+# Every translatable string is recorded with where it sits in the file. Writing copies the
+# original bytes and only re-encodes the strings that changed, so everything this reader
+# doesn't interpret goes back untouched.
+
+ENCODING = 'cp932'
+MAPMAGIC = b'\x00' * 10 + b'W\x00\x00OL\x00M\x00'
+COMMONMAGIC = b'\x00W\x00\x00OL\x00FC\x00'
+DATMAGIC = b'W\x00\x00OL\x00FM\x00'
+INTFIELD = 0x3E8
+STRINGFIELD = 0x7D0
+
+class Reader:
+    def __init__(self, raw):
+        self.raw = raw
+        self.pos = 0
+        self.spans = []
+
+    def bytes(self, size):
+        if self.pos + size > len(self.raw):
+            raise ValueError('Wolf file ends early')
+        value = self.raw[self.pos:self.pos + size]
+        self.pos += size
+        return value
+
+    def byte(self):
+        return self.bytes(1)[0]
+
+    def int(self):
+        return struct.unpack_from('<i', self.bytes(4))[0]
+
+    def string(self):
+        size = self.int()
+        if size <= 0:
+            return ''
+        return self.bytes(size).rstrip(b'\x00').decode(ENCODING, 'replace')
+
+    def text(self, container, *keys):
+        """
+        Reads a string the engines may translate into container at keys, remembering where
+        it sits in the file. The keys are kept rather than the list holding the string, as
+        the engines replace a command's whole stringArgs.
+        """
+        start = self.pos
+        value = self.string()
+        target = container
+        for key in keys[:-1]:
+            target = target[key]
+        target[keys[-1]] = value
+        self.spans.append([start, self.pos - start, container, keys, value])
+
+    def verify(self, expected, what):
+        if self.bytes(len(expected)) != expected:
+            raise ValueError(f'Not a supported Wolf {what} at byte {self.pos - len(expected)}')
+
+    def indicator(self, expected, what):
+        value = self.byte()
+        if value != expected:
+            raise ValueError(f'Expected {expected:#x} in Wolf {what} at byte {self.pos - 1}, found {value:#x}')
+
+    def route(self):
+        for _ in range(self.int()):
+            self.byte()
+            self.bytes(self.byte() * 4)
+            self.verify(b'\x01\x00', 'move route')
+
+    def command(self):
+        count = self.byte()
+        command = {'code': self.int(), 'intArgs': [self.int() for _ in range(count - 1)]}
+        command['indent'] = self.byte()
+        command['stringArgs'] = [None] * self.byte()
+        for i in range(len(command['stringArgs'])):
+            self.text(command, 'stringArgs', i)
+        terminator = self.byte()
+        if terminator == 0x01:
+            # Move route
+            self.bytes(5)
+            self.byte()
+            self.route()
+        elif terminator != 0x00:
+            raise ValueError(f'Unknown Wolf command terminator {terminator:#x} at byte {self.pos - 1}')
+        return command
+
+    def commands(self):
+        return [self.command() for _ in range(self.int())]
+
+    def page(self):
+        self.int()
+        self.string()
+        self.bytes(4 + 37 + 4 + 2)
+        self.route()
+        page = {'list': self.commands()}
+        self.verify(b'\x03\x00\x00\x00', 'page')
+        self.bytes(3)
+        self.indicator(0x7A, 'page')
+        return page
+
+    def mapEvent(self):
+        self.verify(b'\x39\x30\x00\x00', 'event')
+        event = {'id': self.int(), 'name': self.string()}
+        self.bytes(8)
+        self.int()
+        self.verify(b'\x00\x00\x00\x00', 'event')
+        event['pages'] = []
+        while (indicator := self.byte()) == 0x79:
+            event['pages'].append(self.page())
+        if indicator != 0x70:
+            raise ValueError(f'Expected 0x70 after Wolf event pages at byte {self.pos - 1}, found {indicator:#x}')
+        return event
+
+    def commonEvent(self):
+        self.indicator(0x8E, 'common event')
+        event = {'id': self.int()}
+        self.int()
+        self.bytes(7)
+        event['name'] = self.string()
+        event['pages'] = [{'list': self.commands()}]
+        self.string()
+        self.string()
+        self.indicator(0x8F, 'common event')
+        for _ in range(self.int()):
+            self.string()
+        self.bytes(self.int())
+        for _ in range(self.int()):
+            for _ in range(self.int()):
+                self.string()
+        for _ in range(self.int()):
+            self.bytes(self.int() * 4)
+        self.bytes(0x1D)
+        for _ in range(100):
+            self.string()
+        self.indicator(0x91, 'common event')
+        self.string()
+        indicator = self.byte()
+        if indicator == 0x92:
+            self.string()
+            self.int()
+            self.indicator(0x92, 'common event')
+        elif indicator != 0x91:
+            raise ValueError(f'Expected 0x91 or 0x92 in Wolf common event at byte {self.pos - 1}, found {indicator:#x}')
+        return event
+
+def readMap(raw):
+    reader = Reader(raw)
+    reader.verify(MAPMAGIC, 'map')
+    reader.int()
+    reader.byte()
+    reader.string()
+    reader.int()
+    width = reader.int()
+    height = reader.int()
+    reader.int()
+    reader.bytes(width * height * 3 * 4)
+    events = []
+    while (indicator := reader.byte()) == 0x6F:
+        events.append(reader.mapEvent())
+    if indicator != 0x66:
+        raise ValueError(f'Expected 0x66 after Wolf map events at byte {reader.pos - 1}, found {indicator:#x}')
+    return [{'events': events}, reader.spans]
+
+def readCommonEvents(raw):
+    reader = Reader(raw)
+    reader.verify(COMMONMAGIC, 'CommonEvent.dat')
+    reader.byte()
+    events = [reader.commonEvent() for _ in range(reader.int())]
+    return [{'commands': [command for event in events for page in event['pages'] for command in page['list']]}, reader.spans]
+
+def readProject(raw):
+    # Names of every type, its fields and its entries
+    reader = Reader(raw)
+    types = []
+    for _ in range(reader.int()):
+        name = reader.string()
+        fields = [reader.string() for _ in range(reader.int())]
+        entries = [reader.string() for _ in range(reader.int())]
+        reader.string()
+        reader.bytes(reader.int())
+        for _ in range(reader.int()):
+            reader.string()
+        for _ in range(reader.int()):
+            for _ in range(reader.int()):
+                reader.string()
+        for _ in range(reader.int()):
+            reader.bytes(reader.int() * 4)
+        reader.bytes(reader.int() * 4)
+        types.append([name, fields, entries])
+    return types
+
+def readDatabase(raw, project):
+    reader = Reader(raw)
+    if raw[:1] == b'\x00':
+        reader.bytes(1)
+    reader.verify(DATMAGIC, 'database')
+    reader.byte()
+    if reader.int() != len(project):
+        raise ValueError('Wolf .dat and .project have a different number of types')
+
+    types = []
+    for name, fieldNames, entryNames in project:
+        reader.verify(b'\xFE\xFF\xFF\xFF', 'database type')
+        reader.int()
+        fields = [reader.int() for _ in range(reader.int())]
+        entries = []
+        for index in range(reader.int()):
+            values = [{'name': fieldNames[i] if i < len(fieldNames) else '', 'value': None} for i in range(len(fields))]
+
+            # An entry holds its ints then its strings, each field saying which slot is its own
+            numbers = {field - INTFIELD: value for value, field in zip(values, fields) if field < STRINGFIELD}
+            strings = {field - STRINGFIELD: value for value, field in zip(values, fields) if field >= STRINGFIELD}
+            for slot in sorted(numbers):
+                numbers[slot]['value'] = reader.int()
+            for slot in sorted(strings):
+                reader.text(strings[slot], 'value')
+            entries.append({'name': entryNames[index] if index < len(entryNames) else '', 'data': values})
+        types.append({'name': name, 'data': entries})
+    return [{'types': types}, reader.spans]
+
+def isWolfData(path):
+    """
+    Maps, CommonEvent.dat and databases with their .project next to them. A game's Data
+    folder holds other .dat files too (Game.dat, TileSetData.dat, ...) this can't read.
+    """
+    filename = os.path.basename(path)
+    return filename.endswith('.mps') or filename.startswith('CommonEvent') or os.path.exists(path[:-4] + '.project')
+
+def loadWolfData(path):
+    """
+    Reads a map, CommonEvent.dat or database .dat (with its .project next to it). The
+    original bytes and the place of every string come along so dumpWolfData can patch it.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    filename = os.path.basename(path)
+    if filename.endswith('.mps'):
+        data, spans = readMap(raw)
+    elif filename.startswith('CommonEvent'):
+        data, spans = readCommonEvents(raw)
+    elif os.path.exists(path[:-4] + '.project'):
+        with open(path[:-4] + '.project', 'rb') as f:
+            data, spans = readDatabase(raw, readProject(f.read()))
+    else:
+        raise NameError(filename + ' Not Supported')
+    data['raw'] = raw
+    data['spans'] = spans
+    return data
+
+def encodeString(value):
+    # Strict, a character cp932 doesn't have would otherwise be written as '?'
+    if '\ufffd' in value:
+        raise UnicodeEncodeError(ENCODING, value, value.index('\ufffd'), value.index('\ufffd') + 1, 'undecodable bytes in the original')
+    encoded = value.encode(ENCODING) + b'\x00'
+    return struct.pack('<i', len(encoded)) + encoded
+
+def dumpWolfData(data, path):
+    """
+    Writes the original file with every changed string re-encoded in place. Strings that
+    can't be written in cp932 keep their original bytes and are returned so the caller can
+    report them, instead of going into the game as '?'.
+    """
+    raw = data['raw']
+    out = bytearray()
+    failed = []
+    position = 0
+    for start, size, container, keys, original in data['spans']:
+        out += raw[position:start]
+        value = container
+        for key in keys:
+            value = value[key]
+        if value == original:
+            out += raw[start:start + size]
+        else:
+            try:
+                out += encodeString(value)
+            except UnicodeEncodeError:
+                out += raw[start:start + size]
+                failed.append(value)
+        position = start + size
+    out += raw[position:]
+    with open(path, 'wb') as outFile:
+        outFile.write(out)
+    return failed
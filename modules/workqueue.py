@@ -0,0 +1,103 @@
+# Libraries
+import collections, contextvars, os, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from modules.run import currentRun
+from modules.metrics import observe
+from modules.profiler import PROFILER
+from modules.tracing import TRACER
+
+#Globals
+PAGEPOOL = None
+POOLLOCK = threading.Lock()
+
+def submitBounded(executor, jobs, limit):
+    """
+    Submits every job in jobs to executor while keeping at most limit of them in flight.
+    Each job is a tuple of (function, *args). Futures are yielded as they complete so the
+    caller can apply results straight away instead of waiting on the slowest one in a group.
+    Jobs run in a copy of the caller's context so they report into the caller's run. Once
+    that run is cancelled nothing new is submitted and only the jobs in flight are drained.
+    A caller that stops early should close() the generator, see stopJobs.
+    """
+    if not isinstance(limit, int) or limit <= 0:
+        raise ValueError("limit must be a positive integer")
+
+    context = contextvars.copy_context()
+    run = currentRun()
+    pending = set()
+    try:
+        for job in jobs:
+            if run.cancelled():
+                break
+            pending.add(executor.submit(context.copy().run, waited, time.perf_counter(), *job))
+
+            # Queue is full, wait for a slot
+            if len(pending) >= limit:
+                with PROFILER.stage('wait'):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from done
+
+        # Drain
+        while pending:
+            with PROFILER.stage('wait'):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+    finally:
+        stopJobs(pending)
+
+def submitOrdered(executor, jobs, limit):
+    """
+    Like submitBounded, but yields [job, future] in the order the jobs came in. At most
+    limit jobs are in flight or finished and waiting for the ones before them, so a
+    caller writing results in order holds no more than limit of them at a time.
+    """
+    if not isinstance(limit, int) or limit <= 0:
+        raise ValueError("limit must be a positive integer")
+
+    context = contextvars.copy_context()
+    pending = collections.deque()
+    try:
+        for job in jobs:
+            pending.append([job, executor.submit(context.copy().run, waited, time.perf_counter(), *job)])
+            if len(pending) >= limit:
+                with PROFILER.stage('wait'):
+                    pending[0][1].exception()
+                yield pending.popleft()
+
+        while pending:
+            with PROFILER.stage('wait'):
+                pending[0][1].exception()
+            yield pending.popleft()
+    finally:
+        stopJobs([future for job, future in pending])
+
+def stopJobs(futures):
+    """
+    Runs when a caller stops reading early, usually returning on the first failed page.
+    Jobs that haven't started are cancelled and the running ones are waited for, so none
+    of them is still writing into the caller's data once it returns.
+    """
+    for future in futures:
+        future.cancel()
+    wait(futures)
+
+def waited(submitted, function, *args):
+    # Time spent in the executor's queue before a worker was free
+    observe('queue_wait_seconds', time.perf_counter() - submitted, queue='page')
+    with TRACER.span(function.__name__, 'page'):
+        return function(*args)
+
+def getPagePool():
+    """
+    Page level pool shared by every file in the run. It has a worker for each
+    fileThreads * threads slot so once the small files are done, idle workers
+    keep taking pages from the big files that are still running.
+    """
+    global PAGEPOOL
+    with POOLLOCK:
+        if PAGEPOOL is None:
+            PAGEPOOL = ThreadPoolExecutor(max_workers=poolSize())
+    return PAGEPOOL
+
+def poolSize():
+    return max(1, int(os.getenv('fileThreads', 1)) * int(os.getenv('threads', 1)))